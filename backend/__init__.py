@@ -1,17 +1,26 @@
 # pyright: reportMissingImports=false
 """
 Archivo principal de la aplicación Flask.
+
+Importar este paquete no carga TensorFlow ni SHAP; el modelo se carga
+al crear la aplicación (en segundo plano por defecto, ver MODEL_LOAD_MODE).
 """
 import os
 import logging
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
-from tensorflow.keras.models import load_model
 from dotenv import load_dotenv
 
 # Importar los dos tipos de lógica de análisis
-from .model.predict import load_model_resources, make_prediction
+from .model.predict import load_model_resources, make_prediction, get_batching_stats, get_cache_stats, get_shap_stats, get_shap_job
+from .model.explainers import TIERS as SHAP_TIERS
 from .blood_analyzer import analyze_blood_data
+from .batch_analysis import collect_batch_items, run_batch, to_ndjson
+from .upload_audit import UploadAuditor
+from .model_loader import ModelLoader, LOADING
+from . import telemetry
+from .telemetry import span
+from .profiling import RequestProfiler, PROFILE_HEADER, is_admin_token
 
 load_dotenv()
 
@@ -23,6 +32,24 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS_IMG = {'png', 'jpg', 'jpeg', 'dcm'}
 ALLOWED_EXTENSIONS_DATA = {'json', 'csv'} # Ampliamos para datos
 MODEL_PATH = 'backend/model/model.h5'
+# Las subidas se procesan en memoria; guardarlas en UPLOAD_FOLDER es opcional (auditoría)
+PERSIST_UPLOADS = os.getenv('PERSIST_UPLOADS', '0') == '1'
+UPLOAD_AUDIT_MAX_FILES = int(os.getenv('UPLOAD_AUDIT_MAX_FILES', '1000'))
+
+# 'background': el servidor responde de inmediato y el modelo se carga en un hilo aparte.
+# 'sync': create_app() no retorna hasta que el modelo está cargado.
+MODEL_LOAD_MODE = os.getenv('MODEL_LOAD_MODE', 'background')
+# Sockets Unix (separados por comas) de los servidores de modelo; si se definen, este
+# proceso no carga TensorFlow y delega inferencia y SHAP (ver backend/serving).
+MODEL_SERVER_SOCKETS = os.getenv('MODEL_SERVER_SOCKETS', '')
+# Segundos sugeridos al cliente (Retry-After) mientras el modelo se carga
+MODEL_LOADING_RETRY_AFTER = 5
+
+# Tiempo máximo (s) que el endpoint de estado SHAP mantiene abierta una petición (long-poll)
+SHAP_POLL_MAX_WAIT = 30.0
+
+# Endpoints con traza por etapas y métricas de petición (ver telemetry.py)
+TRACED_ENDPOINTS = {'analyze', 'analyze_batch'}
 
 # Nombres de las clases para el modelo de PIEL (antes pulmonar)
 CLASS_NAMES_SKIN = [
@@ -30,38 +57,165 @@ CLASS_NAMES_SKIN = [
     "Maligno"
 ]
 
+def load_skin_model():
+    """Carga el modelo de piel, su motor de inferencia y el explicador SHAP. Lanza excepción si falla."""
+    if MODEL_SERVER_SOCKETS:
+        # Modo multi-proceso: el modelo vive en el servidor de modelo (ver backend/serving)
+        from .serving.client import (ModelServerClient, RemoteEngine, RemoteExplainer, RemoteShapJobs,
+                                     RemoteResultCache)
+        client = ModelServerClient(MODEL_SERVER_SOCKETS)
+        info = client.wait_until_ready()
+        logging.info(f"Usando el servidor de modelo (versión {info.get('model_version')}, motor {info.get('engine')}).")
+        load_model_resources(None, info.get('class_names'), info.get('model_version'), RemoteEngine(client),
+                             shap_explainer=RemoteExplainer(client), job_manager=RemoteShapJobs(client),
+                             cache=RemoteResultCache(client))
+        return
+    logging.info("Cargando modelo de Keras para análisis de piel...")
+    from .model.model import load_trained_model, get_model_version
+    from .model.engines import load_inference_engine
+    skin_model, class_names = load_trained_model()
+    if skin_model is None:
+        raise ValueError("No se pudo cargar el modelo")
+    logging.info("Modelo de piel cargado. Inicializando recursos...")
+    if getattr(skin_model, 'stub', False):
+        # Modelo simulado (STUB_MODEL=1): sin motor convertido ni gradientes
+        from .model.stub import StubEngine, StubExplainer
+        load_model_resources(skin_model, class_names, get_model_version(), StubEngine(skin_model),
+                             shap_explainer=StubExplainer(skin_model))
+        return
+    inference_engine, engine_error = load_inference_engine(skin_model)
+    if engine_error:
+        logging.warning(f"{engine_error}. Se usará el modelo Keras.")
+    load_model_resources(skin_model, class_names, get_model_version(), inference_engine)
+
+def is_file_allowed(filename, analysis_type):
+    """Verifica si la extensión del archivo es válida para el tipo de análisis."""
+    if not '.' in filename:
+        return False
+    ext = filename.rsplit('.', 1)[1].lower()
+    if analysis_type == 'piel':
+        return ext in ALLOWED_EXTENSIONS_IMG
+    elif analysis_type == 'sangre':
+        return ext in ALLOWED_EXTENSIONS_DATA
+    return False
+
+def validate_analysis_request(files, form):
+    """
+    Valida los campos de una petición a /api/analyze (común a Flask y al modo ASGI).
+
+    Retorna:
+        Una tupla. En caso de éxito: ((file, analysis_type, shap_tier), None).
+        En caso de error: (None, error_message_string), que se responde con 400.
+    """
+    if 'file' not in files:
+        return None, "No se encontró el archivo."
+
+    file = files['file']
+    analysis_type = form.get('analysis_type')
+
+    if not analysis_type or analysis_type not in ['piel', 'sangre']:
+        return None, "Tipo de análisis no especificado o inválido."
+
+    if file.filename == '' or not is_file_allowed(file.filename, analysis_type):
+        return None, "Archivo no válido o tipo de archivo no permitido para este análisis."
+
+    # `shap_tier` ('coarse', 'fast' o 'full') elige el coste de la explicación
+    shap_tier = form.get('shap_tier')
+    if analysis_type == 'piel' and shap_tier and shap_tier not in SHAP_TIERS:
+        return None, f"Nivel SHAP no válido: {shap_tier}."
+    return (file, analysis_type, shap_tier), None
+
+def skin_model_unavailable(model_loader):
+    """(cuerpo, código, cabeceras) si el modelo de piel no puede atender peticiones; None si está listo."""
+    if model_loader.status == LOADING:
+        body = {"status": "error", "message": "El modelo de IA para piel se está cargando. Inténtelo de nuevo en unos segundos."}
+        return body, 503, {"Retry-After": str(MODEL_LOADING_RETRY_AFTER)}
+    if not model_loader.ready:
+        return {"status": "error", "message": "El modelo de IA para piel no está disponible."}, 500, {}
+    return None
+
+def analyze_blood_upload(filename, data):
+    """Análisis de sangre de un archivo subido (JSON o CSV, uno o varios pacientes). Retorna (cuerpo, código)."""
+    # Decodificar el contenido del archivo de texto/json
+    try:
+        content = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return {"status": "error", "message": "El archivo de datos no está codificado en UTF-8."}, 400
+    with span('blood_analysis'):
+        return analyze_blood_data(content, file_format=filename.rsplit('.', 1)[1].lower()), 200
+
+def register_metrics_collectors(model_loader):
+    """Métricas de /metrics que se leen de los contadores existentes al servir la petición."""
+    def collect():
+        batching = get_batching_stats() or {}
+        shap = get_shap_stats() or {}
+        cache = get_cache_stats() or {}
+        return [
+            ('auroia_model_ready', 'gauge', 'Modelo de piel cargado (1) o no (0).', int(model_loader.ready)),
+            ('auroia_model_load_seconds', 'gauge', 'Duración de la carga del modelo de piel.', model_loader.load_seconds),
+            ('auroia_inference_batches_total', 'counter', 'Forward passes del planificador de micro-lotes.',
+             batching.get('batches')),
+            ('auroia_inference_items_total', 'counter', 'Imágenes inferidas por el planificador de micro-lotes.',
+             batching.get('items')),
+            ('auroia_inference_queue_depth', 'gauge', 'Peticiones a la espera de un micro-lote.',
+             batching.get('queue_depth')),
+            ('auroia_shap_jobs_pending', 'gauge', 'Trabajos SHAP encolados o en ejecución.', shap.get('pending')),
+            ('auroia_result_cache_lookups_total', 'counter', 'Consultas a la caché de resultados por resultado.',
+             {(('result', key),): cache[key] for key in ('memory_hits', 'disk_hits', 'misses') if key in cache}
+             or None),
+            ('auroia_result_cache_puts_total', 'counter', 'Escrituras en la caché de resultados.', cache.get('puts')),
+            ('auroia_result_cache_evictions_total', 'counter', 'Entradas expulsadas de la caché de resultados por nivel.',
+             {(('tier', tier),): cache[f'{tier}_evictions'] for tier in ('memory', 'disk') if f'{tier}_evictions' in cache}
+             or None),
+            ('auroia_result_cache_items', 'gauge', 'Entradas de la caché de resultados por nivel.',
+             {(('tier', tier),): cache[f'{tier}_items'] for tier in ('memory', 'disk') if f'{tier}_items' in cache}
+             or None),
+            ('auroia_result_cache_disk_bytes', 'gauge', 'Bytes ocupados por la caché de resultados en disco.',
+             cache.get('disk_bytes')),
+        ]
+    telemetry.add_collector(collect)
+
 def create_app():
     """Crea y configura una instancia de la aplicación Flask."""
     app = Flask(__name__, static_folder='../static', template_folder='../src')
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key_for_development') # Cambiar en producción
 
-    # Crear el directorio de subidas si no existe
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Auditoría opcional de subidas (crea el directorio de subidas si no existe)
+    upload_auditor = UploadAuditor(app.config['UPLOAD_FOLDER'], UPLOAD_AUDIT_MAX_FILES) if PERSIST_UPLOADS else None
 
     # --- Carga del Modelo de Imagen al iniciar ---
-    try:
-        logging.info("Cargando modelo de Keras para análisis de piel...")
-        from .model.model import load_trained_model
-        skin_model, class_names = load_trained_model()
-        if skin_model is None:
-            raise ValueError("No se pudo cargar el modelo")
-        logging.info("Modelo de piel cargado. Inicializando recursos...")
-        load_model_resources(skin_model, class_names)
-    except Exception as e:
-        logging.error(f"Error fatal al cargar el modelo de piel: {e}")
-        skin_model = None
-
-    def is_file_allowed(filename, analysis_type):
-        """Verifica si la extensión del archivo es válida para el tipo de análisis."""
-        if not '.' in filename:
-            return False
-        ext = filename.rsplit('.', 1)[1].lower()
-        if analysis_type == 'piel':
-            return ext in ALLOWED_EXTENSIONS_IMG
-        elif analysis_type == 'sangre':
-            return ext in ALLOWED_EXTENSIONS_DATA
-        return False
+    model_loader = ModelLoader(load_skin_model)
+    if MODEL_LOAD_MODE == 'sync':
+        model_loader.load()
+    else:
+        model_loader.start()
+
+    register_metrics_collectors(model_loader)
+    # Perfilado opcional de las peticiones lentas (ver profiling.py)
+    profiler = RequestProfiler()
+    # Estado compartido con el modo de servicio asíncrono (ver asgi.py)
+    app.extensions['auroia'] = {"model_loader": model_loader, "upload_auditor": upload_auditor, "profiler": profiler}
+
+    @app.before_request
+    def begin_trace():
+        if request.endpoint in TRACED_ENDPOINTS:
+            g.telemetry = telemetry.begin_request(request.endpoint)
+
+    @app.after_request
+    def record_status(response):
+        if 'telemetry' in g:
+            g.telemetry_code = response.status_code
+        return response
+
+    @app.teardown_request
+    def end_trace(error=None):
+        context = g.pop('telemetry', None)
+        if context is not None:
+            code = g.pop('telemetry_code', 500)
+            # Sólo valores conocidos como etiqueta, para no crear una serie por cada valor recibido
+            analysis_type = request.form.get('analysis_type')
+            telemetry.end_request(context, code, analysis_type if analysis_type in ('piel', 'sangre') else None)
 
     # --- Rutas de la Aplicación ---
     @app.route('/')
@@ -77,46 +231,151 @@ def create_app():
         # Renderiza la plantilla del informe detallado (se esperan parámetros en la query string)
         return render_template('shap_report.html')
 
+    @app.route('/healthz')
+    def healthz():
+        """Sonda de vida: el proceso responde aunque el modelo aún se esté cargando."""
+        return jsonify({"status": "ok"})
+
+    @app.route('/readyz')
+    def readyz():
+        """Sonda de disponibilidad: 200 sólo cuando el modelo de piel está cargado."""
+        body = {"status": "ready" if model_loader.ready else "not_ready", "model": model_loader.describe()}
+        return jsonify(body), (200 if model_loader.ready else 503)
+
+    @app.route('/api/stats')
+    def stats():
+        """Métricas de servicio (llenado de lotes de inferencia, cola SHAP y caché de resultados)."""
+        return jsonify({"status": "success", "batching": get_batching_stats(), "shap": get_shap_stats(),
+                        "cache": get_cache_stats()})
+
+    @app.route('/metrics')
+    def metrics():
+        """Métricas en formato de exposición de texto de Prometheus."""
+        return Response(telemetry.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/admin/profiles')
+    def list_profiles():
+        """Perfiles guardados de peticiones lentas (requiere la cabecera X-Admin-Token)."""
+        if not is_admin_token(request.headers.get('X-Admin-Token')):
+            return jsonify({"status": "error", "message": "No encontrado."}), 404
+        return jsonify({"status": "success", "profiles": profiler.store.list()})
+
+    @app.route('/admin/profiles/<path:name>')
+    def download_profile(name):
+        """Descarga un archivo de perfil (un nombre de la lista `files` de /admin/profiles)."""
+        if not is_admin_token(request.headers.get('X-Admin-Token')):
+            return jsonify({"status": "error", "message": "No encontrado."}), 404
+        if name.endswith('.json') or not os.path.isfile(profiler.store.path(secure_filename(name))):
+            return jsonify({"status": "error", "message": "Perfil no encontrado."}), 404
+        return send_from_directory(os.path.abspath(profiler.store.directory), secure_filename(name),
+                                   as_attachment=True)
+
+    @app.route('/api/shap/<job_id>')
+    def shap_job_status(job_id):
+        """Estado de una explicación SHAP asíncrona. Acepta `?wait=<s>` para long-polling."""
+        try:
+            wait = min(float(request.args.get('wait', 0)), SHAP_POLL_MAX_WAIT)
+        except ValueError:
+            wait = 0.0
+        job = get_shap_job(job_id, wait=wait)
+        if job is None:
+            return jsonify({"status": "error", "message": "Trabajo SHAP no encontrado."}), 404
+        return jsonify({"status": "success", "job": job})
+
     @app.route('/api/analyze', methods=['POST']) # type: ignore
     def analyze():
         """Endpoint unificado para manejar todos los tipos de análisis."""
         # 1. Validar la solicitud
-        if 'file' not in request.files:
-            return jsonify({"status": "error", "message": "No se encontró el archivo."}), 400
-        
-        file = request.files['file']
-        analysis_type = request.form.get('analysis_type')
-
-        if not analysis_type or analysis_type not in ['piel', 'sangre']:
-            return jsonify({"status": "error", "message": "Tipo de análisis no especificado o inválido."}), 400
-            
-        if file.filename == '' or not is_file_allowed(file.filename, analysis_type):
-            return jsonify({"status": "error", "message": "Archivo no válido o tipo de archivo no permitido para este análisis."}), 400
-
-        # 2. Procesar según el tipo de análisis
+        fields, error = validate_analysis_request(request.files, request.form)
+        if error:
+            return jsonify({"status": "error", "message": error}), 400
+        file, analysis_type, shap_tier = fields
+
+        # 2. Leer la subida en memoria (sin pasar por disco) y procesar según el tipo de análisis
         filename = secure_filename(file.filename) # type: ignore
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        logging.info(f"Archivo guardado en: {filepath} para análisis de tipo: {analysis_type}")
+        with span('upload_save'):
+            data = file.read()
+            if upload_auditor is not None:
+                upload_auditor.submit(filename, data)
+        logging.info(f"Archivo recibido: {filename} ({len(data)} bytes) para análisis de tipo: {analysis_type}")
 
         try:
             if analysis_type == 'piel':
-                if skin_model is None:
-                     return jsonify({"status": "error", "message": "El modelo de IA para piel no está disponible."}), 500
+                unavailable = skin_model_unavailable(model_loader)
+                if unavailable:
+                    body, code, headers = unavailable
+                    return jsonify(body), code, headers
                 # Llamar a la lógica de predicción de imágenes
-                prediction_result = make_prediction(filepath)
-                return jsonify(prediction_result)
+                # `shap_async` permite al cliente forzar el modo síncrono ('0') o asíncrono ('1')
+                shap_async = request.form.get('shap_async')
+                with profiler.profile(request.headers.get(PROFILE_HEADER), image_name=filename,
+                                      shap_async=shap_async, shap_tier=shap_tier) as profile:
+                    # Un perfil sólo captura este hilo: sin micro-lotes y con SHAP síncrono
+                    async_shap = False if profile["active"] else (None if shap_async is None else shap_async == '1')
+                    prediction_result = make_prediction(data, async_shap=async_shap, image_name=filename,
+                                                        shap_tier=shap_tier, batched=not profile["active"])
+                with span('serialize'):
+                    response = jsonify(prediction_result)
+                if profile.get("profile_id"):
+                    response.headers['X-Profile-Id'] = profile["profile_id"]
+                return response
 
             elif analysis_type == 'sangre':
-                # Leer el contenido del archivo de texto/json
-                with open(filepath, 'r') as f:
-                    content = f.read()
-                # Llamar a la nueva lógica de análisis de sangre
-                analysis_result = analyze_blood_data(content)
-                return jsonify(analysis_result)
+                # Llamar a la nueva lógica de análisis de sangre (JSON o CSV, uno o varios pacientes)
+                analysis_result, code = analyze_blood_upload(filename, data)
+                with span('serialize'):
+                    return jsonify(analysis_result), code
 
         except Exception as e:
             logging.error(f"Error durante el análisis del archivo {filename}: {e}")
             return jsonify({"status": "error", "message": f"Error interno del servidor: {e}"}), 500
 
+    @app.route('/api/analyze/batch', methods=['POST'])
+    def analyze_batch():
+        """
+        Análisis por lotes: varios archivos en el campo `files` (o `file`), o un .zip con ellos.
+        El tipo de cada archivo se deduce por su extensión. Responde en NDJSON, una línea por
+        imagen o fila de informe en cuanto está lista, y una línea final de resumen.
+        """
+        files = request.files.getlist('files') + request.files.getlist('file')
+        files = [f for f in files if f.filename]
+        if not files:
+            return jsonify({"status": "error", "message": "No se encontraron archivos."}), 400
+
+        uploads = []
+        for file in files:
+            filename = secure_filename(file.filename) # type: ignore
+            data = file.read()
+            if upload_auditor is not None:
+                upload_auditor.submit(filename, data)
+            uploads.append((filename, data))
+
+        items, error = collect_batch_items(uploads, ALLOWED_EXTENSIONS_IMG, ALLOWED_EXTENSIONS_DATA)
+        if error:
+            return jsonify({"status": "error", "message": error}), 400
+        images, reports = items
+        if not images and not reports:
+            return jsonify({"status": "error", "message": "El lote no contiene archivos con extensiones permitidas."}), 400
+        logging.info(f"Lote recibido: {len(images)} imágenes y {len(reports)} informes de sangre")
+
+        if images:
+            unavailable = skin_model_unavailable(model_loader)
+            if unavailable:
+                body, code, headers = unavailable
+                return jsonify(body), code, headers
+
+        # SHAP es opcional en lotes (`explain=1`): las imágenes de cada lote de inferencia se
+        # explican juntas en un trabajo asíncrono (un trabajo SHAP por imagen)
+        explain = request.form.get('explain') == '1'
+        shap_tier = request.form.get('shap_tier')
+        if shap_tier and shap_tier not in SHAP_TIERS:
+            return jsonify({"status": "error", "message": f"Nivel SHAP no válido: {shap_tier}."}), 400
+        results = run_batch(images, reports, explain=explain, shap_tier=shap_tier)
+        # La petición se da por terminada cuando se ha enviado la última línea, no al enviar las cabeceras
+        context = g.pop('telemetry', None)
+        if context is not None:
+            results = telemetry.end_request_after(context, results, 200, 'lote')
+        return Response(stream_with_context(to_ndjson(results)),
+                        mimetype='application/x-ndjson')
+
     return app
\ No newline at end of file
@@ -0,0 +1,382 @@
+"""
+Modo de servicio asíncrono (ASGI) para /api/analyze.
+
+    uvicorn --factory backend.asgi:create_asgi_app --host 0.0.0.0 --port 8080
+
+El bucle de eventos recibe las subidas sin ocupar un hilo por petición, y el
+trabajo de CPU se reparte en dos carriles acotados:
+
+- `inference`: predicción con la explicación SHAP en segundo plano (por defecto,
+  ver SHAP_ASYNC). Hasta ASYNC_INFERENCE_WORKERS llamadas a TensorFlow a la vez y
+  ASYNC_INFERENCE_QUEUE esperando.
+- `shap`: peticiones con `shap_async=0`, que calculan SHAP dentro de la petición.
+  Hasta ASYNC_SHAP_WORKERS a la vez y ASYNC_SHAP_QUEUE esperando.
+
+Con el carril lleno la petición se rechaza en el acto con 429 y un Retry-After
+estimado a partir del tiempo de servicio reciente, en lugar de encolarse y hacer
+crecer la latencia de todas las demás. Lo mismo ocurre si la cola de trabajos SHAP
+en segundo plano supera ASYNC_SHAP_MAX_PENDING. Mientras el modelo se carga la
+respuesta sigue siendo 503.
+
+El resto de rutas (frontend, /api/analyze/batch, /api/shap, /metrics, ...) se
+delegan en la aplicación Flask a través de un puente WSGI que la ejecuta en su
+propio pool de hilos y reenvía la respuesta por trozos (el NDJSON de los lotes
+sigue llegando en streaming).
+"""
+import io
+import os
+import sys
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wrappers import Request
+from werkzeug.utils import secure_filename
+
+from . import create_app, validate_analysis_request, skin_model_unavailable, analyze_blood_upload
+from .model.predict import make_prediction, get_shap_stats, SHAP_ASYNC
+from .profiling import PROFILE_HEADER
+from .telemetry import begin_request, end_request, span, add_collector
+
+# Carril de inferencia (SHAP en segundo plano): hilos y peticiones en espera
+ASYNC_INFERENCE_WORKERS = int(os.getenv('ASYNC_INFERENCE_WORKERS', '4'))
+ASYNC_INFERENCE_QUEUE = int(os.getenv('ASYNC_INFERENCE_QUEUE', '16'))
+# Carril de SHAP síncrono (`shap_async=0`): hilos y peticiones en espera
+ASYNC_SHAP_WORKERS = int(os.getenv('ASYNC_SHAP_WORKERS', '1'))
+ASYNC_SHAP_QUEUE = int(os.getenv('ASYNC_SHAP_QUEUE', '4'))
+# Trabajos SHAP en segundo plano pendientes a partir de los cuales se rechaza (0 = sin límite)
+ASYNC_SHAP_MAX_PENDING = int(os.getenv('ASYNC_SHAP_MAX_PENDING', '32'))
+# Tamaño máximo del cuerpo de /api/analyze
+ASYNC_MAX_UPLOAD_MB = float(os.getenv('ASYNC_MAX_UPLOAD_MB', '20'))
+# Hilos del puente WSGI (las consultas de /api/shap esperan hasta 30 s cada una)
+ASYNC_WSGI_WORKERS = int(os.getenv('ASYNC_WSGI_WORKERS', '32'))
+# Límites del Retry-After de las respuestas 429 (s)
+ASYNC_RETRY_AFTER_MAX = 30
+SHAP_BACKLOG_RETRY_AFTER = 10
+
+# Peso de la última medida en la media móvil del tiempo de servicio
+SERVICE_TIME_ALPHA = 0.2
+
+
+class BoundedExecutor:
+    """
+    Pool de hilos con capacidad fija (hilos + cola): `try_submit` devuelve None en
+    lugar de encolar cuando está lleno.
+    """
+
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.workers = max(1, workers)
+        self.capacity = self.workers + max(0, queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'async-{name}')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._service_time = None
+        self.completed = 0
+        self.rejected = 0
+
+    def try_submit(self, fn, *args, **kwargs):
+        """Ejecuta `fn` en el pool (con el contexto actual, para las trazas) o None si está lleno."""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                return None
+            self._in_flight += 1
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, self._run, fn, args, kwargs)
+
+    def retry_after(self):
+        """Segundos estimados hasta que se vacíe la cola actual."""
+        with self._lock:
+            in_flight, service_time = self._in_flight, self._service_time or 1.0
+        seconds = math.ceil(in_flight / self.workers * service_time)
+        return min(max(1, seconds), ASYNC_RETRY_AFTER_MAX)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self._in_flight, "capacity": self.capacity, "workers": self.workers,
+                    "completed": self.completed, "rejected": self.rejected,
+                    "service_time_ms": None if self._service_time is None else self._service_time * 1000.0}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._in_flight -= 1
+                self.completed += 1
+                if self._service_time is None:
+                    self._service_time = elapsed
+                else:
+                    self._service_time += SERVICE_TIME_ALPHA * (elapsed - self._service_time)
+
+
+async def read_body(scope, receive, limit=None):
+    """
+    Lee el cuerpo completo de la petición.
+
+    Retorna:
+        Una tupla. En caso de éxito: (bytes, None).
+        En caso de error: (None, 'too_large') o (None, 'disconnect').
+    """
+    if limit is not None:
+        for name, value in scope['headers']:
+            if name == b'content-length' and value.isdigit() and int(value) > limit:
+                return None, 'too_large'
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None, 'disconnect'
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None, 'too_large'
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks), None
+
+
+def build_environ(scope, body):
+    """Entorno WSGI equivalente a la petición ASGI `scope` con el cuerpo ya leído."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-length':
+            continue
+        key = 'CONTENT_TYPE' if name == 'content-type' else 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_response(send, code, body, content_type='application/json', headers=None):
+    """Envía una respuesta completa (`body` en bytes)."""
+    raw_headers = [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1'))]
+    raw_headers += [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in (headers or {}).items()]
+    await send({'type': 'http.response.start', 'status': code, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class WsgiBridge:
+    """Ejecuta una aplicación WSGI en un pool de hilos y reenvía su respuesta por trozos."""
+
+    def __init__(self, wsgi_app, workers=ASYNC_WSGI_WORKERS):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-wsgi')
+
+    async def __call__(self, scope, receive, send):
+        body, error = await read_body(scope, receive)
+        if error:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._run, build_environ(scope, body), send, loop)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, environ, send, loop):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                emit({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in iterable:
+                start()
+                if chunk:
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            start()
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+
+class AsyncAnalyzeApp:
+    """Aplicación ASGI: /api/analyze nativo y con control de admisión; el resto, Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        state = flask_app.extensions['auroia']
+        self.model_loader = state['model_loader']
+        self.upload_auditor = state['upload_auditor']
+        self.profiler = state['profiler']
+        self.inference = BoundedExecutor('inference', ASYNC_INFERENCE_WORKERS, ASYNC_INFERENCE_QUEUE)
+        self.shap = BoundedExecutor('shap', ASYNC_SHAP_WORKERS, ASYNC_SHAP_QUEUE)
+        self.shap_backlog_rejected = 0
+        self.wsgi = WsgiBridge(flask_app)
+        add_collector(self._collect_metrics)
+        logging.info(f"Modo asíncrono: carril de inferencia {self.inference.workers}+{ASYNC_INFERENCE_QUEUE}, "
+                     f"carril SHAP {self.shap.workers}+{ASYNC_SHAP_QUEUE}")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] != 'http':
+            return
+        elif scope['path'] == '/api/analyze' and scope['method'] == 'POST':
+            await self._analyze(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    def shutdown(self):
+        self.inference.shutdown()
+        self.shap.shutdown()
+        self.wsgi.shutdown()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _analyze(self, scope, receive, send):
+        """Equivalente asíncrono de la ruta /api/analyze de Flask."""
+        telemetry = begin_request('analyze')
+        code, analysis_type = 500, None
+        try:
+            try:
+                result, analysis_type = await self._analyze_response(scope, receive)
+            except Exception as e:
+                logging.error(f"Error durante el análisis: {e}")
+                result = {"status": "error", "message": f"Error interno del servidor: {e}"}, 500, {}
+            if result is None:
+                # El cliente se desconectó antes de terminar de enviar el archivo
+                code = 499
+                return
+            body, code, headers = result
+            with span('serialize'):
+                payload = self.flask_app.json.response(body).get_data()
+            await send_response(send, code, payload, headers=headers)
+        finally:
+            end_request(telemetry, code, analysis_type)
+
+    async def _analyze_response(self, scope, receive):
+        """
+        Retorna:
+            Una tupla ((cuerpo, código, cabeceras), tipo de análisis), o (None, None) si
+            el cliente se desconectó.
+        """
+        data, error = await read_body(scope, receive, int(ASYNC_MAX_UPLOAD_MB * 1024 * 1024))
+        if error == 'disconnect':
+            return None, None
+        if error == 'too_large':
+            return ({"status": "error", "message": f"El archivo supera el máximo de {ASYNC_MAX_UPLOAD_MB:g} MB."}, 413, {}), None
+
+        # 1. Validar la solicitud (el análisis del multipart se hace fuera del bucle de eventos)
+        request = Request(build_environ(scope, data))
+        fields, error = await asyncio.to_thread(lambda: validate_analysis_request(request.files, request.form))
+        if error:
+            return ({"status": "error", "message": error}, 400, {}), None
+        file, analysis_type, shap_tier = fields
+
+        # 2. Leer la subida y procesar según el tipo de análisis
+        filename = secure_filename(file.filename) # type: ignore
+        with span('upload_save'):
+            data = file.read()
+            if self.upload_auditor is not None:
+                self.upload_auditor.submit(filename, data)
+        logging.info(f"Archivo recibido: {filename} ({len(data)} bytes) para análisis de tipo: {analysis_type}")
+
+        if analysis_type == 'sangre':
+            body, code = await asyncio.to_thread(analyze_blood_upload, filename, data)
+            return (body, code, {}), analysis_type
+
+        unavailable = skin_model_unavailable(self.model_loader)
+        if unavailable:
+            return unavailable, analysis_type
+
+        # 3. Control de admisión: con el carril (o la cola SHAP de fondo) lleno se rechaza ya
+        shap_async = request.form.get('shap_async')
+        async_shap = SHAP_ASYNC if shap_async is None else shap_async == '1'
+        if async_shap and ASYNC_SHAP_MAX_PENDING:
+            pending = (get_shap_stats() or {}).get("pending", 0)
+            if pending >= ASYNC_SHAP_MAX_PENDING:
+                self.shap_backlog_rejected += 1
+                return self._overloaded(SHAP_BACKLOG_RETRY_AFTER), analysis_type
+        lane = self.inference if async_shap else self.shap
+        future = lane.try_submit(self._predict, data, filename, async_shap, shap_async, shap_tier,
+                                 request.headers.get(PROFILE_HEADER))
+        if future is None:
+            return self._overloaded(lane.retry_after()), analysis_type
+        prediction_result, profile_id = await asyncio.wrap_future(future)
+        headers = {"X-Profile-Id": profile_id} if profile_id else {}
+        return (prediction_result, 200, headers), analysis_type
+
+    def _predict(self, data, filename, async_shap, shap_async, shap_tier, profile_header):
+        """Predicción en un hilo del carril; retorna (resultado, id del perfil o None)."""
+        with self.profiler.profile(profile_header, image_name=filename, shap_async=shap_async,
+                                   shap_tier=shap_tier) as profile:
+            # Un perfil sólo captura este hilo: sin micro-lotes y con SHAP síncrono
+            prediction_result = make_prediction(data, async_shap=False if profile["active"] else async_shap,
+                                                image_name=filename, shap_tier=shap_tier,
+                                                batched=not profile["active"])
+        return prediction_result, profile.get("profile_id")
+
+    def _overloaded(self, retry_after):
+        body = {"status": "error", "message": "El servidor está saturado. Inténtelo de nuevo en unos segundos."}
+        return body, 429, {"Retry-After": str(retry_after)}
+
+    def _collect_metrics(self):
+        lanes = [(lane.name, lane.stats()) for lane in (self.inference, self.shap)]
+        rejected = {(("lane", name),): stats["rejected"] for name, stats in lanes}
+        rejected[(("lane", "shap_backlog"),)] = self.shap_backlog_rejected
+        return [
+            ("auroia_async_lane_in_flight", "gauge", "Peticiones en ejecución o en espera por carril del modo asíncrono.",
+             {(("lane", name),): stats["in_flight"] for name, stats in lanes}),
+            ("auroia_async_lane_capacity", "gauge", "Capacidad (hilos + cola) de cada carril del modo asíncrono.",
+             {(("lane", name),): stats["capacity"] for name, stats in lanes}),
+            ("auroia_async_rejected_total", "counter", "Peticiones rechazadas con 429 por carril lleno.", rejected),
+        ]
+
+
+def create_asgi_app():
+    """Fábrica para `uvicorn --factory backend.asgi:create_asgi_app`."""
+    return AsyncAnalyzeApp(create_app())
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(create_asgi_app(), host='0.0.0.0', port=int(os.environ.get("PORT", 8080)))
@@ -0,0 +1,111 @@
+"""
+Análisis por lotes: muchas imágenes de piel y/o informes de sangre en una sola petición.
+
+Las subidas (archivos sueltos o un .zip con ellos) se clasifican por extensión. Las
+imágenes se preprocesan en paralelo y pasan por el modelo en lotes completos
+(ver `predict_images`); los informes de sangre (CSV o array JSON) se
+analizan por columnas. Cada resultado se emite como una línea NDJSON en cuanto está listo.
+"""
+import io
+import os
+import json
+import zipfile
+import logging
+
+from .model.predict import predict_images
+from .blood_analyzer import load_blood_frame, analyze_blood_frame
+
+# Límites de una petición por lotes (archivos tras descomprimir y bytes descomprimidos)
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '500'))
+BATCH_MAX_UNCOMPRESSED_MB = float(os.getenv('BATCH_MAX_UNCOMPRESSED_MB', '512'))
+
+
+def _extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+
+
+def collect_batch_items(uploads, image_extensions, data_extensions):
+    """
+    Expande los .zip y clasifica las subidas. `uploads` es una lista de (nombre, bytes).
+    Devuelve ((imágenes, informes), error); cada elemento es (nombre, extensión, bytes).
+    Los archivos con extensiones no admitidas se ignoran.
+    """
+    images, reports = [], []
+    total_bytes = 0
+    max_bytes = BATCH_MAX_UNCOMPRESSED_MB * 1024 * 1024
+
+    def _add(name, data):
+        ext = _extension(name)
+        if ext in image_extensions:
+            images.append((name, ext, data))
+        elif ext in data_extensions:
+            reports.append((name, ext, data))
+
+    for filename, data in uploads:
+        if _extension(filename) != 'zip':
+            total_bytes += len(data)
+            _add(filename, data)
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    base = os.path.basename(info.filename)
+                    # Directorios, ocultos y metadatos de macOS (__MACOSX/._*) no son análisis
+                    if info.is_dir() or not base or base.startswith('.'):
+                        continue
+                    total_bytes += info.file_size
+                    if total_bytes > max_bytes:
+                        return None, f"El contenido descomprimido supera {BATCH_MAX_UNCOMPRESSED_MB:g} MB."
+                    _add(info.filename, archive.read(info))
+        except zipfile.BadZipFile:
+            return None, f"El archivo {filename} no es un zip válido."
+
+    if total_bytes > max_bytes:
+        return None, f"El contenido descomprimido supera {BATCH_MAX_UNCOMPRESSED_MB:g} MB."
+    if len(images) + len(reports) > BATCH_MAX_FILES:
+        return None, f"Se admiten como máximo {BATCH_MAX_FILES} archivos por lote."
+    return (images, reports), None
+
+
+def _analyze_reports(reports):
+    """Analiza cada informe de sangre (todas sus filas a la vez) y produce un resultado por paciente."""
+    for name, ext, data in reports:
+        try:
+            content = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            yield {"file": name, "analysis_type": "sangre", "status": "error",
+                   "message": "El archivo de datos no está codificado en UTF-8."}
+            continue
+        frame, error = load_blood_frame(content, file_format=ext)
+        if error:
+            yield {"file": name, "analysis_type": "sangre", "status": "error", "message": error}
+            continue
+        for row, result in enumerate(analyze_blood_frame(frame)):
+            yield dict(result, file=name, row=row)
+
+
+def run_batch(images, reports, explain=False, shap_tier=None):
+    """
+    Generador con un resultado por imagen y por fila de informe, y un resumen final
+    (`"summary": true`). Cada resultado lleva `file` para identificarlo en el lote.
+    """
+    counts = {"success": 0, "error": 0}
+
+    for result in _analyze_reports(reports):
+        counts["success" if result.get("status") == "success" else "error"] += 1
+        yield result
+
+    if images:
+        sources = [(name, data) for name, _, data in images]
+        for name, result in predict_images(sources, explain=explain, shap_tier=shap_tier):
+            counts["success" if result.get("status") == "success" else "error"] += 1
+            yield dict(result, file=name, analysis_type="piel")
+
+    logging.info(f"Lote completado: {counts['success']} correctos, {counts['error']} con error")
+    yield {"status": "done", "summary": True, "images": len(images), "reports": len(reports), **counts}
+
+
+def to_ndjson(results):
+    """Serializa cada resultado como una línea JSON."""
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
@@ -1,8 +1,13 @@
 """
 Modulo para el analisis de datos de sangre y prediccion de enfermedades futuras.
 """
-import random
+import io
+import os
 import json
+import threading
+import numpy as np
+
+from .rule_engine import RuleSet
 
 # Base de conocimiento simple para la interpretacion de analisis de sangre
 # En un caso real, esto vendria de una base de datos o una fuente mas robusta.
@@ -15,13 +20,12 @@ KNOWLEDGE_BASE = {
     'bacteria_presence': {'range': (0, 0), 'unit': ''} # 0 = Ausente, 1 = Presente
 }
 
-DISEASE_PATTERNS = {
-    "Anemia": lambda d: d['hemoglobin'] < KNOWLEDGE_BASE['hemoglobin']['range'][0],
-    "Infeccion Bacteriana": lambda d: d['white_blood_cells'] > KNOWLEDGE_BASE['white_blood_cells']['range'][1] or d.get('bacteria_presence', 0) == 1,
-    "Riesgo de Trombosis": lambda d: d['platelets'] > KNOWLEDGE_BASE['platelets']['range'][1],
-    "Pre-diabetes": lambda d: d['glucose'] > 100 and d['glucose'] <= 125,
-    "Posible Diabetes": lambda d: d['glucose'] > 125
-}
+# Reglas de diagnostico: archivo declarativo compilado en un plan de evaluacion por
+# columnas (ver rule_engine.py). Los cambios en el archivo se aplican sin reiniciar.
+BLOOD_RULES_PATH = os.getenv('BLOOD_RULES_PATH', os.path.join(os.path.dirname(__file__), 'blood_rules.json'))
+BLOOD_RULES_CHECK_INTERVAL = float(os.getenv('BLOOD_RULES_CHECK_INTERVAL', '2'))
+BLOOD_RULES = RuleSet(BLOOD_RULES_PATH, {key: spec['range'] for key, spec in KNOWLEDGE_BASE.items()},
+                      check_interval=BLOOD_RULES_CHECK_INTERVAL)
 
 # Modelo de Transicion de Estados (Simulacion de Cadenas de Markov)
 # (Estado Actual) -> [(Estado Futuro, Probabilidad), ...]
@@ -34,65 +38,186 @@ MARKOV_TRANSITIONS = {
     'Riesgo de Trombosis': [('Riesgo de Trombosis', 0.85), ('Normal', 0.15)],
 }
 
-def analyze_blood_data(file_content):
+# Horizontes (en años) de las proyecciones futuras; el de 1 año siempre se incluye
+PROJECTION_HORIZONS = sorted({1, *(int(h) for h in os.getenv('BLOOD_PROJECTION_HORIZONS', '1,5,10').split(',') if h.strip())})
+
+class MarkovChain:
+    """
+    Cadena de Markov compilada a partir de MARKOV_TRANSITIONS: matriz de transicion
+    densa con un indice de estados, y potencias de la matriz en cache por horizonte.
+    Las distribuciones son filas, asi que proyectar muchos pacientes a la vez es una
+    sola multiplicacion (pacientes x estados) @ P^h.
+    """
+
+    def __init__(self, transitions):
+        states = list(transitions)
+        for outcomes in transitions.values():
+            states.extend(s for s, _ in outcomes if s not in states)
+        self.states = states
+        self.index = {state: i for i, state in enumerate(states)}
+
+        # Los estados sin transiciones definidas son absorbentes
+        matrix = np.eye(len(states))
+        for state, outcomes in transitions.items():
+            row = np.zeros(len(states))
+            for target, probability in outcomes:
+                row[self.index[target]] += probability
+            if not np.isclose(row.sum(), 1.0):
+                raise ValueError(f"Las transiciones desde '{state}' suman {row.sum():.4f}, no 1.")
+            matrix[self.index[state]] = row
+        self.matrix = matrix
+        self._powers = {0: np.eye(len(states)), 1: matrix}
+        self._lock = threading.Lock()
+
+    def power(self, horizon):
+        """P^horizon, calculada a partir de la mayor potencia ya en cache."""
+        with self._lock:
+            cached = self._powers.get(horizon)
+            if cached is None:
+                base = max(h for h in self._powers if h <= horizon)
+                cached = self._powers[base] @ np.linalg.matrix_power(self.matrix, horizon - base)
+                self._powers[horizon] = cached
+            return cached
+
+    def initial_distribution(self, diagnoses_per_patient):
+        """
+        Distribucion inicial (pacientes x estados): mezcla uniforme de todos los
+        diagnosticos actuales de cada paciente; sin diagnosticos conocidos, 'Normal'.
+        """
+        initial = np.zeros((len(diagnoses_per_patient), len(self.states)))
+        for row, diagnoses in enumerate(diagnoses_per_patient):
+            known = [self.index[d] for d in diagnoses if d in self.index] or [self.index['Normal']]
+            initial[row, known] = 1.0 / len(known)
+        return initial
+
+    def project(self, initial, horizon):
+        """Distribuciones tras `horizon` pasos para todas las filas de `initial` a la vez."""
+        return initial @ self.power(horizon)
+
+    def describe(self, distribution, min_probability=1e-4):
+        """Lista [{'state', 'probability'}] ordenada de mayor a menor probabilidad."""
+        order = np.argsort(-distribution, kind='stable')
+        return [{"state": self.states[i], "probability": round(float(distribution[i]), 4)}
+                for i in order if distribution[i] >= min_probability]
+
+MARKOV_CHAIN = MarkovChain(MARKOV_TRANSITIONS)
+
+def load_blood_frame(file_content, file_format='json'):
+    """
+    Carga uno o varios analisis de sangre en una tabla (una fila por paciente y una
+    columna por marcador de KNOWLEDGE_BASE o de las reglas). Acepta un objeto JSON, un array JSON de
+    objetos o un CSV con una columna por marcador. Devuelve (DataFrame, error).
+
+    Los valores se conservan tal como llegaron (para mostrarlos igual en el informe);
+    `analyze_blood_frame` los convierte a numero. Los marcadores ausentes quedan vacios.
     """
-    Analiza los datos de un archivo de analisis de sangre (JSON) y devuelve un informe estructurado.
+    import pandas as pd
+
+    # Marcadores del informe y los que usan las reglas de diagnostico
+    columns = list(KNOWLEDGE_BASE) + [f for f in BLOOD_RULES.plan().fields if f not in KNOWLEDGE_BASE]
+    if file_format == 'csv':
+        try:
+            frame = pd.read_csv(io.StringIO(file_content), dtype=str, skipinitialspace=True)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            return None, f"El archivo CSV no es válido: {e}"
+        frame.columns = [str(c).strip() for c in frame.columns]
+    else:
+        try:
+            data = json.loads(file_content)
+        except json.JSONDecodeError:
+            return None, "El archivo no es un JSON válido."
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            return None, "El JSON debe ser un objeto o un array de objetos."
+        # Solo interesan los marcadores conocidos: se extraen directamente por columnas
+        return pd.DataFrame({key: [record.get(key) for record in data] for key in columns},
+                            index=pd.RangeIndex(len(data)), dtype=object), None
+
+    return frame.reindex(columns=columns, index=pd.RangeIndex(len(frame))), None
+
+def analyze_blood_frame(frame):
     """
-    try:
-        data = json.loads(file_content)
-    except json.JSONDecodeError:
-        return {"status": "error", "message": "El archivo no es un JSON válido."}
-
-    # 1. Analisis del Estado Actual
-    current_anomalies = []
-    report_details = []
-    for key, values in KNOWLEDGE_BASE.items():
-        if key in data:
-            val = data[key]
-            lower, upper = values['range']
-            status = "Normal"
-            if val < lower:
-                status = "Bajo"
-                current_anomalies.append(key)
-            elif val > upper:
-                status = "Alto"
-                current_anomalies.append(key)
-            report_details.append(f"{key.replace('_', ' ').title()}: {val} {values['unit']} (Estado: {status})")
-
-    # 2. Diagnostico Basado en Patrones
-    current_diagnoses = []
-    for disease, check_func in DISEASE_PATTERNS.items():
-        if check_func(data):
-            current_diagnoses.append(disease)
-
-    if not current_diagnoses:
-        current_diagnoses.append("Normal")
-
-    # 3. Prediccion Futura (Simulacion de Markov)
-    primary_state = current_diagnoses[0] # Usamos el primer diagnostico como estado primario
-    future_projections = []
-    if primary_state in MARKOV_TRANSITIONS:
-        # Simular una transicion
-        transitions = MARKOV_TRANSITIONS[primary_state]
-        states, probabilities = zip(*transitions)
-        # Elegimos un estado futuro basado en las probabilidades
-        # En una app real, devolveriamos las probabilidades, pero aqui simulamos un camino
-        # next_state = random.choices(states, weights=probabilities, k=1)[0]
-        future_projections = [{"state": s, "probability": p} for s, p in transitions]
-
-    # 4. Ensamblar la respuesta
-    response = {
-        "status": "success",
-        "analysis_type": "blood_analysis",
-        "report": {
-            "title": "Informe de Análisis de Sangre",
-            "details": "\n".join(report_details),
-            "current_diagnoses": current_diagnoses,
-            "future_projections": {
-                "title": f"Proyección a 1 año basada en el estado '{primary_state}'",
-                "projections": future_projections
+    Analiza todos los pacientes de `frame` (ver `load_blood_frame`) con operaciones por
+    columnas y devuelve una respuesta por paciente con la misma estructura que el
+    analisis de un solo JSON. Los valores ausentes o no numericos no se muestran en el
+    informe; en las reglas siguen la semantica de valores ausentes del archivo de reglas.
+    """
+    import pandas as pd
+
+    n = len(frame)
+    if n == 0:
+        return []
+    values = {key: pd.to_numeric(frame[key], errors='coerce').to_numpy(dtype=np.float64) for key in frame.columns}
+
+    # 1. Analisis del Estado Actual: estado de cada marcador como mascaras por columna
+    detail_columns = []
+    for key, spec in KNOWLEDGE_BASE.items():
+        column = values[key]
+        present = ~np.isnan(column)
+        if not present.any():
+            continue
+        lower, upper = spec['range']
+        status = np.where(column < lower, 'Bajo', np.where(column > upper, 'Alto', 'Normal')).tolist()
+        label = key.replace('_', ' ').title()
+        detail_columns.append([f"{label}: {text} {spec['unit']} (Estado: {state})" if ok else None
+                               for text, state, ok in zip(frame[key].tolist(), status, present.tolist())])
+    details = ['\n'.join(filter(None, parts)) for parts in zip(*detail_columns)] if detail_columns else [''] * n
+
+    # 2. Diagnostico Basado en Reglas: una mascara booleana por enfermedad; cada combinacion
+    # distinta de diagnosticos se resuelve una sola vez
+    plan = BLOOD_RULES.plan()
+    masks = np.column_stack(list(plan.evaluate(values, n=n).values()))
+    combinations, combination_of = np.unique(masks, axis=0, return_inverse=True)
+    combination_of = combination_of.reshape(-1).tolist()
+
+    # 3. Prediccion Futura: se parte de la mezcla de todos los diagnosticos actuales y se
+    # proyectan a la vez todas las combinaciones distintas (una multiplicacion por horizonte)
+    diagnoses_by_combination = [[name for name, active in zip(plan.rule_names, row) if active] or ["Normal"]
+                                for row in combinations.tolist()]
+    initial = MARKOV_CHAIN.initial_distribution(diagnoses_by_combination)
+    projected = {horizon: MARKOV_CHAIN.project(initial, horizon) for horizon in PROJECTION_HORIZONS}
+
+    summaries = []
+    for row, current_diagnoses in enumerate(diagnoses_by_combination):
+        if len(current_diagnoses) == 1:
+            basis = f"el estado '{current_diagnoses[0]}'"
+        else:
+            basis = "los estados " + ", ".join(f"'{d}'" for d in current_diagnoses)
+        summaries.append((current_diagnoses, {
+            "title": f"Proyección a 1 año basada en {basis}",
+            "projections": MARKOV_CHAIN.describe(projected[1][row]),
+            "horizons": [{"years": horizon, "projections": MARKOV_CHAIN.describe(projected[horizon][row])}
+                         for horizon in PROJECTION_HORIZONS]
+        }))
+
+    # 4. Ensamblar una respuesta por paciente
+    responses = []
+    for detail, combination in zip(details, combination_of):
+        current_diagnoses, future_projections = summaries[combination]
+        responses.append({
+            "status": "success",
+            "analysis_type": "blood_analysis",
+            "report": {
+                "title": "Informe de Análisis de Sangre",
+                "details": detail,
+                "current_diagnoses": current_diagnoses,
+                "future_projections": future_projections
             }
-        }
-    }
-    
-    return response
+        })
+    return responses
+
+def analyze_blood_data(file_content, file_format='json'):
+    """
+    Analiza los datos de un archivo de analisis de sangre (JSON o CSV) y devuelve un informe estructurado.
+    Un objeto JSON devuelve su informe; un array JSON o un CSV, aunque tenga una sola fila,
+    devuelve siempre `blood_analysis_batch` con la lista `reports` (un informe por fila).
+    """
+    frame, error = load_blood_frame(file_content, file_format)
+    if error:
+        return {"status": "error", "message": error}
+    reports = analyze_blood_frame(frame)
+    # Un JSON valido que empieza por '{' es un objeto (un solo paciente)
+    if file_format != 'csv' and file_content.lstrip().startswith('{'):
+        return reports[0]
+    return {"status": "success", "analysis_type": "blood_analysis_batch", "count": len(reports), "reports": reports}
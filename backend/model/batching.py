@@ -0,0 +1,195 @@
+"""
+Planificador de micro-lotes (micro-batching) para la inferencia del modelo de piel.
+
+Las peticiones concurrentes de análisis de piel se encolan y un hilo de trabajo
+las agrupa hasta alcanzar el tamaño máximo de lote o hasta que vence la ventana
+de espera de la petición más antigua. Se ejecuta un único forward pass sobre el
+lote completo y a cada llamador se le devuelve su propia porción del resultado.
+"""
+import time
+import queue
+import logging
+import threading
+import numpy as np
+
+
+class _PendingRequest:
+    """Petición encolada a la espera de su porción del lote."""
+
+    __slots__ = ('inputs', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Agrupa peticiones concurrentes en lotes y las ejecuta con `predict_fn`.
+
+    Parámetros:
+        predict_fn: función que recibe un array (N, H, W, C) y devuelve un array (N, ...).
+        max_batch_size: número máximo de imágenes por forward pass.
+        max_wait_ms: presupuesto máximo de latencia (ms) que una petición puede
+            esperar en la cola a que se llene el lote.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size debe ser >= 1")
+        self.predict_fn = predict_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._carry = None  # Petición extraída que no cupo en el lote anterior
+        self._stop = threading.Event()
+        # Hace atómicos la comprobación de `_stop` y el encolado frente a `stop()`
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def _reset_stats(self):
+        self._batches = 0
+        self._requests = 0
+        self._items = 0
+        self._queue_wait_total = 0.0
+        self._inference_total = 0.0
+        self._size_histogram = {}
+
+    def submit(self, inputs, timeout=None):
+        """
+        Encola `inputs` (array (n, H, W, C)) y bloquea hasta obtener su resultado.
+        Lanza la excepción del forward pass si éste falla.
+        """
+        inputs = np.asarray(inputs)
+        if inputs.ndim == 3:
+            inputs = np.expand_dims(inputs, axis=0)
+        pending = _PendingRequest(inputs)
+        with self._submit_lock:
+            if self._stop.is_set():
+                raise RuntimeError("El planificador de lotes está detenido.")
+            self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Tiempo de espera agotado en la cola de inferencia.")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def queue_depth(self):
+        """Número aproximado de peticiones a la espera de ser agrupadas."""
+        return self._queue.qsize() + (1 if self._carry is not None else 0)
+
+    def stats(self):
+        """Devuelve métricas de llenado de lotes y tiempos acumulados."""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "requests": self._requests,
+                "items": self._items,
+                "avg_batch_size": (self._items / batches) if batches else 0.0,
+                "avg_fill_ratio": (self._items / (batches * self.max_batch_size)) if batches else 0.0,
+                "avg_queue_wait_ms": (self._queue_wait_total / self._requests * 1000.0) if self._requests else 0.0,
+                "avg_inference_ms": (self._inference_total / batches * 1000.0) if batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._size_histogram.items())),
+                "queue_depth": self.queue_depth(),
+            }
+
+    def stop(self, timeout=1.0):
+        """Detiene el hilo de trabajo. Las peticiones pendientes reciben un error."""
+        with self._submit_lock:
+            self._stop.set()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            # El hilo ya vació la cola al salir; por si terminó de forma inesperada
+            self._fail_pending()
+
+    # --- Bucle del hilo de trabajo ---
+
+    def _next_request(self, timeout):
+        if self._carry is not None:
+            pending, self._carry = self._carry, None
+            return pending
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect_batch(self):
+        first = self._next_request(timeout=0.1)
+        if first is None:
+            return []
+        batch = [first]
+        size = len(first.inputs)
+        deadline = first.enqueued_at + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            pending = self._next_request(timeout=remaining)
+            if pending is None:
+                break
+            if size + len(pending.inputs) > self.max_batch_size:
+                # No cabe en este lote: se procesa primero en el siguiente
+                self._carry = pending
+                break
+            batch.append(pending)
+            size += len(pending.inputs)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._execute(batch)
+        self._fail_pending()
+
+    def _fail_pending(self):
+        """Libera con un error a cualquier llamador que siga esperando en la cola."""
+        leftovers = [self._carry] if self._carry is not None else []
+        self._carry = None
+        while True:
+            try:
+                leftovers.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for pending in leftovers:
+            pending.error = RuntimeError("El planificador de lotes se detuvo antes de procesar la petición.")
+            pending.done.set()
+
+    def _execute(self, batch):
+        started = time.perf_counter()
+        try:
+            inputs = np.concatenate([p.inputs for p in batch], axis=0)
+            outputs = np.asarray(self.predict_fn(inputs))
+            offset = 0
+            for pending in batch:
+                n = len(pending.inputs)
+                pending.result = outputs[offset:offset + n]
+                offset += n
+        except Exception as e:
+            logging.exception(f"Error en el forward pass del lote de {len(batch)} peticiones: {e}")
+            for pending in batch:
+                pending.error = e
+        finished = time.perf_counter()
+
+        items = sum(len(p.inputs) for p in batch)
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._items += items
+            self._inference_total += finished - started
+            self._queue_wait_total += sum(started - p.enqueued_at for p in batch)
+            self._size_histogram[items] = self._size_histogram.get(items, 0) + 1
+
+        for pending in batch:
+            pending.done.set()
@@ -0,0 +1,172 @@
+"""
+Caché de resultados direccionada por contenido.
+
+La clave es un hash de los píxeles ya decodificados y preprocesados más la versión
+del modelo, de modo que volver a subir la misma imagen (aunque tenga otro nombre)
+devuelve la predicción y la ruta del artefacto SHAP sin ejecutar el modelo.
+Hay dos niveles: un LRU en memoria y un nivel en disco con expulsión por tamaño.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def compute_cache_key(processed_image, model_version):
+    """Hash SHA-256 de los píxeles preprocesados (forma, tipo y bytes) y la versión del modelo."""
+    h = hashlib.sha256()
+    h.update(str(model_version).encode('utf-8'))
+    h.update(str(processed_image.shape).encode('utf-8'))
+    h.update(str(processed_image.dtype).encode('utf-8'))
+    h.update(np.ascontiguousarray(processed_image).data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU en memoria respaldado por un directorio en disco.
+
+    Parámetros:
+        max_items: entradas máximas en memoria.
+        disk_dir: directorio del nivel en disco (None para desactivarlo).
+        max_disk_bytes: tamaño máximo del nivel en disco; al superarlo se
+            eliminan las entradas usadas hace más tiempo.
+        on_evict: función llamada con la clave de cada entrada que se expulsa del
+            último nivel (el disco o, sin él, la memoria); por ejemplo, para borrar
+            los archivos asociados a la entrada. Se llama con el lock tomado.
+    """
+
+    def __init__(self, max_items=256, disk_dir=None, max_disk_bytes=256 * 1024 * 1024, on_evict=None):
+        self.max_items = max_items
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.on_evict = on_evict
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_index = OrderedDict()  # clave -> tamaño en bytes, de más antiguo a más reciente
+        self._disk_bytes = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0,
+                          "memory_evictions": 0, "disk_evictions": 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _load_disk_index(self):
+        """Reconstruye el índice del nivel en disco ordenado por último acceso."""
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.is_file() and entry.name.endswith('.json'):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-len('.json')], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+        logging.info(f"Caché de resultados en disco: {len(entries)} entradas ({self._disk_bytes} bytes).")
+
+    def get(self, key):
+        """Devuelve el valor almacenado para `key` o None."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return value
+            if self.disk_dir and key in self._disk_index:
+                value = self._read_disk(key)
+                if value is not None:
+                    self._counters["disk_hits"] += 1
+                    self._remember(key, value)
+                    return value
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, value, persist=True):
+        """Guarda `value` (serializable a JSON). Con persist=False sólo se guarda en memoria."""
+        with self._lock:
+            self._counters["puts"] += 1
+            self._remember(key, value)
+            if persist and self.disk_dir:
+                self._write_disk(key, value)
+
+    def invalidate(self, key):
+        """Elimina `key` de ambos niveles."""
+        with self._lock:
+            self._memory.pop(key, None)
+            if self.disk_dir and key in self._disk_index:
+                self._remove_disk(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            return dict(self._counters,
+                        hit_ratio=(hits / lookups) if lookups else 0.0,
+                        memory_items=len(self._memory),
+                        disk_items=len(self._disk_index),
+                        disk_bytes=self._disk_bytes)
+
+    # --- Métodos internos (se llaman con el lock tomado) ---
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            evicted, _ = self._memory.popitem(last=False)
+            self._counters["memory_evictions"] += 1
+            if not self.disk_dir:
+                self._notify_evict(evicted)
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+            # Marcar el acceso para que la expulsión por antigüedad lo respete
+            os.utime(path, None)
+            self._disk_index.move_to_end(key)
+            return value
+        except (OSError, ValueError) as e:
+            logging.warning(f"Entrada de caché ilegible {path}: {e}")
+            self._remove_disk(key)
+            return None
+
+    def _write_disk(self, key, value):
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            data = json.dumps(value).encode('utf-8')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"No se pudo escribir la entrada de caché {path}: {e}")
+            return
+        self._disk_bytes -= self._disk_index.pop(key, 0)
+        self._disk_index[key] = len(data)
+        self._disk_bytes += len(data)
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk_index) > 1:
+            oldest = next(iter(self._disk_index))
+            self._remove_disk(oldest)
+            self._counters["disk_evictions"] += 1
+            self._notify_evict(oldest)
+
+    def _notify_evict(self, key):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key)
+        except Exception as e:
+            logging.warning(f"Error al liberar la entrada expulsada {key}: {e}")
+
+    def _remove_disk(self, key):
+        self._disk_bytes -= self._disk_index.pop(key, 0)
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
@@ -0,0 +1,210 @@
+# pyright: reportMissingImports=false
+"""
+Motores de inferencia intercambiables para el modelo de piel.
+
+El modelo Keras (`model.h5`) se puede servir tal cual o convertirse una sola vez
+a un artefacto más rápido en CPU:
+ - 'keras': el modelo Keras en precisión completa.
+ - 'tflite_fp16': TFLite con pesos en float16.
+ - 'tflite_int8': TFLite con cuantización dinámica de rango (pesos int8).
+ - 'savedmodel': función concreta congelada exportada como SavedModel.
+
+El motor se elige con la variable de entorno INFERENCE_BACKEND. Todos exponen
+`predict(batch)` con un array (N, 224, 224, 3) preprocesado y devuelven (N, 1).
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+import tensorflow as tf
+
+from .model import MODEL_PATH, IMG_SHAPE
+
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras')
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', str(os.cpu_count() or 1)))
+ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), 'artifacts')
+
+BACKENDS = ('keras', 'tflite_fp16', 'tflite_int8', 'savedmodel')
+
+
+class KerasEngine:
+    """
+    Inferencia con el modelo Keras a través de una tf.function de firma fija.
+
+    `Model.predict` reconstruye en cada llamada su maquinaria de adaptadores de
+    datos y callbacks; la función trazada una sola vez evita ese coste por
+    petición. Con traced=False se usa `model.predict` (ruta original).
+    """
+
+    name = 'keras'
+
+    def __init__(self, model, traced=True):
+        self.model = model
+        self.traced = traced
+        self._fn = _serving_function(model) if traced else None
+
+    def predict(self, batch):
+        if self._fn is None:
+            return self.model.predict(batch, verbose=0)
+        return self._fn(tf.convert_to_tensor(batch, dtype=tf.float32))['output'].numpy()
+
+    def warmup(self, batch_sizes):
+        warmup_engine(self, batch_sizes)
+
+
+class TFLiteEngine:
+    """Inferencia con un intérprete TFLite. El intérprete no es reentrante: se serializa con un lock."""
+
+    def __init__(self, model_path, name='tflite', num_threads=TFLITE_NUM_THREADS):
+        self.name = name
+        self.model_path = model_path
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input_index = self._interpreter.get_input_details()[0]['index']
+        self._output_index = self._interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                # Redimensionar la entrada sólo cuando cambia el tamaño del lote
+                self._interpreter.resize_tensor_input(self._input_index, list(batch.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input_index, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+    def warmup(self, batch_sizes):
+        warmup_engine(self, batch_sizes)
+
+
+class SavedModelEngine:
+    """Inferencia con la firma congelada de un SavedModel."""
+
+    name = 'savedmodel'
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        self._loaded = tf.saved_model.load(export_dir)
+        self._fn = self._loaded.signatures['serving_default']
+        self._output_key = list(self._fn.structured_outputs.keys())[0]
+
+    def predict(self, batch):
+        outputs = self._fn(tf.convert_to_tensor(batch, dtype=tf.float32))
+        return outputs[self._output_key].numpy()
+
+    def warmup(self, batch_sizes):
+        warmup_engine(self, batch_sizes)
+
+
+def warmup_engine(engine, batch_sizes):
+    """
+    Ejecuta lotes ficticios con los tamaños indicados para pagar el trazado del
+    grafo y la reserva de memoria antes de la primera petición real.
+    """
+    for size in sorted(set(int(b) for b in batch_sizes if int(b) > 0)):
+        started = time.perf_counter()
+        engine.predict(np.zeros((size,) + IMG_SHAPE, dtype=np.float32))
+        logging.info(f"Calentamiento de '{engine.name}' con lote {size}: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+def _serving_function(model):
+    """tf.function de firma fija (lote variable, 224x224x3) alrededor del modelo."""
+    @tf.function(input_signature=[tf.TensorSpec(shape=(None,) + IMG_SHAPE, dtype=tf.float32, name='input_layer')])
+    def serve(images):
+        return {'output': model(images, training=False)}
+    return serve
+
+
+def convert_to_tflite(model, output_path, quantization='float16'):
+    """
+    Convierte el modelo Keras a TFLite.
+
+    `quantization` puede ser 'float16' (pesos en float16), 'dynamic' (cuantización
+    dinámica de rango, pesos int8) o None (float32).
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ('float16', 'dynamic'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    tflite_model = converter.convert()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    logging.info(f"Modelo TFLite ({quantization or 'float32'}) guardado en {output_path} ({len(tflite_model)} bytes)")
+    return output_path
+
+
+def export_saved_model(model, export_dir):
+    """Exporta una función concreta congelada del modelo como SavedModel."""
+    module = tf.Module()
+    module.model = model
+    module.serve = _serving_function(model)
+    tf.saved_model.save(module, export_dir, signatures={'serving_default': module.serve.get_concrete_function()})
+    logging.info(f"SavedModel exportado en {export_dir}")
+    return export_dir
+
+
+def artifact_path(backend):
+    """Ruta del artefacto convertido para `backend`."""
+    if backend == 'tflite_fp16':
+        return os.path.join(ARTIFACTS_DIR, 'model_fp16.tflite')
+    if backend == 'tflite_int8':
+        return os.path.join(ARTIFACTS_DIR, 'model_int8.tflite')
+    if backend == 'savedmodel':
+        return os.path.join(ARTIFACTS_DIR, 'saved_model')
+    return MODEL_PATH
+
+
+def _is_stale(path):
+    """Un artefacto está desactualizado si no existe o es más antiguo que model.h5."""
+    if not os.path.exists(path):
+        return True
+    return os.path.exists(MODEL_PATH) and os.path.getmtime(path) < os.path.getmtime(MODEL_PATH)
+
+
+def build_artifact(model, backend, force=False):
+    """Convierte el modelo para `backend` si el artefacto falta o está desactualizado."""
+    path = artifact_path(backend)
+    if backend == 'keras' or (not force and not _is_stale(path)):
+        return path
+    logging.info(f"Generando artefacto de inferencia '{backend}'...")
+    if backend == 'tflite_fp16':
+        return convert_to_tflite(model, path, quantization='float16')
+    if backend == 'tflite_int8':
+        return convert_to_tflite(model, path, quantization='dynamic')
+    if backend == 'savedmodel':
+        return export_saved_model(model, path)
+    raise ValueError(f"Motor de inferencia desconocido: {backend}")
+
+
+def load_inference_engine(model, backend=None):
+    """
+    Devuelve el motor de inferencia configurado, convirtiendo el modelo una vez si hace falta.
+
+    Retorna:
+        Una tupla. En caso de éxito: (engine, None).
+        En caso de error: (KerasEngine(model), error_message_string) para que el
+        servidor siga funcionando con el modelo Keras.
+    """
+    backend = backend or INFERENCE_BACKEND
+    try:
+        if backend not in BACKENDS:
+            raise ValueError(f"Motor de inferencia desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+        if backend == 'keras':
+            return KerasEngine(model), None
+        path = build_artifact(model, backend)
+        if backend == 'savedmodel':
+            engine = SavedModelEngine(path)
+        else:
+            engine = TFLiteEngine(path, name=backend)
+        logging.info(f"Motor de inferencia '{backend}' cargado desde {path}")
+        return engine, None
+    except Exception as e:
+        error_message = f"No se pudo cargar el motor de inferencia '{backend}': {e}"
+        logging.error(error_message)
+        return KerasEngine(model), error_message
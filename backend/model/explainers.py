@@ -0,0 +1,166 @@
+"""
+Explicadores SHAP por niveles de coste.
+
+ - full: gradientes esperados (el estimador de shap.GradientExplainer) con muchas muestras.
+ - fast: gradientes esperados con pocas muestras.
+ - coarse: atribución por oclusión sobre una rejilla de baja resolución (grid×grid celdas):
+   cada celda se sustituye por el fondo y se mide el cambio en la probabilidad. Sólo
+   necesita forward passes en lote, así que funciona con cualquier motor de inferencia.
+
+Todos devuelven atribuciones con forma (N, H, W, C) para la salida del modelo. Cada
+nivel usa un único estimador sea cual sea N, así que la explicación de una imagen
+(que se guarda en la caché de resultados) no depende de con cuántas otras llegó: los
+niveles de gradiente reparten las muestras de todas las imágenes en lotes comunes de
+gradientes (ver `_expected_gradients`) y coarse evalúa las variantes de oclusión de
+todas las imágenes en lotes comunes.
+"""
+import numpy as np
+
+# Niveles de explicación, del más barato al más caro
+TIERS = ('coarse', 'fast', 'full')
+
+
+def tier_rank(tier):
+    """Posición del nivel en TIERS (mayor = más caro y más detallado); -1 si es desconocido."""
+    return TIERS.index(tier) if tier in TIERS else -1
+
+
+def attributions_for_images(shap_values):
+    """
+    Normaliza la salida de SHAP a (N, H, W, C) para la primera salida del modelo.
+    Según la versión, GradientExplainer devuelve una lista por salida de (N, H, W, C)
+    o un array (N, H, W, C, salidas).
+    """
+    if isinstance(shap_values, list):
+        shap_values = shap_values[0]
+    values = np.asarray(shap_values)
+    if values.ndim == 5:
+        values = values[..., 0]
+    return values
+
+
+class TieredExplainer:
+    """
+    Agrupa los explicadores de cada nivel. `keras_model` es necesario para fast/full
+    (gradientes); `predict_fn` (lote -> probabilidades) basta para coarse.
+    """
+
+    def __init__(self, keras_model=None, predict_fn=None, input_shape=(224, 224, 3),
+                 fast_nsamples=16, full_nsamples=200, coarse_grid=8, coarse_batch_size=32,
+                 gradient_batch_size=64):
+        self.predict_fn = predict_fn
+        self.input_shape = tuple(input_shape)
+        self.fast_nsamples = fast_nsamples
+        self.full_nsamples = full_nsamples
+        self.coarse_grid = coarse_grid
+        self.coarse_batch_size = coarse_batch_size
+        self.gradient_batch_size = gradient_batch_size
+        self.keras_model = keras_model
+        self._gradient_fn = None
+        # Fondo simple (imágenes negras en el espacio de entrada del modelo)
+        self.background = np.zeros((1,) + self.input_shape, dtype=np.float32)
+        # Los niveles de gradiente necesitan el modelo Keras (ver `_gradients`)
+        self._gradient_tiers = ('fast', 'full') if keras_model is not None else ()
+
+    @property
+    def tiers(self):
+        """Niveles disponibles con los recursos cargados."""
+        available = set(self._gradient_tiers)
+        if self.predict_fn is not None:
+            available.add('coarse')
+        return [tier for tier in TIERS if tier in available]
+
+    def resolve_tier(self, tier):
+        """El nivel pedido si está disponible; si no, el disponible más cercano por debajo (o por encima)."""
+        available = self.tiers
+        if not available:
+            return None
+        if tier in available:
+            return tier
+        cheaper = [t for t in available if tier_rank(t) < tier_rank(tier)]
+        return cheaper[-1] if cheaper else available[0]
+
+    def shap_values(self, images, tier='full'):
+        """Atribuciones (N, H, W, C) de `images` con el nivel `tier` (o el más cercano disponible)."""
+        resolved = self.resolve_tier(tier)
+        if resolved is None:
+            raise RuntimeError("No hay explicadores SHAP disponibles.")
+        images = np.asarray(images, dtype=np.float32)
+        if resolved == 'coarse':
+            return self._grid_occlusion(images)
+        nsamples = self.full_nsamples if resolved == 'full' else self.fast_nsamples
+        return self._expected_gradients(images, nsamples)
+
+    def _gradients(self, batch):
+        """Gradiente de la primera salida respecto a la entrada, con una tf.function de forma variable."""
+        import tensorflow as tf
+
+        if self._gradient_fn is None:
+            model = self.keras_model
+
+            @tf.function(input_signature=[tf.TensorSpec((None,) + self.input_shape, tf.float32)])
+            def gradient_fn(x):
+                with tf.GradientTape() as tape:
+                    tape.watch(x)
+                    output = model(x, training=False)[:, 0]
+                return tape.gradient(output, x)
+
+            self._gradient_fn = gradient_fn
+        return self._gradient_fn(batch).numpy()
+
+    def _expected_gradients(self, images, nsamples):
+        """
+        El mismo estimador que GradientExplainer (gradientes esperados entre el fondo y
+        cada imagen), pero con las N×nsamples muestras de todas las imágenes repartidas
+        en lotes de `gradient_batch_size` en lugar de recorrer las imágenes una a una.
+        Se usa para cualquier N, también para una sola imagen.
+        """
+        n = len(images)
+        rng = np.random.default_rng()
+        background = self.background[0]
+        deltas = images - background
+        alphas = rng.uniform(size=n * nsamples).astype(np.float32)
+        owners = np.repeat(np.arange(n), nsamples)
+
+        attributions = np.zeros_like(images, dtype=np.float32)
+        for start in range(0, n * nsamples, self.gradient_batch_size):
+            idx = owners[start:start + self.gradient_batch_size]
+            alpha = alphas[start:start + self.gradient_batch_size].reshape(-1, 1, 1, 1)
+            samples = background + alpha * deltas[idx]
+            contributions = self._gradients(samples) * deltas[idx]
+            # Las muestras están ordenadas por imagen: sumar los tramos contiguos de cada una
+            owners_in_batch, starts = np.unique(idx, return_index=True)
+            attributions[owners_in_batch] += np.add.reduceat(contributions, starts, axis=0)
+        return attributions / nsamples
+
+    def _grid_occlusion(self, images):
+        n, h, w, c = images.shape
+        g = self.coarse_grid
+        rows = np.linspace(0, h, g + 1).astype(int)
+        cols = np.linspace(0, w, g + 1).astype(int)
+        cells = [(r, q) for r in range(g) for q in range(g)]
+
+        # Variantes de todas las imágenes: para cada una, la imagen completa (variante 0)
+        # seguida de una copia por celda con esa celda sustituida por el fondo. Se
+        # construyen por lotes para no tener en memoria todas las variantes a la vez.
+        per_image = len(cells) + 1
+        total = n * per_image
+        outputs = np.empty(total, dtype=np.float64)
+        for start in range(0, total, self.coarse_batch_size):
+            flat = np.arange(start, min(start + self.coarse_batch_size, total))
+            chunk = images[flat // per_image].copy()
+            for j, variant in enumerate(flat % per_image):
+                if variant:
+                    r, q = cells[variant - 1]
+                    chunk[j, rows[r]:rows[r + 1], cols[q]:cols[q + 1]] = \
+                        self.background[0, rows[r]:rows[r + 1], cols[q]:cols[q + 1]]
+            outputs[flat] = np.asarray(self.predict_fn(chunk), dtype=np.float64).reshape(len(chunk), -1)[:, 0]
+        outputs = outputs.reshape(n, per_image)
+        deltas = outputs[:, :1] - outputs[:, 1:]
+
+        # Repartir la contribución de cada celda entre sus píxeles y canales
+        attributions = np.zeros_like(images, dtype=np.float32)
+        for k, (r, q) in enumerate(cells):
+            area = (rows[r + 1] - rows[r]) * (cols[q + 1] - cols[q]) * c
+            attributions[:, rows[r]:rows[r + 1], cols[q]:cols[q + 1]] = (deltas[:, k] / max(area, 1)).reshape(n, 1, 1, 1)
+        return attributions
@@ -7,6 +7,8 @@ from tensorflow.keras.applications import ResNet50
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Input
 from tensorflow.keras import Model
 
+from .stub import STUB_MODEL, STUB_LATENCY_MS, STUB_LATENCY_PER_IMAGE_MS, load_stub_model
+
 # Configuración básica
 IMG_SHAPE = (224, 224, 3)
 NUM_CLASSES = 1  # número de neuronas de salida 
@@ -19,10 +21,13 @@ CLASS_NAMES = ['benigno', 'maligno']
 logging.basicConfig(level=logging.INFO)
 
 
-def create_model():
+def create_model(weights='imagenet'):
     """
     Crea un modelo de clasificación de imágenes usando ResNet50 como base.
 
+    `weights` se pasa a ResNet50 ('imagenet' o None para pesos aleatorios,
+    útil en pruebas de rendimiento sin conexión).
+
     Retorna:
         Una tupla. En caso de éxito: (model, None).
         En caso de error: (None, error_message_string).
@@ -36,7 +41,7 @@ def create_model():
         # 2. Modelo base ResNet50 (pre-entrenado)
         base_model = ResNet50(
             include_top=False,
-            weights='imagenet',
+            weights=weights,
             input_shape=IMG_SHAPE
         )
         base_model.trainable = False
@@ -58,14 +63,37 @@ def create_model():
         logging.error(error_message)
         return None, error_message
 
+def get_model_version():
+    """
+    Devuelve un identificador de la versión del modelo desplegado.
+
+    Se usa la variable de entorno MODEL_VERSION si está definida; si no, se
+    deriva del tamaño y la fecha de modificación de `model.h5`.
+    """
+    version = os.getenv('MODEL_VERSION')
+    if version:
+        return version
+    if STUB_MODEL:
+        return f"stub-{STUB_LATENCY_MS:g}-{STUB_LATENCY_PER_IMAGE_MS:g}"
+    try:
+        st = os.stat(MODEL_PATH)
+        return f"{st.st_size}-{st.st_mtime_ns}"
+    except OSError:
+        return 'unknown'
+
 def load_trained_model():
     """
     Carga el modelo entrenado desde el archivo guardado.
+
+    Con STUB_MODEL=1 devuelve el modelo simulado de `stub.py` (pruebas de carga).
     
     Retorna:
         Una tupla (model, class_names) en caso de éxito.
         Una tupla (None, None) en caso de error.
     """
+    if STUB_MODEL:
+        logging.info("STUB_MODEL=1: usando el modelo simulado (sin model.h5).")
+        return load_stub_model(CLASS_NAMES)
     try:
         if not os.path.exists(MODEL_PATH):
             logging.error(f"No se encontró el modelo en {MODEL_PATH}")
@@ -75,14 +103,9 @@ def load_trained_model():
 
         # Cargar el modelo completo guardado (incluye arquitectura y pesos).
         # Esto evita inconsistencias entre la arquitectura esperada y la estructura
-        # real del modelo almacenado en el HDF5.
-        model = tf.keras.models.load_model(MODEL_PATH)
-        # (Opcional) compilar para mantener compatibilidad con .evaluate() o entrenamiento
-        model.compile(
-            optimizer='adam',
-            loss='binary_crossentropy',
-            metrics=['accuracy']
-        )
+        # real del modelo almacenado en el HDF5. El servidor sólo hace inferencia,
+        # así que no se restaura ni se compila el optimizador.
+        model = tf.keras.models.load_model(MODEL_PATH, compile=False)
         logging.info("Modelo cargado exitosamente usando tf.keras.models.load_model.")
 
         return model, CLASS_NAMES
@@ -2,23 +2,32 @@
 """
 Este módulo contiene la lógica para realizar predicciones usando el modelo de IA.
 """
+import io
 import os
+import gzip
+import json
+import uuid
+import struct
 import logging
+import contextvars
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras # type: ignore
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.resnet50 import preprocess_input
-import shap
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# TensorFlow y SHAP se importan de forma diferida dentro de las funciones que
+# los usan: importar este módulo (y `backend`) es casi instantáneo y el coste de esas
+# librerías se paga en el hilo de carga del modelo o en la primera petición.
+from .batching import MicroBatcher
+from .shap_jobs import ShapJobManager
+from .cache import ResultCache, compute_cache_key
+from .explainers import TIERS, TieredExplainer, attributions_for_images, tier_rank
+from ..telemetry import span
 
 # --- Configuración de Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # --- Variables Globales ---
 model = None
+engine = None
 explainer = None
 class_names = None
 # Umbrales para mejorar la UX y reducir falsas alarmas sin retrenar el modelo.
@@ -28,69 +37,204 @@ class_names = None
 LOW_THRESHOLD = 0.3
 HIGH_THRESHOLD = 0.7
 
-def load_model_resources(loaded_model, app_class_names):
+# Micro-batching de la inferencia: las peticiones concurrentes se agrupan hasta
+# BATCH_MAX_SIZE imágenes o hasta que la más antigua lleva BATCH_MAX_WAIT_MS en cola.
+BATCHING_ENABLED = os.getenv('BATCHING_ENABLED', '1') == '1'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+batcher = None
+
+# Hilos para decodificar y preprocesar imágenes en los análisis por lotes
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+# Tamaños de lote con los que se calienta el motor de inferencia al arrancar
+WARMUP_BATCH_SIZES = [int(b) for b in os.getenv('WARMUP_BATCH_SIZES', f"1,{BATCH_MAX_SIZE}").split(',') if b.strip()]
+
+# Explicaciones SHAP asíncronas: la predicción se devuelve sin esperar a SHAP y
+# un pool de SHAP_WORKERS hilos genera el artefacto SHAP en segundo plano.
+SHAP_ASYNC = os.getenv('SHAP_ASYNC', '1') == '1'
+SHAP_WORKERS = int(os.getenv('SHAP_WORKERS', '1'))
+shap_jobs = None
+
+# Caché de resultados por contenido (hash de píxeles preprocesados + versión del modelo)
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_MAX_ITEMS = int(os.getenv('RESULT_CACHE_MAX_ITEMS', '256'))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', 'cache/results')
+RESULT_CACHE_MAX_DISK_MB = float(os.getenv('RESULT_CACHE_MAX_DISK_MB', '256'))
+result_cache = None
+model_version = None
+
+# Niveles de explicación SHAP (ver explainers.py): nivel por defecto, muestras de los
+# niveles de gradiente y rejilla del nivel por oclusión
+SHAP_DEFAULT_TIER = os.getenv('SHAP_DEFAULT_TIER', 'full')
+SHAP_FAST_NSAMPLES = int(os.getenv('SHAP_FAST_NSAMPLES', '16'))
+SHAP_FULL_NSAMPLES = int(os.getenv('SHAP_FULL_NSAMPLES', '200'))
+SHAP_COARSE_GRID = int(os.getenv('SHAP_COARSE_GRID', '8'))
+# Muestras por lote de gradientes al explicar varias imágenes juntas
+SHAP_GRADIENT_BATCH = int(os.getenv('SHAP_GRADIENT_BATCH', '64'))
+# Con tantos trabajos SHAP pendientes o más, se baja automáticamente a 'fast' / 'coarse'
+SHAP_FAST_QUEUE_DEPTH = int(os.getenv('SHAP_FAST_QUEUE_DEPTH', '4'))
+SHAP_COARSE_QUEUE_DEPTH = int(os.getenv('SHAP_COARSE_QUEUE_DEPTH', '16'))
+
+# Artefactos SHAP: factor de reducción del mapa de calor (1 = resolución completa) y
+# cabecera mágica del formato binario (gzip de MAGIC + uint32 longitud + cabecera JSON + uint8)
+SHAP_ARTIFACT_DOWNSAMPLE = max(1, int(os.getenv('SHAP_ARTIFACT_DOWNSAMPLE', '2')))
+SHAP_ARTIFACT_MAGIC = b'SHAP'
+
+def load_model_resources(loaded_model, app_class_names, loaded_model_version=None, inference_engine=None,
+                         shap_explainer=None, job_manager=None, cache=None):
     """
     Inicializa el modelo, el explicador SHAP y los nombres de las clases.
     Esta función es llamada una vez al inicio de la aplicación.
+
+    `loaded_model_version` forma parte de la clave de la caché de resultados, de modo
+    que un modelo nuevo nunca reutiliza predicciones del anterior.
+    `inference_engine` (ver `engines.py`) sirve las predicciones; por defecto se usa
+    el modelo Keras. SHAP trabaja sobre el modelo Keras salvo que se pase
+    `shap_explainer` (por ejemplo, el explicador remoto del servidor de modelo,
+    en cuyo caso `loaded_model` puede ser None).
+    `job_manager` y `cache` sustituyen a la cola de trabajos SHAP y a la caché de
+    resultados locales (en modo multi-proceso, las del servidor de modelo, comunes
+    a todos los procesos HTTP; ver serving/client.py).
     """
-    global model, explainer, class_names
+    global model, engine, explainer, class_names, batcher, shap_jobs, result_cache, model_version
     model = loaded_model
+    if inference_engine is None:
+        from .engines import KerasEngine
+        inference_engine = KerasEngine(loaded_model)
+    engine = inference_engine
     class_names = app_class_names
+    model_version = f"{loaded_model_version or 'unknown'}:{engine.name}"
+
+    if RESULT_CACHE_ENABLED and result_cache is None:
+        result_cache = cache if cache is not None else ResultCache(
+            max_items=RESULT_CACHE_MAX_ITEMS, disk_dir=RESULT_CACHE_DIR or None,
+            max_disk_bytes=int(RESULT_CACHE_MAX_DISK_MB * 1024 * 1024), on_evict=_remove_artifacts)
 
-    # Crear fondo simple (imágenes negras) con la forma correcta
+    # Pagar el trazado del grafo ahora y no en la primera petición de un paciente
+    try:
+        engine.warmup(WARMUP_BATCH_SIZES)
+    except Exception as e:
+        logging.warning(f"No se pudo calentar el motor de inferencia: {e}")
+
+    if batcher is not None:
+        batcher.stop()
+        batcher = None
+    if BATCHING_ENABLED:
+        batcher = MicroBatcher(_predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+        logging.info(f"Micro-batching activado (lote máximo={BATCH_MAX_SIZE}, espera máxima={BATCH_MAX_WAIT_MS} ms).")
+
+    if shap_explainer is not None:
+        explainer = shap_explainer
+    else:
+        explainer = _create_explainer(model)
+
+    if shap_jobs is None:
+        shap_jobs = job_manager if job_manager is not None else ShapJobManager(max_workers=SHAP_WORKERS)
+
+    logging.info("Recursos del modelo (modelo, explicador SHAP) cargados exitosamente.")
+
+def _create_explainer(keras_model):
+    """Crea los explicadores SHAP por niveles sobre el modelo Keras y el motor de inferencia."""
     # model.input_shape puede ser (None, H, W, C)
     try:
-        _, h, w, c = model.input_shape
+        input_shape = tuple(keras_model.input_shape[1:])
     except Exception:
         # Fallback a 224x224x3
-        h, w, c = 224, 224, 3
+        input_shape = (224, 224, 3)
+    tiered = TieredExplainer(keras_model, predict_fn=engine.predict, input_shape=input_shape,
+                             fast_nsamples=SHAP_FAST_NSAMPLES, full_nsamples=SHAP_FULL_NSAMPLES,
+                             coarse_grid=SHAP_COARSE_GRID, gradient_batch_size=SHAP_GRADIENT_BATCH)
+    logging.info(f"Niveles SHAP disponibles: {', '.join(tiered.tiers) or 'ninguno'}")
+    return tiered
+
+def choose_shap_tier(requested=None):
+    """
+    Nivel SHAP para una petición: el pedido (o SHAP_DEFAULT_TIER), rebajado a 'fast' o
+    'coarse' cuando la cola de trabajos SHAP está llena.
+    """
+    tier = requested if requested in TIERS else SHAP_DEFAULT_TIER
+    depth = shap_jobs.pending_count() if shap_jobs is not None else 0
+    if depth >= SHAP_COARSE_QUEUE_DEPTH:
+        ceiling = 'coarse'
+    elif depth >= SHAP_FAST_QUEUE_DEPTH:
+        ceiling = 'fast'
+    else:
+        return tier
+    if tier_rank(ceiling) < tier_rank(tier):
+        logging.info(f"Cola SHAP con {depth} trabajos: nivel '{tier}' rebajado a '{ceiling}'")
+        return ceiling
+    return tier
 
-    background = np.zeros((1, h, w, c), dtype=np.float32)
+def _predict_batch(batch):
+    """Ejecuta un único forward pass sobre un lote (N, H, W, C)."""
+    return engine.predict(batch)
 
-    # Inicializar el explicador SHAP usando directamente el modelo Keras.
-    # GradientExplainer espera típicamente un objeto de modelo compatible
-    # (por ejemplo, tf.keras.Model). Pasar el modelo cargado evita errores
-    # internos al intentar inferir la firma desde un wrapper de función.
-    try:
-        explainer = shap.GradientExplainer(model, background)
-    except Exception as e:
-        # Si SHAP no acepta el modelo directamente por versión o firma,
-        # intentar crear el explicador sin crash y dejar explainer=None.
-        logging.warning(f"No se pudo inicializar GradientExplainer con el modelo: {e}")
-        explainer = None
-    
-    logging.info("Recursos del modelo (modelo, explicador SHAP) cargados exitosamente.")
+def run_inference(processed_image, batched=True):
+    """
+    Obtiene la salida del modelo para `processed_image`, pasando por el
+    planificador de micro-lotes cuando está activo y `batched` es verdadero.
+    """
+    if batched and batcher is not None:
+        return batcher.submit(processed_image)
+    return engine.predict(processed_image)
+
+def get_batching_stats():
+    """Métricas del planificador de micro-lotes (o None si está desactivado)."""
+    return batcher.stats() if batcher is not None else None
 
-def preprocess_image(img_path):
+def _describe_source(img_source):
+    """Texto breve para los logs según el origen de la imagen."""
+    if isinstance(img_source, str):
+        return img_source
+    if isinstance(img_source, (bytes, bytearray, memoryview)):
+        return f"<{len(img_source)} bytes en memoria>"
+    return "<flujo en memoria>"
+
+def preprocess_image(img_source):
     """
     Carga y pre-procesa una imagen para que sea compatible con el modelo.
+
+    `img_source` puede ser una ruta en disco, los bytes del archivo o un objeto
+    tipo archivo (por ejemplo, el flujo de la petición), de modo que las subidas
+    se decodifican directamente desde memoria sin pasar por el disco.
     """
+    from tensorflow.keras.preprocessing import image
+    from tensorflow.keras.applications.resnet50 import preprocess_input
+
     try:
-        # Verificar existencia del archivo
-        if not os.path.exists(img_path):
-            raise FileNotFoundError(f"No se encontró el archivo: {img_path}")
+        if isinstance(img_source, str):
+            # Verificar existencia del archivo
+            if not os.path.exists(img_source):
+                raise FileNotFoundError(f"No se encontró el archivo: {img_source}")
+            source = img_source
+        elif isinstance(img_source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(img_source)
+        elif isinstance(img_source, io.BytesIO):
+            source = img_source
+        else:
+            source = io.BytesIO(img_source.read())
 
         # Cargar y convertir a RGB
-        img = image.load_img(img_path, target_size=(224, 224), color_mode='rgb')
-        logging.info(f"Imagen cargada correctamente: {img_path}")
+        with span('decode'):
+            img = image.load_img(source, target_size=(224, 224), color_mode='rgb')
 
-        # Convertir a array
-        img_array = image.img_to_array(img)
-        logging.info(f"Forma del array de imagen: {img_array.shape}")
+        with span('preprocess'):
+            # Convertir a array
+            img_array = image.img_to_array(img)
 
-        # Validar dimensiones
-        if img_array.shape != (224, 224, 3):
-            raise ValueError(f"Dimensiones incorrectas de imagen: {img_array.shape}")
+            # Validar dimensiones
+            if img_array.shape != (224, 224, 3):
+                raise ValueError(f"Dimensiones incorrectas de imagen: {img_array.shape}")
 
-        # Guardar copia original (uint8) para visualizaciones
-        original_img = img_array.astype(np.uint8)
+            # Guardar copia original (uint8) para visualizaciones
+            original_img = img_array.astype(np.uint8)
 
-        # Preprocesar para ResNet50
-        from tensorflow.keras.applications.resnet50 import preprocess_input
-        img_array_expanded = np.expand_dims(img_array, axis=0)
-        preprocessed_img = preprocess_input(img_array_expanded)
+            # Preprocesar para ResNet50
+            img_array_expanded = np.expand_dims(img_array, axis=0)
+            preprocessed_img = preprocess_input(img_array_expanded)
 
-        logging.info("Preprocesamiento completado exitosamente")
+        logging.debug(f"Imagen preprocesada: {_describe_source(img_source)}")
         # Devolver la imagen preprocesada y la original para uso en visualizaciones
         return preprocessed_img, original_img, None
 
@@ -99,124 +243,240 @@ def preprocess_image(img_path):
         logging.error(error_message)
         return None, None, error_message
 
+def _downsample_heatmap(heatmap, factor):
+    """Reduce el mapa por bloques factor×factor (media); recorta los bordes que no completen un bloque."""
+    if factor <= 1:
+        return heatmap
+    h, w = heatmap.shape[0] // factor, heatmap.shape[1] // factor
+    return heatmap[:h * factor, :w * factor].reshape(h, factor, w, factor).mean(axis=(1, 3))
+
 def generate_shap_image(shap_values, image_original, output_path):
     """
-    Genera y guarda una visualización interactiva de SHAP usando Plotly.
+    Guarda la explicación SHAP como artefacto binario compacto (ver SHAP_ARTIFACT_MAGIC):
+    el mapa de calor cuantizado a uint8 (y reducido SHAP_ARTIFACT_DOWNSAMPLE veces) y una
+    referencia a la imagen original, que se guarda aparte como JPEG junto al artefacto.
+    La figura Plotly se construye en el navegador (static/js/shap_artifact.js).
     """
+    from PIL import Image
+
     try:
-        # La salida de GradientExplainer es una lista de arrays
-        shap_values_single = shap_values[0][0]
+        # Atribuciones (H, W, C) de la primera imagen
+        shap_values_single = attributions_for_images(shap_values)[0]
         # image_original is expected to be an HxWx3 uint8 numpy array
-        
-        # Crear un subplot con dos imágenes lado a lado
-        fig = make_subplots(
-            rows=1, cols=2,
-            subplot_titles=('Imagen Original', 'Áreas de Interés (SHAP)'),
-            horizontal_spacing=0.1
-        )
-        
-        # Imagen original
-        fig.add_trace(
-            go.Image(z=image_original, name='Original'),
-            row=1, col=1
-        )
-        
-        # Mapa de calor SHAP
-        shap_heatmap = np.sum(np.abs(shap_values_single), axis=-1)
-        max_abs_val = np.max(np.abs(shap_heatmap))
-        
-        fig.add_trace(
-            go.Heatmap(
-                z=shap_heatmap,
-                colorscale='RdBu',
-                zmid=0,
-                zmin=-max_abs_val,
-                zmax=max_abs_val,
-                showscale=True,
-                colorbar=dict(
-                    title='Importancia',
-                    titleside='right',
-                    thickness=15,
-                    len=0.7
-                ),
-                name='Análisis SHAP'
-            ),
-            row=1, col=2
-        )
-        
-        # Configurar el diseño
-        fig.update_layout(
-            title={
-                'text': 'Análisis Visual de Características',
-                'y':0.95,
-                'x':0.5,
-                'xanchor': 'center',
-                'yanchor': 'top',
-                'font': dict(size=20)
-            },
-            height=600,
-            width=1000,
-            showlegend=True,
-            plot_bgcolor='rgb(13, 17, 23)',
-            paper_bgcolor='rgb(13, 17, 23)',
-            font=dict(color='rgb(205, 213, 224)'),
-            margin=dict(l=40, r=40, t=60, b=40)
-        )
-        
-        # Actualizar los ejes
-        fig.update_xaxes(showgrid=False, zeroline=False)
-        fig.update_yaxes(showgrid=False, zeroline=False)
-        
-        # Guardar como JSON para Plotly
-        plot_json = fig.to_json()
-        with open(output_path, 'w') as f:
-            f.write(plot_json)
-        
-        logging.info(f"Visualización SHAP guardada como JSON en {output_path}")
+        source_shape = list(shap_values_single.shape[:2])
+
+        # Mapa de calor SHAP, reducido y cuantizado en [0, max]
+        shap_heatmap = _downsample_heatmap(np.sum(np.abs(shap_values_single), axis=-1), SHAP_ARTIFACT_DOWNSAMPLE)
+        max_abs_val = float(np.max(shap_heatmap))
+        scale = max_abs_val if max_abs_val > 0 else 1.0
+        quantized = np.clip(np.rint(shap_heatmap / scale * 255.0), 0, 255).astype(np.uint8)
+
+        # La imagen original se referencia por nombre (mismo directorio que el artefacto)
+        stem = os.path.splitext(output_path)[0]
+        image_path = f"{stem}.jpg"
+        Image.fromarray(np.asarray(image_original, dtype=np.uint8)).save(image_path, format='JPEG', quality=90)
+
+        header = json.dumps({
+            "version": 1,
+            "dtype": "uint8",
+            "shape": list(quantized.shape),
+            "source_shape": source_shape,
+            "downsample": SHAP_ARTIFACT_DOWNSAMPLE,
+            "scale": max_abs_val,
+            "image": os.path.basename(image_path),
+        }).encode('utf-8')
+        payload = SHAP_ARTIFACT_MAGIC + struct.pack('<I', len(header)) + header + quantized.tobytes()
+        with open(output_path, 'wb') as f:
+            f.write(gzip.compress(payload, compresslevel=6))
+
+        logging.debug(f"Artefacto SHAP guardado en {output_path} ({os.path.getsize(output_path)} bytes)")
         return output_path, None
     except Exception as e:
         error_message = f"Error al generar la imagen SHAP: {e}"
         logging.error(error_message)
         return None, error_message
 
-def make_prediction(img_path):
-    """
-    Realiza una predicción sobre una imagen y devuelve un resultado en formato JSON estructurado.
-    """
-    logging.info(f"Iniciando predicción para imagen: {img_path}")
-    
-    # 1. Verificar si el modelo se cargó correctamente
-    if not model:
-        error_msg = "El modelo no está disponible."
-        logging.error(error_msg)
-        return {"status": "error", "message": error_msg}
+def load_shap_artifact(path):
+    """Lee un artefacto de `generate_shap_image`. Devuelve (cabecera, mapa de calor float32)."""
+    with open(path, 'rb') as f:
+        payload = gzip.decompress(f.read())
+    if payload[:4] != SHAP_ARTIFACT_MAGIC:
+        raise ValueError(f"{path} no es un artefacto SHAP válido.")
+    (header_len,) = struct.unpack('<I', payload[4:8])
+    header = json.loads(payload[8:8 + header_len].decode('utf-8'))
+    quantized = np.frombuffer(payload[8 + header_len:], dtype=np.uint8).reshape(header["shape"])
+    return header, quantized.astype(np.float32) / 255.0 * header["scale"]
 
-    # Verificar si es una imagen válida antes de intentar procesarla
-    if not os.path.exists(img_path):
-        return {"status": "error", "message": "Archivo no encontrado"}
+def shap_filename_for(base_name):
+    """Nombre del artefacto SHAP binario asociado a una imagen."""
+    return f"shap_{base_name}.bin"
 
-    # 2. Pre-procesar la imagen de entrada
-    processed_image, original_img, error = preprocess_image(img_path)
-    if error:
-        return {"status": "error", "message": error}
+def _explanation_text(attributions, main_label):
+    """Explicación textual breve a partir de las atribuciones (H, W, C) de una imagen."""
+    try:
+        shap_heatmap = np.mean(np.abs(attributions), axis=-1)
+        # Localizar el punto de mayor importancia
+        max_idx = np.unravel_index(np.argmax(shap_heatmap), shap_heatmap.shape)
+        max_value = float(shap_heatmap[max_idx])
+        # Normalizar por el promedio para dar contexto
+        mean_val = float(np.mean(shap_heatmap))
+        ratio = max_value / (mean_val + 1e-8)
+        coord_text = f"en la región aproximada (fila={int(max_idx[0])}, col={int(max_idx[1])})"
+        importance_text = f"valor SHAP máximo {max_value:.3f} (≈{ratio:.1f}× el promedio)"
+        if main_label == 'maligno':
+            return f"El modelo favorece 'maligno' porque detectó características relevantes {coord_text} con {importance_text}."
+        return f"El modelo favorece 'benigno' porque las contribuciones locales son bajas; punto de mayor importancia {coord_text} con {importance_text}."
+    except Exception as ex:
+        logging.warning(f"No se pudo extraer explicación textual de SHAP: {ex}")
+        return "No se pudo generar una explicación textual de SHAP."
+
+def explain_predictions(items, tier='full'):
+    """
+    Explica varias imágenes con una sola llamada al explicador (los gradientes de todas
+    se calculan en lotes comunes) y guarda un artefacto por imagen bajo `static/shap/`.
 
-    # 3. Realizar la predicción
+    `items` es una lista de (processed_image, original_img, base_name, main_label).
+    Retorna una tupla (shap_plot_url, reason_text) por imagen; shap_plot_url es None si falla.
+    """
+    if not items:
+        return []
     try:
-        preds = model.predict(processed_image)
-        preds = np.asarray(preds).ravel()
-        logging.info(f"Raw model prediction output shape: {preds.shape}")
+        if explainer is None:
+            logging.warning("Explainer SHAP no inicializado; omitiendo explicación SHAP.")
+            return [(None, "No se generó explicación SHAP (recurso no inicializado).")] * len(items)
+
+        images = np.concatenate([processed for processed, *_ in items], axis=0)
+        with span('shap'):
+            attributions = attributions_for_images(explainer.shap_values(images, tier=tier)) # type: ignore
     except Exception as e:
-        error_message = f"Error durante la inferencia del modelo: {e}"
+        # No falle el endpoint si SHAP da error; devolver resultado sin SHAP
+        error_message = f"Error durante la generación de SHAP: {e}"
         logging.exception(error_message)
-        return {"status": "error", "message": error_message}
-        
-    # 4. Estructurar los resultados
-    # Como es un modelo binario con una sola salida sigmoid, interpretamos:
-    # predictions[0] es la probabilidad de que sea maligno
-    if preds.size == 0:
-        return {"status": "error", "message": "El modelo devolvió una salida vacía."}
+        return [(None, "No se pudo generar explicación SHAP debido a un error interno.")] * len(items)
+
+    # Asegurarse de que la carpeta de salida exista
+    os.makedirs("static/shap", exist_ok=True)
+    results = []
+    for (_, original_img, base_name, main_label), image_attributions in zip(items, attributions):
+        # Nombre derivado del contenido (ver `_base_name_for`), único por imagen
+        shap_filename = shap_filename_for(base_name)
+        shap_output_path = os.path.join("static/shap", shap_filename)
+
+        # Generar y guardar el artefacto (mapa cuantizado + referencia a la imagen)
+        with span('render'):
+            _, plot_err = generate_shap_image(image_attributions[np.newaxis], original_img, shap_output_path)
+        if plot_err:
+            logging.warning(f"No se pudo generar la visualización SHAP interactiva: {plot_err}")
 
-    prob_malignant = float(preds[0])
+        # Devolver la ruta relativa para el frontend, sólo si se escribió
+        shap_plot_url = None if plot_err else f"/static/shap/{shap_filename}"
+        results.append((shap_plot_url, _explanation_text(image_attributions, main_label)))
+    return results
+
+def explain_prediction(processed_image, original_img, base_name, main_label, tier='full'):
+    """
+    Calcula los valores SHAP de una imagen, guarda el artefacto SHAP bajo `static/shap/`
+    y construye una explicación textual breve.
+
+    Retorna:
+        Una tupla (shap_plot_url, reason_text). shap_plot_url es None si falla.
+    """
+    return explain_predictions([(processed_image, original_img, base_name, main_label)], tier)[0]
+
+def _artifact_path(shap_plot_url):
+    """Ruta local de un artefacto servido bajo /static/shap/."""
+    return os.path.join("static/shap", os.path.basename(shap_plot_url))
+
+def _remove_artifacts(cache_key):
+    """
+    Borra el artefacto SHAP de una entrada expulsada de la caché (y su imagen JPEG), de
+    modo que `static/shap/` queda acotado como la caché. Una entrada sin artefacto se
+    trata como un fallo de caché (ver `_cached_prediction`).
+    """
+    artifact_path = os.path.join("static/shap", shap_filename_for(cache_key))
+    for path in (artifact_path, f"{os.path.splitext(artifact_path)[0]}.jpg"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _explain_and_cache(cache_key, prediction, processed_image, original_img, base_name, main_label, tier):
+    """Trabajo SHAP asíncrono que, al terminar, completa la entrada de la caché."""
+    shap_plot_url, reason_text = explain_prediction(processed_image, original_img, base_name, main_label, tier)
+    if result_cache is not None and cache_key is not None:
+        if shap_plot_url:
+            result_cache.put(cache_key, dict(prediction, shap_plot_url=shap_plot_url, explanation=reason_text,
+                                             shap_job_id=None, shap_status='done'))
+        else:
+            result_cache.invalidate(cache_key)
+    return shap_plot_url, reason_text
+
+def _explain_group_and_cache(entries, tier):
+    """Trabajo SHAP de un grupo de imágenes: una sola llamada al explicador para todas."""
+    results = explain_predictions([entry[2:] for entry in entries], tier)
+    for (cache_key, prediction, *_), (shap_plot_url, reason_text) in zip(entries, results):
+        if result_cache is not None and cache_key is not None:
+            if shap_plot_url:
+                result_cache.put(cache_key, dict(prediction, shap_plot_url=shap_plot_url, explanation=reason_text,
+                                                 shap_job_id=None, shap_status='done'))
+            else:
+                result_cache.invalidate(cache_key)
+    return results
+
+def submit_explanations(entries, tier):
+    """
+    Encola la explicación SHAP de `entries`, tuplas (cache_key, prediction, processed_image,
+    original_img, base_name, main_label), y devuelve un identificador de trabajo por entrada.
+    """
+    if not isinstance(shap_jobs, ShapJobManager):
+        # Cola del servidor de modelo: el trabajo se ejecuta y se registra allí
+        return shap_jobs.submit_explanations(entries, tier)
+    if len(entries) == 1:
+        return [shap_jobs.submit(_explain_and_cache, *entries[0], tier)]
+    return shap_jobs.submit_group(len(entries), _explain_group_and_cache, entries, tier)
+
+def _cached_prediction(cache_key, tier=None):
+    """
+    Devuelve la predicción cacheada si su artefacto SHAP sigue disponible y, si se pide
+    un nivel SHAP, si la entrada tiene explicación y es al menos de ese nivel.
+    """
+    cached = result_cache.get(cache_key)
+    if cached is None:
+        return None
+    if tier is not None and not cached.get("shap_plot_url"):
+        # Predicción de un lote sin explicación (ver `_predict_pending`)
+        return None
+    # Las entradas anteriores a los niveles SHAP se generaron con el nivel completo
+    if tier is not None and tier_rank(cached.get("shap_tier") or 'full') < tier_rank(tier):
+        return None
+    if cached.get("shap_plot_url") and os.path.basename(cached["shap_plot_url"]) != shap_filename_for(_base_name_for(cache_key)):
+        # Entrada de una versión que nombraba el artefacto por el archivo subido: no es fiable
+        result_cache.invalidate(cache_key)
+        return None
+    if cached.get("shap_status") == 'done' and not os.path.exists(_artifact_path(cached["shap_plot_url"])):
+        # El artefacto se borró: recalcular
+        result_cache.invalidate(cache_key)
+        return None
+    return cached
+
+def get_cache_stats():
+    """Contadores de la caché de resultados (o None si está desactivada)."""
+    return result_cache.stats() if result_cache is not None else None
+
+def get_shap_stats():
+    """Profundidad de la cola de trabajos SHAP (o None si no hay gestor de trabajos)."""
+    if shap_jobs is None:
+        return None
+    return {"pending": shap_jobs.pending_count(), "workers": SHAP_WORKERS}
+
+def get_shap_job(job_id, wait=0.0):
+    """Estado de un trabajo SHAP asíncrono, o None si no existe."""
+    if shap_jobs is None:
+        return None
+    return shap_jobs.get(job_id, wait=wait)
+
+def build_prediction(prob_malignant):
+    """Estructura la salida del modelo (probabilidad de malignidad) en el formato de respuesta."""
     prob_benign = 1.0 - prob_malignant
 
     results = [
@@ -239,70 +499,203 @@ def make_prediction(img_path):
     else:
         decision_label = 'indeterminado'
 
-    # 5. Generar explicabilidad SHAP
-    try:
-        if explainer is None:
-            logging.warning("Explainer SHAP no inicializado; omitiendo explicación SHAP.")
-            shap_plot_url = None
-            reason_text = "No se generó explicación SHAP (recurso no inicializado)."
-        else:
-            shap_values = explainer.shap_values(processed_image) # type: ignore
-            # Asegurarse de que la carpeta de salida exista
-            os.makedirs("static/shap", exist_ok=True)
-            # Usar el nombre base del archivo sin extensión para evitar duplicados
-            base_name = os.path.splitext(os.path.basename(img_path))[0]
-            shap_filename = f"shap_{base_name}.json"
-            shap_output_path = os.path.join("static/shap", shap_filename)
-
-            # Generar y guardar la visualización Plotly (JSON)
-            plot_path, plot_err = generate_shap_image(shap_values, original_img, shap_output_path)
-            if plot_err:
-                logging.warning(f"No se pudo generar la visualización SHAP interactiva: {plot_err}")
-
-            # Devolver la ruta relativa para el frontend (JSON para Plotly)
-            shap_plot_url = f"/static/shap/{shap_filename}"
-
-            # Construir una explicación textual breve basada en el mapa SHAP
-            try:
-                # shap_values_single: [height, width, channels]
-                shap_values_single = shap_values[0][0]
-                shap_heatmap = np.mean(np.abs(shap_values_single), axis=-1)
-                # Localizar el punto de mayor importancia
-                max_idx = np.unravel_index(np.argmax(shap_heatmap), shap_heatmap.shape)
-                max_value = float(shap_heatmap[max_idx])
-                # Normalizar por el promedio para dar contexto
-                mean_val = float(np.mean(shap_heatmap))
-                ratio = max_value / (mean_val + 1e-8)
-                coord_text = f"en la región aproximada (fila={int(max_idx[0])}, col={int(max_idx[1])})"
-                importance_text = f"valor SHAP máximo {max_value:.3f} (≈{ratio:.1f}× el promedio)"
-                if main_diagnosis['name'] == 'maligno':
-                    reason_text = f"El modelo favorece 'maligno' porque detectó características relevantes {coord_text} con {importance_text}."
-                else:
-                    reason_text = f"El modelo favorece 'benigno' porque las contribuciones locales son bajas; punto de mayor importancia {coord_text} con {importance_text}."
-            except Exception as ex:
-                logging.warning(f"No se pudo extraer explicación textual de SHAP: {ex}")
-                reason_text = "No se pudo generar una explicación textual de SHAP." 
-    except Exception as e:
-        # No falle el endpoint si SHAP da error; devolver resultado sin SHAP
-        error_message = f"Error durante la generación de SHAP: {e}"
-        logging.exception(error_message)
-        shap_plot_url = None
-        reason_text = "No se pudo generar explicación SHAP debido a un error interno." 
-
-    # 6. Ensamblar la respuesta final en el formato JSON solicitado
-    final_response = {
-        "status": "success",
-        "prediction": {
-            "main_diagnosis": main_diagnosis,
-            "differential_diagnoses": differential_diagnoses,
-            "shap_plot_url": shap_plot_url,
-            "explanation": reason_text,
-            "decision": decision_label,
-            "probabilities": {
-                "maligno": prob_malignant,
-                "benigno": prob_benign
-            }
+    return {
+        "main_diagnosis": main_diagnosis,
+        "differential_diagnoses": differential_diagnoses,
+        "shap_plot_url": None,
+        "shap_job_id": None,
+        "shap_status": None,
+        "shap_tier": None,
+        "explanation": None,
+        "decision": decision_label,
+        "probabilities": {
+            "maligno": prob_malignant,
+            "benigno": prob_benign
         }
     }
+
+def _base_name_for(cache_key):
+    """
+    Nombre base del artefacto SHAP: el hash de contenido de la imagen (o un uuid por
+    resultado si la caché está desactivada). Nunca el nombre de archivo subido, que
+    puede repetirse entre imágenes distintas y servir la explicación de otra.
+    """
+    return cache_key or uuid.uuid4().hex
+
+def _attach_explanation(prediction, processed_image, original_img, base_name, cache_key, async_shap, tier):
+    """Completa los campos SHAP de `prediction` (en segundo plano o en línea) y la guarda en caché."""
+    main_label = prediction["main_diagnosis"]["name"]
+    prediction["shap_tier"] = tier
+    if async_shap and explainer is not None and shap_jobs is not None:
+        # Ruta donde quedará el artefacto; el cliente debe esperar a que el trabajo termine
+        prediction["shap_plot_url"] = f"/static/shap/{shap_filename_for(base_name)}"
+        prediction["shap_status"] = 'pending'
+        prediction["explanation"] = "La explicación SHAP se está generando en segundo plano."
+        (prediction["shap_job_id"],) = submit_explanations(
+            [(cache_key, dict(prediction), processed_image, original_img, base_name, main_label)], tier)
+        if result_cache is not None and cache_key is not None:
+            # Mientras el trabajo esté en curso, las subidas repetidas comparten el mismo job
+            result_cache.put(cache_key, prediction, persist=False)
+    else:
+        shap_plot_url, reason_text = explain_prediction(processed_image, original_img, base_name, main_label, tier)
+        prediction["shap_plot_url"] = shap_plot_url
+        prediction["explanation"] = reason_text
+        if shap_plot_url:
+            prediction["shap_status"] = 'done'
+            if result_cache is not None and cache_key is not None:
+                result_cache.put(cache_key, prediction)
+
+def make_prediction(img_source, async_shap=None, image_name=None, shap_tier=None, batched=True):
+    """
+    Realiza una predicción sobre una imagen y devuelve un resultado en formato JSON estructurado.
+
+    `img_source` es una ruta o los bytes de la imagen (ver `preprocess_image`);
+    `image_name` sólo identifica la imagen en el log; el artefacto SHAP se nombra
+    por el hash de su contenido (ver `_base_name_for`).
+
+    Si `async_shap` es verdadero (por defecto, según SHAP_ASYNC), la explicación SHAP
+    se calcula en segundo plano y la respuesta incluye `shap_job_id` para consultarla.
+    `shap_tier` elige el nivel de la explicación ('coarse', 'fast' o 'full'; ver
+    `choose_shap_tier`, que lo rebaja si la cola SHAP está llena).
+    Con `batched` falso el forward pass se ejecuta en el hilo del llamador, sin pasar
+    por el planificador de micro-lotes (peticiones perfiladas, ver profiling.py).
+    """
+    logging.debug(f"Iniciando predicción para imagen: {image_name or _describe_source(img_source)}")
     
-    return final_response
+    # 1. Verificar si el modelo (o el servidor de modelo) se cargó correctamente
+    if engine is None:
+        error_msg = "El modelo no está disponible."
+        logging.error(error_msg)
+        return {"status": "error", "message": error_msg}
+
+    # Verificar si es una imagen válida antes de intentar procesarla
+    if isinstance(img_source, str) and not os.path.exists(img_source):
+        return {"status": "error", "message": "Archivo no encontrado"}
+
+    # 2. Pre-procesar la imagen de entrada
+    processed_image, original_img, error = preprocess_image(img_source)
+    if error:
+        return {"status": "error", "message": error}
+
+    # 3. Consultar la caché por contenido: una imagen repetida no vuelve a pasar por el modelo
+    tier = choose_shap_tier(shap_tier)
+    cache_key = None
+    if result_cache is not None:
+        cache_key = compute_cache_key(processed_image, model_version)
+        cached = _cached_prediction(cache_key, tier)
+        if cached is not None:
+            logging.debug(f"Resultado obtenido de la caché para {image_name or _describe_source(img_source)}")
+            return {"status": "success", "cached": True, "prediction": cached}
+
+    # 4. Realizar la predicción
+    try:
+        with span('inference'):
+            preds = run_inference(processed_image, batched=batched)
+        preds = np.asarray(preds).ravel()
+    except Exception as e:
+        error_message = f"Error durante la inferencia del modelo: {e}"
+        logging.exception(error_message)
+        return {"status": "error", "message": error_message}
+        
+    # 5. Estructurar los resultados
+    # Como es un modelo binario con una sola salida sigmoid, interpretamos:
+    # predictions[0] es la probabilidad de que sea maligno
+    if preds.size == 0:
+        return {"status": "error", "message": "El modelo devolvió una salida vacía."}
+    prediction = build_prediction(float(preds[0]))
+
+    # 6. Generar explicabilidad SHAP (en segundo plano o en línea)
+    if async_shap is None:
+        async_shap = SHAP_ASYNC
+    _attach_explanation(prediction, processed_image, original_img,
+                        _base_name_for(cache_key), cache_key, async_shap, tier)
+
+    # 7. Ensamblar la respuesta final en el formato JSON solicitado
+    return {"status": "success", "cached": False, "prediction": prediction}
+
+def _predict_pending(pending, explain, shap_tier):
+    """Ejecuta un forward pass sobre el lote `pending` y produce (nombre, respuesta) por imagen."""
+    try:
+        with span('inference'):
+            probs = np.asarray(engine.predict(np.concatenate([p[1] for p in pending], axis=0))).reshape(len(pending), -1)
+    except Exception as e:
+        error_message = f"Error durante la inferencia del modelo: {e}"
+        logging.exception(error_message)
+        for name, *_ in pending:
+            yield name, {"status": "error", "message": error_message}
+        return
+    predictions = [build_prediction(float(row[0])) for row in probs]
+    if explain:
+        _attach_group_explanation(pending, predictions, choose_shap_tier(shap_tier))
+    elif result_cache is not None:
+        # Sin explicación (shap_status None): sólo sirve a otros lotes sin `explain`
+        for (_, _, _, cache_key), prediction in zip(pending, predictions):
+            if cache_key is not None:
+                result_cache.put(cache_key, prediction)
+    for (name, *_), prediction in zip(pending, predictions):
+        yield name, {"status": "success", "cached": False, "prediction": prediction}
+
+def _attach_group_explanation(pending, predictions, tier):
+    """
+    Encola un único trabajo SHAP para todas las imágenes de `pending` (gradientes en
+    lotes comunes) y deja en cada predicción el identificador de su propio trabajo.
+    """
+    if explainer is None or shap_jobs is None:
+        for (name, processed_image, original_img, cache_key), prediction in zip(pending, predictions):
+            _attach_explanation(prediction, processed_image, original_img, _base_name_for(cache_key),
+                                cache_key, async_shap=False, tier=tier)
+        return
+    entries = []
+    for (name, processed_image, original_img, cache_key), prediction in zip(pending, predictions):
+        base_name = _base_name_for(cache_key)
+        prediction.update(shap_plot_url=f"/static/shap/{shap_filename_for(base_name)}", shap_status='pending',
+                          shap_tier=tier, explanation="La explicación SHAP se está generando en segundo plano.")
+        entries.append((cache_key, dict(prediction), processed_image, original_img, base_name,
+                        prediction["main_diagnosis"]["name"]))
+    job_ids = submit_explanations(entries, tier)
+    for (cache_key, *_), prediction, job_id in zip(entries, predictions, job_ids):
+        prediction["shap_job_id"] = job_id
+        if result_cache is not None and cache_key is not None:
+            # Mientras el trabajo esté en curso, las subidas repetidas comparten el mismo job
+            result_cache.put(cache_key, prediction, persist=False)
+
+def predict_images(named_sources, explain=False, shap_tier=None, max_workers=PREPROCESS_WORKERS):
+    """
+    Analiza muchas imágenes a la vez. Generador que produce (nombre, respuesta) a
+    medida que cada imagen termina, con la misma estructura que `make_prediction`.
+
+    El preprocesado se hace en paralelo en un pool de hilos y la inferencia en lotes
+    completos de BATCH_MAX_SIZE imágenes. Con `explain`, cada lote encola un único
+    trabajo SHAP que explica todas sus imágenes a la vez, con un identificador de
+    trabajo por imagen (ver `get_shap_job`) y el nivel `shap_tier`.
+    """
+    named_sources = list(named_sources)
+    if engine is None:
+        for name, _ in named_sources:
+            yield name, {"status": "error", "message": "El modelo no está disponible."}
+        return
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preprocess') as pool:
+        # Cada tarea con su copia del contexto, para que sus etapas cuenten en la traza de la petición
+        futures = {pool.submit(contextvars.copy_context().run, preprocess_image, source): name
+                   for name, source in named_sources}
+        for future in as_completed(futures):
+            name = futures[future]
+            processed_image, original_img, error = future.result()
+            if error:
+                yield name, {"status": "error", "message": error}
+                continue
+            cache_key = compute_cache_key(processed_image, model_version) if result_cache is not None else None
+            cached = None
+            if cache_key is not None:
+                cached = _cached_prediction(cache_key, choose_shap_tier(shap_tier) if explain else None)
+            if cached is not None:
+                yield name, {"status": "success", "cached": True, "prediction": cached}
+                continue
+            pending.append((name, processed_image, original_img, cache_key))
+            if len(pending) >= BATCH_MAX_SIZE:
+                yield from _predict_pending(pending, explain, shap_tier)
+                pending = []
+    if pending:
+        yield from _predict_pending(pending, explain, shap_tier)
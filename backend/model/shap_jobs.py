@@ -0,0 +1,147 @@
+"""
+Cola de trabajos asíncronos para las explicaciones SHAP.
+
+La predicción se devuelve de inmediato al cliente y la explicación (el artefacto
+SHAP bajo `static/shap/`) se calcula en un pool de hilos. El cliente consulta
+el estado del trabajo por su identificador, opcionalmente con long-polling.
+"""
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados posibles de un trabajo
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+
+class ShapJobManager:
+    """
+    Ejecuta funciones de explicación en segundo plano y guarda su estado.
+
+    Cada función debe devolver una tupla (shap_plot_url, explanation). Para acotar la
+    memoria se conservan como mucho `max_jobs` trabajos: por encima se olvidan los
+    terminados más antiguos, nunca uno encolado o en curso (si todos lo están, el
+    registro crece por encima del límite hasta que terminen).
+
+    `submit_group` encola una sola función que explica varias imágenes a la vez
+    (devuelve una tupla por imagen) y crea un trabajo consultable por cada imagen.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='shap-job')
+        self._jobs = {}
+        # Trabajos terminados, del más antiguo al más reciente (candidatos a olvidar)
+        self._finished = OrderedDict()
+        self._pending = 0
+        self._cond = threading.Condition()
+
+    def _register(self, count):
+        job_ids = [uuid.uuid4().hex for _ in range(count)]
+        with self._cond:
+            for job_id in job_ids:
+                self._jobs[job_id] = {
+                    "job_id": job_id,
+                    "status": PENDING,
+                    "shap_plot_url": None,
+                    "explanation": None,
+                    "error": None,
+                    "created_at": time.time(),
+                    "finished_at": None,
+                }
+            self._pending += count
+            self._evict()
+        return job_ids
+
+    def _evict(self):
+        while len(self._jobs) > self.max_jobs and self._finished:
+            job_id, _ = self._finished.popitem(last=False)
+            self._jobs.pop(job_id, None)
+
+    def submit(self, fn, *args, **kwargs):
+        """Encola `fn(*args, **kwargs)` y devuelve el identificador del trabajo."""
+        (job_id,) = self._register(1)
+        # El trabajo se ejecuta con el contexto del llamador (traza de la petición, ver telemetry.py)
+        self._executor.submit(contextvars.copy_context().run, self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def submit_group(self, count, fn, *args, **kwargs):
+        """
+        Encola `fn(*args, **kwargs)`, que debe devolver `count` tuplas
+        (shap_plot_url, explanation), y devuelve un identificador por tupla.
+        """
+        job_ids = self._register(count)
+        self._executor.submit(contextvars.copy_context().run, self._run_group, job_ids, fn, args, kwargs)
+        return job_ids
+
+    def pending_count(self):
+        """Número de trabajos encolados o en ejecución."""
+        with self._cond:
+            return self._pending
+
+    def get(self, job_id, wait=0.0):
+        """
+        Devuelve una copia del estado del trabajo, o None si no existe.
+        Si `wait` > 0 y el trabajo no ha terminado, espera hasta `wait` segundos.
+        """
+        deadline = time.monotonic() + max(0.0, wait)
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if job["status"] in (DONE, ERROR) or remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
+
+    def _update(self, job_id, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+            self._cond.notify_all()
+
+    def _finish(self, job_id, **fields):
+        """Marca el trabajo como terminado (DONE o ERROR) y lo hace candidato a olvidarse."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] in (PENDING, RUNNING):
+                job.update(fields, finished_at=time.time())
+                self._pending -= 1
+                self._finished[job_id] = None
+                self._evict()
+            self._cond.notify_all()
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status=RUNNING)
+        try:
+            shap_plot_url, explanation = fn(*args, **kwargs)
+            status = DONE if shap_plot_url else ERROR
+            self._finish(job_id, status=status, shap_plot_url=shap_plot_url, explanation=explanation)
+        except Exception as e:
+            logging.exception(f"Error en el trabajo SHAP {job_id}: {e}")
+            self._finish(job_id, status=ERROR, error=str(e))
+
+    def _run_group(self, job_ids, fn, args, kwargs):
+        for job_id in job_ids:
+            self._update(job_id, status=RUNNING)
+        try:
+            results = fn(*args, **kwargs)
+        except Exception as e:
+            logging.exception(f"Error en el grupo de {len(job_ids)} trabajos SHAP: {e}")
+            for job_id in job_ids:
+                self._finish(job_id, status=ERROR, error=str(e))
+            return
+        for job_id, (shap_plot_url, explanation) in zip(job_ids, results):
+            self._finish(job_id, status=DONE if shap_plot_url else ERROR, shap_plot_url=shap_plot_url,
+                         explanation=explanation)
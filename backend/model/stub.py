@@ -0,0 +1,97 @@
+"""
+Modelo simulado para pruebas de carga sin `model.h5`.
+
+Con STUB_MODEL=1, `load_trained_model` devuelve un `StubModel` en lugar del modelo
+Keras y el servidor usa `StubEngine` y `StubExplainer`: el resto del pipeline
+(decodificación, preprocesado, micro-lotes, caché, trabajos SHAP, artefactos) es el
+real, pero la inferencia y SHAP sólo esperan la latencia configurada.
+
+Las salidas son deterministas: la probabilidad de cada imagen se deriva del CRC32
+de sus píxeles preprocesados, así que la misma imagen da siempre el mismo
+diagnóstico y un corpus variado reparte las respuestas entre benigno, maligno e
+indeterminado.
+"""
+import os
+import time
+import zlib
+import numpy as np
+
+STUB_MODEL = os.getenv('STUB_MODEL', '0') == '1'
+# Latencia de cada forward pass: fija por llamada más un coste por imagen del lote
+STUB_LATENCY_MS = float(os.getenv('STUB_LATENCY_MS', '30'))
+STUB_LATENCY_PER_IMAGE_MS = float(os.getenv('STUB_LATENCY_PER_IMAGE_MS', '10'))
+# Latencia de SHAP por imagen con el nivel 'full'; los niveles baratos la escalan
+STUB_SHAP_LATENCY_MS = float(os.getenv('STUB_SHAP_LATENCY_MS', '500'))
+STUB_SHAP_TIER_FACTORS = {'coarse': 0.1, 'fast': 0.3, 'full': 1.0}
+
+STUB_INPUT_SHAPE = (224, 224, 3)
+
+
+class StubModel:
+    """Sustituto determinista del modelo Keras con la misma interfaz de `predict`."""
+
+    stub = True
+    name = 'stub_model'
+    input_shape = (None,) + STUB_INPUT_SHAPE
+    output_shape = (None, 1)
+
+    def __init__(self, latency_ms=STUB_LATENCY_MS, latency_per_image_ms=STUB_LATENCY_PER_IMAGE_MS):
+        self.latency_ms = latency_ms
+        self.latency_per_image_ms = latency_per_image_ms
+
+    def probabilities(self, batch):
+        """Probabilidad de malignidad (N, 1) de cada imagen, sin esperar."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if batch.ndim == 3:
+            batch = batch[np.newaxis]
+        checksums = [zlib.crc32(image.tobytes()) for image in batch]
+        return (np.asarray(checksums, dtype=np.float64) / 0xFFFFFFFF).astype(np.float32).reshape(-1, 1)
+
+    def predict(self, batch, verbose=0):
+        outputs = self.probabilities(batch)
+        time.sleep((self.latency_ms + self.latency_per_image_ms * len(outputs)) / 1000.0)
+        return outputs
+
+
+class StubEngine:
+    """Motor de inferencia (ver engines.py) sobre un `StubModel`."""
+
+    name = 'stub'
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return self.model.predict(batch)
+
+    def warmup(self, batch_sizes):
+        # No hay grafo que trazar
+        pass
+
+
+class StubExplainer:
+    """Explicador SHAP simulado: espera la latencia del nivel y devuelve atribuciones deterministas."""
+
+    tiers = ['coarse', 'fast', 'full']
+
+    def __init__(self, model, latency_ms=STUB_SHAP_LATENCY_MS):
+        self.model = model
+        self.latency_ms = latency_ms
+
+    def resolve_tier(self, tier):
+        return tier if tier in self.tiers else 'full'
+
+    def shap_values(self, images, tier='full'):
+        images = np.asarray(images, dtype=np.float32)
+        if images.ndim == 3:
+            images = images[np.newaxis]
+        factor = STUB_SHAP_TIER_FACTORS[self.resolve_tier(tier)]
+        time.sleep(self.latency_ms * factor * len(images) / 1000.0)
+        # Atribución proporcional a la entrada, con el signo y la escala de la probabilidad
+        probabilities = self.model.probabilities(images).reshape(-1, 1, 1, 1)
+        return images * (probabilities - 0.5) * 1e-3
+
+
+def load_stub_model(class_names):
+    """Mismo contrato que `load_trained_model`: una tupla (model, class_names)."""
+    return StubModel(), class_names
@@ -0,0 +1,162 @@
+"""
+Canal de entrada tf.data para el entrenamiento (sustituye a ImageDataGenerator).
+
+Lee la misma estructura que flow_from_directory (una carpeta por clase, clases en
+orden alfabético) y produce lotes (imágenes en [0, 1], etiquetas):
+
+ - la lista de archivos se ordena y se reparte entre shards antes de leer nada, así
+   que cada shard ve siempre los mismos archivos;
+ - lectura y decodificación en paralelo (num_parallel_calls=AUTOTUNE, orden determinista);
+ - cache() de las imágenes decodificadas y redimensionadas en uint8 (en memoria o en
+   archivo), antes de barajar y aumentar;
+ - aumentación vectorizada por lote equivalente a AUGMENTATION_PARAMS: una matriz
+   afín por imagen y un único remuestreo por lote (ver `random_affine`);
+ - prefetch() para solapar la lectura con el paso de entrenamiento.
+
+Si el directorio es un conjunto exportado en shards (ver shards.py) se lee de los
+shards en lugar de decodificar JPEGs; el resto del canal es el mismo.
+"""
+import os
+import math
+import tensorflow as tf
+
+from backend.model.training.utils import AUGMENTATION_PARAMS
+from backend.model.training.shards import is_shard_directory, make_shard_dataset
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def list_image_files(directory):
+    """
+    Archivos de imagen de `directory` ordenados por clase y nombre.
+
+    Retorna:
+        Una tupla (paths, labels, class_names), con las clases en orden alfabético
+        (el mismo índice que asigna flow_from_directory).
+    """
+    class_names = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    paths, labels = [], []
+    for index, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        for root, _, files in sorted(os.walk(class_dir)):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+                    labels.append(index)
+    return paths, labels, class_names
+
+
+def random_affine(images, params=AUGMENTATION_PARAMS, seed=None):
+    """
+    Aumentación de un lote con una única transformación afín aleatoria por imagen
+    (rotación, desplazamiento, cizalla, zoom y volteo horizontal, como ImageDataGenerator),
+    aplicada a todo el lote en una sola operación de remuestreo.
+
+    `seed` es una semilla de operación (entero) o un par (a, b): con un par se usan
+    generadores sin estado, así que la misma llamada da siempre la misma aumentación
+    (la caché de características depende de ello, ver features.py).
+    """
+    shape = tf.shape(images)
+    n = shape[0]
+    height, width = tf.cast(shape[1], tf.float32), tf.cast(shape[2], tf.float32)
+    counter = iter(range(8))
+
+    def uniform(low, high):
+        # Semilla distinta por parámetro para que no salgan correlacionados
+        index = next(counter)
+        if isinstance(seed, (tuple, list)):
+            return tf.random.stateless_uniform((n,), seed=(seed[0], seed[1] * 8 + index), minval=low, maxval=high)
+        op_seed = None if seed is None else seed * 8 + index
+        return tf.random.uniform((n,), low, high, seed=op_seed)
+
+    zeros, ones = tf.zeros((n,)), tf.ones((n,))
+    # ImageDataGenerator usa grados para la rotación y la cizalla
+    theta = uniform(-1.0, 1.0) * math.radians(params.get('rotation_range', 0))
+    shear = uniform(-1.0, 1.0) * math.radians(params.get('shear_range', 0))
+    zoom = params.get('zoom_range', 0)
+    zx, zy = uniform(1 - zoom, 1 + zoom), uniform(1 - zoom, 1 + zoom)
+    tx = uniform(-1.0, 1.0) * params.get('width_shift_range', 0) * width
+    ty = uniform(-1.0, 1.0) * params.get('height_shift_range', 0) * height
+    flip = tf.where(uniform(0.0, 1.0) < 0.5, -ones, ones) if params.get('horizontal_flip') else ones
+
+    # Matriz de salida -> entrada alrededor del centro: rotación · cizalla · zoom · volteo
+    cos_t, sin_t = tf.cos(theta), tf.sin(theta)
+    a00 = (cos_t * zx) * flip
+    a01 = (-cos_t * tf.sin(shear) - sin_t * tf.cos(shear)) * zy
+    a10 = (sin_t * zx) * flip
+    a11 = (-sin_t * tf.sin(shear) + cos_t * tf.cos(shear)) * zy
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    a02 = cx - a00 * cx - a01 * cy + tx
+    a12 = cy - a10 * cx - a11 * cy + ty
+    transforms = tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images, transforms=transforms, output_shape=shape[1:3], fill_value=0.0,
+        interpolation='BILINEAR', fill_mode=params.get('fill_mode', 'nearest').upper())
+
+
+def make_dataset(directory, image_shape=(224, 224, 3), batch_size=32, label_mode='binary', augment=False,
+                 shuffle=False, cache='memory', seed=0, num_shards=1, shard_index=0):
+    """
+    Crea el tf.data.Dataset de `directory`.
+
+    `cache`: 'memory', una ruta de archivo (cache en disco) o None para no cachear.
+    `label_mode`: 'binary' (etiqueta float) o 'categorical' (one-hot).
+    `num_shards`/`shard_index`: reparto determinista de los archivos entre trabajadores.
+    Si `directory` contiene shards exportados, `cache` no se usa (ya están decodificados).
+
+    Retorna:
+        Una tupla. En caso de éxito: ((dataset, info), None), con info =
+        {"samples", "class_names"} del shard. En caso de error: (None, error_message_string).
+    """
+    if not os.path.isdir(directory):
+        return None, f"No se encontró el directorio de imágenes: {directory}"
+    if is_shard_directory(directory):
+        dataset, info = make_shard_dataset(directory, batch_size, shuffle=shuffle, seed=seed,
+                                           num_shards=num_shards, shard_index=shard_index)
+        return (_finish(dataset, image_shape, len(info["class_names"]), label_mode, augment, seed), info), None
+
+    paths, labels, class_names = list_image_files(directory)
+    # Mismo reparto que Dataset.shard, pero calculado antes para conocer el tamaño del shard
+    paths, labels = paths[shard_index::num_shards], labels[shard_index::num_shards]
+    if not paths:
+        return None, f"No hay imágenes en {directory}"
+
+    height, width = image_shape[0], image_shape[1]
+
+    def load(path, label):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        # 'nearest' como flow_from_directory; se conserva uint8 para que la caché ocupe 4 veces menos
+        image = tf.image.resize(image, (height, width), method='nearest')
+        return tf.cast(image, tf.uint8), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(load, num_parallel_calls=AUTOTUNE, deterministic=True)
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache:
+        os.makedirs(os.path.dirname(cache) or '.', exist_ok=True)
+        dataset = dataset.cache(cache)
+    if shuffle:
+        dataset = dataset.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = _finish(dataset, image_shape, len(class_names), label_mode, augment, seed)
+    return (dataset, {"samples": len(paths), "class_names": class_names}), None
+
+
+def _finish(dataset, image_shape, num_classes, label_mode, augment, seed):
+    """Parte común a JPEGs y shards: lotes uint8 -> [0, 1], aumentación, etiquetas y prefetch."""
+    height, width = image_shape[0], image_shape[1]
+
+    def finish(images, labels):
+        if images.shape[1] != height or images.shape[2] != width:
+            images = tf.image.resize(images, (height, width), method='nearest')
+        images = tf.cast(images, tf.float32) / 255.0
+        if augment:
+            images = random_affine(images, seed=seed)
+        if label_mode == 'categorical':
+            return images, tf.one_hot(labels, num_classes)
+        return images, tf.cast(labels, tf.float32)
+
+    return dataset.map(finish, num_parallel_calls=AUTOTUNE, deterministic=True).prefetch(AUTOTUNE)
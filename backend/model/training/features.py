@@ -0,0 +1,173 @@
+"""
+Caché de características del backbone congelado para entrenar sólo la cabeza densa.
+
+ResNet50 está congelado en `create_model`, así que su salida (el vector GAP de 2048
+valores) es la misma en cada época para una misma imagen. Aquí se calcula una sola vez
+por imagen (y por cada una de K aumentaciones fijas) y se guarda en un array mapeado
+en memoria; la cabeza (dense_1 + output) se entrena después directamente sobre esos
+vectores y sus pesos se copian al modelo completo para guardarlo como siempre.
+
+Las imágenes se leen con el mismo canal tf.data que el entrenamiento completo
+(data.py): decodificación en paralelo, o lectura directa de los shards exportados,
+y aumentación vectorizada por lote con `random_affine`.
+
+Estructura de la caché (un directorio por conjunto, p. ej. cache/features/train):
+ - features.npy: float32 (filas, dim), abierto con np.load(mmap_mode='r')
+ - labels.npy: etiqueta de cada fila
+ - meta.json: huella de las imágenes y de la configuración; si no coincide, se recalcula
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Dense, Input # type: ignore
+from tensorflow.keras import Model # type: ignore
+
+from backend.model.training.utils import AUGMENTATION_PARAMS
+from backend.model.training.data import list_image_files, make_dataset, random_affine
+from backend.model.training.shards import is_shard_directory
+
+# Nombre de la capa cuya salida se cachea (ver create_model)
+FEATURE_LAYER = 'gap'
+# Capas de la cabeza que se entrenan sobre las características
+HEAD_LAYERS = ('dense_1', 'output')
+FEATURE_CACHE_VERSION = 2
+
+
+def build_backbone(model):
+    """Submodelo imagen -> vector GAP del modelo completo."""
+    return Model(inputs=model.input, outputs=model.get_layer(FEATURE_LAYER).output, name='frozen_backbone')
+
+
+def _source_files(directory):
+    """Archivos de los que salen las imágenes: los JPEG/PNG o, si hay shards, los del conjunto exportado."""
+    if is_shard_directory(directory):
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    paths, _, _ = list_image_files(directory)
+    return paths
+
+
+def _fingerprint(directory, paths, image_shape, augmentations, batch_size, seed, weights):
+    """Huella de las imágenes (ruta, tamaño, fecha) y de todo lo que cambia las características."""
+    digest = hashlib.sha256()
+    # La aumentación de cada imagen depende de su lote, así que también del tamaño de lote
+    digest.update(json.dumps([FEATURE_CACHE_VERSION, list(image_shape), augmentations, batch_size, seed, weights,
+                              AUGMENTATION_PARAMS]).encode('utf-8'))
+    for path in paths:
+        st = os.stat(path)
+        digest.update(f"{os.path.relpath(path, directory)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _load_cached(cache_dir, fingerprint):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') != fingerprint:
+            return None
+        features = np.load(os.path.join(cache_dir, 'features.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(cache_dir, 'labels.npy'))
+    except (OSError, ValueError):
+        return None
+    return features, labels, meta
+
+
+def compute_feature_cache(directory, backbone, cache_dir, image_shape=(224, 224, 3), augmentations=0,
+                          batch_size=32, seed=0, weights='imagenet'):
+    """
+    Calcula (o reutiliza) las características de todas las imágenes de `directory`
+    (una carpeta por clase, o un conjunto exportado en shards; ver `make_dataset`).
+
+    Se guardan `augmentations + 1` filas por imagen: la imagen original y K
+    aumentaciones fijas (la aumentación k del lote b usa siempre la semilla (seed, b·(K+1)+k)).
+
+    Retorna:
+        Una tupla. En caso de éxito: ((features, labels, meta), None), con `features`
+        mapeado en memoria. En caso de error: (None, error_message_string).
+    """
+    # Sin caché de tf.data: cada imagen se lee una sola vez
+    result, error = make_dataset(directory, image_shape, batch_size, label_mode='binary', cache=None)
+    if error:
+        return None, error
+    dataset, info = result
+
+    fingerprint = _fingerprint(directory, _source_files(directory), image_shape, augmentations, batch_size,
+                               seed, weights)
+    cached = _load_cached(cache_dir, fingerprint)
+    if cached is not None:
+        logging.info(f"Características reutilizadas de {cache_dir}: {cached[0].shape[0]} filas")
+        return cached, None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    passes = augmentations + 1
+    rows = info["samples"] * passes
+    dim = int(backbone.output_shape[-1])
+    # Se escribe en archivos temporales y se renombran al final: una ejecución
+    # interrumpida nunca deja una caché a medias que parezca válida
+    tmp_path = os.path.join(cache_dir, 'features.tmp.npy')
+    features = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(rows, dim))
+    labels = np.empty(rows, dtype=np.float32)
+
+    started = time.perf_counter()
+    logging.info(f"Calculando características de {info['samples']} imágenes × {passes} pasadas...")
+    first = 0
+    for b, (images, batch_labels) in enumerate(dataset):
+        indices = np.arange(first, first + len(images))
+        first += len(images)
+        for k in range(passes):
+            batch = random_affine(images, seed=(seed, b * passes + k)) if k else images
+            # Fila de la aumentación k de la imagen i: i * passes + k
+            rows_k = indices * passes + k
+            features[rows_k] = backbone(batch, training=False).numpy()
+            labels[rows_k] = batch_labels.numpy()
+    features.flush()
+    del features
+
+    np.save(os.path.join(cache_dir, 'labels.npy'), labels)
+    os.replace(tmp_path, os.path.join(cache_dir, 'features.npy'))
+    meta = {
+        "fingerprint": fingerprint,
+        "samples": info["samples"],
+        "augmentations": augmentations,
+        "class_indices": {name: index for index, name in enumerate(info["class_names"])},
+        "dim": dim,
+    }
+    with open(os.path.join(cache_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    logging.info(f"Características guardadas en {cache_dir} ({rows}×{dim}) en {time.perf_counter() - started:.1f}s")
+    return _load_cached(cache_dir, fingerprint), None
+
+
+def build_head(model):
+    """Cabeza densa con la misma arquitectura que la del modelo completo, sobre el vector GAP."""
+    inputs = Input(shape=(int(model.get_layer(FEATURE_LAYER).output.shape[-1]),), name='features')
+    x = inputs
+    for name in HEAD_LAYERS:
+        layer = model.get_layer(name)
+        x = Dense(layer.units, activation=layer.activation, name=name)(x)
+    return Model(inputs=inputs, outputs=x, name='head')
+
+
+def transfer_head_weights(head, model):
+    """Copia los pesos de la cabeza entrenada al modelo completo."""
+    for name in HEAD_LAYERS:
+        model.get_layer(name).set_weights(head.get_layer(name).get_weights())
+
+
+def train_head(model, train_features, train_labels, validation_data=None, learning_rate=0.0001,
+               epochs=15, batch_size=32):
+    """
+    Entrena la cabeza de `model` sobre características precalculadas y copia los pesos
+    resultantes a `model`. Pensado también para barridos de hiperparámetros: cada
+    llamada parte de una cabeza nueva. Retorna el History de Keras.
+    """
+    head = build_head(model)
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                 loss='binary_crossentropy', metrics=['accuracy'])
+    history = head.fit(train_features, train_labels, epochs=epochs, batch_size=batch_size,
+                       shuffle=True, validation_data=validation_data)
+    transfer_head_weights(head, model)
+    return history
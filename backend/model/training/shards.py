@@ -0,0 +1,123 @@
+"""
+Lectura de los conjuntos exportados en shards por `prepare_data.py --export`.
+
+Cada conjunto (p. ej. data/shards/train) contiene:
+ - shard-00000.npy, ... : arrays uint8 (n, 224, 224, 3), o shard-00000.tfrecord con
+   ejemplos {image (bytes uint8), shape, label, image_id};
+ - labels.npy: índice de clase de cada registro, en el orden de los shards;
+ - index.json: formato, forma de imagen, clases, lista de shards {file, count} y,
+   por registro, su etiqueta y los metadatos de HAM10000_metadata.csv.
+
+Los shards NPY se abren mapeados en memoria, así que leer cualquier registro cuesta
+una copia de 150 KB sin decodificar nada; los TFRecord se leen de forma secuencial.
+"""
+import os
+import json
+import numpy as np
+
+INDEX_FILE = 'index.json'
+
+
+def is_shard_directory(directory):
+    return os.path.isfile(os.path.join(directory, INDEX_FILE))
+
+
+class ShardedDataset:
+    """Conjunto exportado en shards, con acceso aleatorio por índice global (formato NPY)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.format = self.index['format']
+        self.image_shape = tuple(self.index['image_shape'])
+        self.class_names = self.index['class_names']
+        self.records = self.index['records']
+        self.labels = np.load(os.path.join(directory, 'labels.npy'))
+        self.paths = [os.path.join(directory, shard['file']) for shard in self.index['shards']]
+        counts = [shard['count'] for shard in self.index['shards']]
+        # Primer índice global de cada shard
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._arrays = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _shard(self, number):
+        array = self._arrays.get(number)
+        if array is None:
+            array = self._arrays[number] = np.load(self.paths[number], mmap_mode='r')
+        return array
+
+    def read(self, indices):
+        """Imágenes uint8 (k, H, W, C) y etiquetas de los registros `indices`, en ese orden."""
+        if self.format != 'npy':
+            raise ValueError("El acceso aleatorio sólo está disponible para shards NPY.")
+        indices = np.asarray(indices, dtype=np.int64)
+        images = np.empty((len(indices),) + self.image_shape, dtype=np.uint8)
+        shard_numbers = np.searchsorted(self.offsets, indices, side='right') - 1
+        for number in np.unique(shard_numbers):
+            positions = np.flatnonzero(shard_numbers == number)
+            local = indices[positions] - self.offsets[number]
+            # Lectura en orden creciente dentro del shard (acceso secuencial al mapa de memoria)
+            order = np.argsort(local)
+            images[positions[order]] = self._shard(number)[local[order]]
+        return images, self.labels[indices]
+
+    def __getitem__(self, i):
+        images, labels = self.read([i])
+        return images[0], labels[0]
+
+    def iter_batches(self, batch_size=32):
+        """Recorre el conjunto secuencialmente, shard a shard, en lotes (imágenes uint8, etiquetas)."""
+        for start in range(0, len(self), batch_size):
+            yield self.read(np.arange(start, min(start + batch_size, len(self))))
+
+
+def make_shard_dataset(directory, batch_size=32, shuffle=False, seed=0, num_shards=1, shard_index=0):
+    """
+    tf.data.Dataset de lotes (imágenes uint8, etiquetas enteras) leídos de los shards.
+
+    Con shards NPY se barajan los índices (no las imágenes) y cada lote se lee de
+    los mapas de memoria; con TFRecord se leen los archivos en paralelo y se baraja
+    con un búfer. Retorna (dataset, info) con info = {"samples", "class_names"}.
+    """
+    import tensorflow as tf
+
+    shards = ShardedDataset(directory)
+    height, width, channels = shards.image_shape
+    samples = len(range(shard_index, len(shards), num_shards))
+
+    if shards.format == 'npy':
+        def read_batch(indices):
+            images, labels = shards.read(indices)
+            return images, labels.astype(np.int64)
+
+        def load(indices):
+            images, labels = tf.numpy_function(read_batch, [indices], (tf.uint8, tf.int64))
+            images.set_shape((None, height, width, channels))
+            labels.set_shape((None,))
+            return images, labels
+
+        dataset = tf.data.Dataset.range(len(shards)).shard(num_shards, shard_index)
+        if shuffle:
+            dataset = dataset.shuffle(samples, seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size).map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=True)
+    else:
+        spec = {
+            'image': tf.io.FixedLenFeature([], tf.string),
+            'label': tf.io.FixedLenFeature([], tf.int64),
+        }
+
+        def parse(serialized):
+            example = tf.io.parse_single_example(serialized, spec)
+            image = tf.reshape(tf.io.decode_raw(example['image'], tf.uint8), (height, width, channels))
+            return image, example['label']
+
+        dataset = tf.data.TFRecordDataset(shards.paths, num_parallel_reads=tf.data.AUTOTUNE)
+        dataset = dataset.shard(num_shards, shard_index).map(parse, num_parallel_calls=tf.data.AUTOTUNE,
+                                                             deterministic=True)
+        if shuffle:
+            dataset = dataset.shuffle(min(samples, 2048), seed=seed, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size)
+    return dataset, {"samples": samples, "class_names": shards.class_names}
@@ -2,9 +2,9 @@
 import os
 import logging
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
 from tensorflow.keras.optimizers import Adam # type: ignore
 from backend.model.model import create_model
+from backend.model.training.data import make_dataset
 
 # --- Configuración y Constantes ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,6 +19,66 @@ MODEL_SAVE_PATH = 'backend/model/model.h5'
 IMG_SHAPE = (224, 224, 3)
 BATCH_SIZE = 32
 EPOCHS = 15 # Número de veces que el modelo verá todo el dataset
+LEARNING_RATE = 0.0001
+
+# 'full': imágenes aumentadas a través del modelo completo en cada época.
+# 'features': el backbone congelado se ejecuta una sola vez por imagen y la cabeza
+# densa se entrena sobre los vectores cacheados (ver features.py).
+TRAINING_MODE = os.getenv('TRAINING_MODE', 'full')
+FEATURE_CACHE_DIR = os.getenv('FEATURE_CACHE_DIR', 'cache/features')
+# Aumentaciones fijas por imagen de entrenamiento en el modo 'features'
+FEATURE_AUGMENTATIONS = int(os.getenv('FEATURE_AUGMENTATIONS', '0'))
+
+# Caché de imágenes decodificadas del canal tf.data: 'memory', una ruta de archivo o 'none'
+DATA_CACHE = os.getenv('TRAIN_DATA_CACHE', 'memory')
+# Reparto determinista de los archivos entre trabajadores (entrenamiento distribuido)
+NUM_SHARDS = int(os.getenv('TRAIN_NUM_SHARDS', '1'))
+SHARD_INDEX = int(os.getenv('TRAIN_SHARD_INDEX', '0'))
+SEED = int(os.getenv('TRAIN_SEED', '0'))
+# Leer los conjuntos exportados en shards (prepare_data.py --export) en lugar de los JPEGs
+USE_SHARDS = os.getenv('TRAIN_USE_SHARDS', '0') == '1'
+
+def save_model(model):
+    """Guarda el modelo completo (arquitectura + pesos) en MODEL_SAVE_PATH."""
+    try:
+        # Asegurarse de que el directorio del modelo exista
+        os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
+        model.save(MODEL_SAVE_PATH)
+        logging.info(f"El modelo completo ha sido guardado exitosamente en: {MODEL_SAVE_PATH}")
+    except Exception as e:
+        logging.error(f"Ocurrió un error al guardar el modelo: {e}")
+
+def run_feature_training():
+    """
+    Entrenamiento de la cabeza sobre características precalculadas del backbone congelado.
+    Las características se reutilizan entre ejecuciones mientras no cambien las imágenes.
+    """
+    from backend.model.training.features import build_backbone, compute_feature_cache, train_head
+
+    model, error = create_model()
+    if error:
+        logging.error(f"No se pudo crear el modelo. Abortando entrenamiento. Error: {error}")
+        return
+    backbone = build_backbone(model)
+
+    cached = {}
+    for split, augmentations in (('train', FEATURE_AUGMENTATIONS), ('validation', 0)):
+        split_dir = os.path.join(DATA_DIR, 'shards', split) if USE_SHARDS else os.path.join(DATA_DIR, split)
+        result, error = compute_feature_cache(split_dir, backbone,
+                                              os.path.join(FEATURE_CACHE_DIR, split), IMG_SHAPE,
+                                              augmentations=augmentations, batch_size=BATCH_SIZE)
+        if error:
+            logging.error(error)
+            return
+        cached[split] = result
+
+    train_features, train_labels, _ = cached['train']
+    val_features, val_labels, _ = cached['validation']
+    logging.info(f"Entrenando la cabeza sobre {len(train_features)} vectores de características...")
+    train_head(model, train_features, train_labels, validation_data=(val_features, val_labels),
+               learning_rate=LEARNING_RATE, epochs=EPOCHS, batch_size=BATCH_SIZE)
+    logging.info("Entrenamiento completado.")
+    save_model(model)
 
 def run_training():
     """
@@ -30,39 +90,30 @@ def run_training():
         logging.error("Por favor, crea la estructura de carpetas: data/train/benign, data/train/malignant y data/validation/benign, data/validation/malignant.")
         return
 
-    # 2. Generadores de Datos (Data Augmentation y Carga)
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=40,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        fill_mode='nearest'
-    )
-
-    validation_datagen = ImageDataGenerator(rescale=1./255)
-
-    try:
-        train_generator = train_datagen.flow_from_directory(
-            os.path.join(DATA_DIR, 'train'),
-            target_size=(IMG_SHAPE[0], IMG_SHAPE[1]),
-            batch_size=BATCH_SIZE,
-            class_mode='binary'
-        )
-
-        validation_generator = validation_datagen.flow_from_directory(
-            os.path.join(DATA_DIR, 'validation'),
-            target_size=(IMG_SHAPE[0], IMG_SHAPE[1]),
-            batch_size=BATCH_SIZE,
-            class_mode='binary'
-        )
-    except FileNotFoundError as e:
-        logging.error(f"Error al buscar las carpetas de imágenes: {e}")
-        logging.error("Asegúrate de que la estructura 'data/train/[clases]' y 'data/validation/[clases]' existe.")
+    if TRAINING_MODE == 'features':
+        run_feature_training()
         return
 
+    # 2. Canales de datos tf.data (decodificación en paralelo, caché, aumentación y prefetch)
+    def cache_for(split):
+        if DATA_CACHE in ('none', ''):
+            return None
+        return DATA_CACHE if DATA_CACHE == 'memory' else f"{DATA_CACHE}_{split}_{SHARD_INDEX}"
+
+    datasets = {}
+    for split, augment in (('train', True), ('validation', False)):
+        split_dir = os.path.join(DATA_DIR, 'shards', split) if USE_SHARDS else os.path.join(DATA_DIR, split)
+        result, error = make_dataset(split_dir, IMG_SHAPE, BATCH_SIZE, label_mode='binary',
+                                     augment=augment, shuffle=augment, cache=cache_for(split), seed=SEED,
+                                     num_shards=NUM_SHARDS, shard_index=SHARD_INDEX)
+        if error:
+            logging.error(f"Error al buscar las carpetas de imágenes: {error}")
+            logging.error("Asegúrate de que la estructura 'data/train/[clases]' y 'data/validation/[clases]' existe.")
+            return
+        datasets[split] = result
+    (train_dataset, train_info), (validation_dataset, _) = datasets['train'], datasets['validation']
+    logging.info(f"Entrenamiento con {train_info['samples']} imágenes, clases {train_info['class_names']}")
+
     # 3. Creación y Compilación del Modelo
     model, error = create_model()
     if error:
@@ -73,7 +124,7 @@ def run_training():
         logging.error("No se pudo crear el modelo")
         return
         
-    optimizer = Adam(learning_rate=0.0001)
+    optimizer = Adam(learning_rate=LEARNING_RATE)
     model.compile(
         optimizer=optimizer,
         loss='binary_crossentropy',
@@ -89,24 +140,15 @@ def run_training():
 
     # 4. Entrenamiento del Modelo
     history = model.fit(
-        train_generator,
+        train_dataset,
         epochs=EPOCHS,
-        validation_data=validation_generator,
-        steps_per_epoch=train_generator.samples // BATCH_SIZE,
-        validation_steps=validation_generator.samples // BATCH_SIZE
+        validation_data=validation_dataset
     )
 
     logging.info("Entrenamiento completado.")
 
     # 5. Guardado del Modelo Completo
-    try:
-        # Asegurarse de que el directorio del modelo exista
-        os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
-        # Guardar el modelo completo (arquitectura + pesos)
-        model.save(MODEL_SAVE_PATH)
-        logging.info(f"El modelo completo ha sido guardado exitosamente en: {MODEL_SAVE_PATH}")
-    except Exception as e:
-        logging.error(f"Ocurrió un error al guardar el modelo: {e}")
+    save_model(model)
 
 
 if __name__ == '__main__':
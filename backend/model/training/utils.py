@@ -0,0 +1,14 @@
+"""
+Utilidades compartidas por los modos de entrenamiento.
+"""
+
+# Aumentación de datos del conjunto de entrenamiento (parámetros de ImageDataGenerator)
+AUGMENTATION_PARAMS = dict(
+    rotation_range=40,
+    width_shift_range=0.2,
+    height_shift_range=0.2,
+    shear_range=0.2,
+    zoom_range=0.2,
+    horizontal_flip=True,
+    fill_mode='nearest'
+)
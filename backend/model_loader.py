@@ -0,0 +1,67 @@
+"""
+Carga del modelo de piel en segundo plano con sonda de disponibilidad.
+
+Permite que la aplicación sirva las páginas estáticas y el endpoint de salud
+de inmediato mientras TensorFlow, el modelo y el explicador SHAP se cargan en
+un hilo aparte.
+"""
+import time
+import logging
+import threading
+
+# Estados de carga
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ModelLoader:
+    """Ejecuta `load_fn` una vez (en línea o en un hilo) y expone su estado."""
+
+    def __init__(self, load_fn):
+        self._load_fn = load_fn
+        self._ready_event = threading.Event()
+        self._thread = None
+        self.status = LOADING
+        self.error = None
+        self.started_at = None
+        self.load_seconds = None
+
+    @property
+    def ready(self):
+        return self.status == READY
+
+    def load(self):
+        """Carga el modelo en el hilo actual."""
+        self.started_at = time.time()
+        started = time.perf_counter()
+        try:
+            self._load_fn()
+            self.status = READY
+        except Exception as e:
+            logging.error(f"Error fatal al cargar el modelo de piel: {e}")
+            self.error = str(e)
+            self.status = FAILED
+        finally:
+            self.load_seconds = time.perf_counter() - started
+            self._ready_event.set()
+        if self.status == READY:
+            logging.info(f"Modelo de piel listo en {self.load_seconds:.2f} s.")
+
+    def start(self):
+        """Lanza la carga en un hilo de fondo y retorna de inmediato."""
+        self._thread = threading.Thread(target=self.load, name='model-loader', daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Espera a que termine la carga; devuelve True si el modelo está listo."""
+        self._ready_event.wait(timeout)
+        return self.ready
+
+    def describe(self):
+        return {
+            "status": self.status,
+            "error": self.error,
+            "started_at": self.started_at,
+            "load_seconds": self.load_seconds,
+        }
@@ -0,0 +1,222 @@
+"""
+Perfilado bajo demanda de las peticiones lentas de análisis de piel.
+
+Una petición se perfila si trae la cabecera PROFILE_HEADER con el valor de
+PROFILE_ADMIN_TOKEN, o al azar con probabilidad PROFILE_SAMPLE_RATE. Alrededor de
+`make_prediction` se captura un perfil de cProfile (o de pyinstrument, si está
+instalado y PROFILE_ENGINE=pyinstrument) y, con PROFILE_TF_TRACE=1, una traza del
+profiler de TensorFlow. Sólo se guardan los perfiles de las peticiones que superan
+PROFILE_THRESHOLD_MS; los demás se descartan.
+
+Los perfiles se guardan en PROFILE_DIR como un anillo acotado: por cada perfil, un
+JSON de metadatos y sus archivos (`.prof` para pstats/snakeviz, `.html` de
+pyinstrument, `-tf.zip` con la traza para TensorBoard), y al superar
+PROFILE_MAX_FILES perfiles se borran los más antiguos.
+
+cProfile y pyinstrument sólo observan el hilo que los activa, y normalmente el
+forward pass corre en el hilo del planificador de micro-lotes y SHAP en el pool de
+trabajos SHAP. Por eso una petición perfilada se atiende por la ruta síncrona y sin
+micro-lotes (ver `profile`): inferencia y SHAP en el hilo de la petición, que es el
+que se captura. En modo multi-proceso el modelo está en el servidor de modelo y el
+perfil sólo muestra la espera de la llamada IPC.
+
+El perfilador de TensorFlow es global al proceso, así que se perfila como mucho una
+petición a la vez; si ya hay una en curso, la siguiente se atiende sin perfilar.
+"""
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+# Cabecera para pedir el perfil de una petición; su valor debe ser PROFILE_ADMIN_TOKEN
+PROFILE_HEADER = 'X-Profile'
+# Token de los endpoints de administración (/admin/profiles); vacío los desactiva
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN', '')
+PROFILE_THRESHOLD_MS = float(os.getenv('PROFILE_THRESHOLD_MS', '1000'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '50'))
+# 'cprofile' o 'pyinstrument' (opcional; si no está instalado se usa cProfile)
+PROFILE_ENGINE = os.getenv('PROFILE_ENGINE', 'cprofile')
+PROFILE_TF_TRACE = os.getenv('PROFILE_TF_TRACE', '0') == '1'
+
+
+def is_admin_token(value):
+    """True si `value` es el token de administración configurado."""
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(str(value or ''), PROFILE_ADMIN_TOKEN)
+
+
+class ProfileStore:
+    """Anillo de perfiles en disco: un JSON de metadatos por perfil más sus archivos."""
+
+    def __init__(self, directory=PROFILE_DIR, max_profiles=PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        """Identificador que ordena los perfiles por fecha (hasta el milisegundo)."""
+        now = time.time()
+        return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}-{uuid.uuid4().hex[:6]}"
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, meta):
+        """Guarda los metadatos del perfil `meta["profile_id"]` y recorta el anillo."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = self.path(f"{meta['profile_id']}.json.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp_path, self.path(f"{meta['profile_id']}.json"))
+            self._prune()
+
+    def list(self):
+        """Metadatos de los perfiles guardados, del más reciente al más antiguo."""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(self.path(name), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def _prune(self):
+        metas = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in metas[:max(0, len(metas) - self.max_profiles)]:
+            profile_id = name[:-len('.json')]
+            for other in os.listdir(self.directory):
+                if other.startswith(profile_id):
+                    try:
+                        os.remove(self.path(other))
+                    except OSError:
+                        pass
+
+
+class RequestProfiler:
+    """Decide qué peticiones se perfilan y captura sus perfiles."""
+
+    def __init__(self, store=None, sample_rate=PROFILE_SAMPLE_RATE, threshold_ms=PROFILE_THRESHOLD_MS,
+                 engine=PROFILE_ENGINE, tf_trace=PROFILE_TF_TRACE):
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.engine = engine
+        self.tf_trace = tf_trace
+        self._busy = threading.Lock()
+
+    def wants(self, header_value=None):
+        """True si la petición pide perfil (cabecera con el token) o sale en el muestreo."""
+        if header_value is not None and is_admin_token(header_value):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, header_value=None, **meta):
+        """
+        Perfila el bloque si la petición lo pide y no hay otro perfil en curso. Produce
+        un dict con "active" (el bloque se está perfilando: el llamador debe hacer todo
+        el trabajo en su propio hilo) al que, al salir, se añade "profile_id" si el
+        perfil se ha guardado.
+        """
+        session = {"active": False}
+        if not self.wants(header_value) or not self._busy.acquire(blocking=False):
+            yield session
+            return
+        try:
+            profile_id = self.store.new_id()
+            profiler = self._start_profiler()
+            tf_logdir = self._start_tf_trace(profile_id)
+            started = time.perf_counter()
+            session["active"] = True
+            try:
+                yield session
+            finally:
+                duration_ms = (time.perf_counter() - started) * 1000.0
+                profiler_result = self._stop_profiler(profiler)
+                self._stop_tf_trace(tf_logdir)
+                if duration_ms >= self.threshold_ms:
+                    files = self._write_files(profile_id, profiler_result, tf_logdir)
+                    self.store.save(dict(meta, profile_id=profile_id, created_at=time.time(),
+                                         duration_ms=duration_ms, files=files))
+                    session["profile_id"] = profile_id
+                    logging.info(f"Perfil {profile_id} guardado ({duration_ms:.0f} ms): {', '.join(files)}")
+                if tf_logdir is not None:
+                    shutil.rmtree(tf_logdir, ignore_errors=True)
+        finally:
+            self._busy.release()
+
+    # --- Perfiladores ---
+
+    def _start_profiler(self):
+        if self.engine == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+                return ('pyinstrument', profiler)
+            except ImportError:
+                logging.warning("pyinstrument no está instalado; se usa cProfile.")
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return ('cprofile', profiler)
+
+    def _stop_profiler(self, profiler):
+        kind, instance = profiler
+        if kind == 'pyinstrument':
+            instance.stop()
+        else:
+            instance.disable()
+        return profiler
+
+    def _start_tf_trace(self, profile_id):
+        if not self.tf_trace:
+            return None
+        try:
+            import tensorflow as tf
+            logdir = self.store.path(f"{profile_id}-tf")
+            tf.profiler.experimental.start(logdir)
+            return logdir
+        except Exception as e:
+            logging.warning(f"No se pudo iniciar la traza de TensorFlow: {e}")
+            return None
+
+    def _stop_tf_trace(self, logdir):
+        if logdir is None:
+            return
+        try:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+        except Exception as e:
+            logging.warning(f"No se pudo detener la traza de TensorFlow: {e}")
+
+    def _write_files(self, profile_id, profiler, tf_logdir):
+        """Escribe el perfil (y la traza de TF comprimida) y devuelve los nombres de archivo."""
+        kind, instance = profiler
+        os.makedirs(self.store.directory, exist_ok=True)
+        files = []
+        if kind == 'pyinstrument':
+            name = f"{profile_id}.html"
+            with open(self.store.path(name), 'w', encoding='utf-8') as f:
+                f.write(instance.output_html())
+        else:
+            name = f"{profile_id}.prof"
+            instance.dump_stats(self.store.path(name))
+        files.append(name)
+        if tf_logdir is not None and os.path.isdir(tf_logdir):
+            archive = shutil.make_archive(self.store.path(f"{profile_id}-tf"), 'zip', tf_logdir)
+            files.append(os.path.basename(archive))
+        return files
@@ -0,0 +1,202 @@
+"""
+Motor de reglas declarativas para el análisis de sangre.
+
+Las reglas se leen de un archivo JSON y se compilan en un plan de evaluación: cada
+subexpresión distinta (la lectura de un marcador, una comparación, un AND/OR) aparece
+una sola vez en el plan aunque la usen varias reglas, y se evalúa sobre columnas
+completas (un valor por paciente). Un único registro se evalúa como una tabla de una fila.
+
+Formato del archivo:
+
+    {
+      "missing": false,
+      "rules": [
+        {"name": "Anemia", "when": {"field": "hemoglobin", "op": "below_range"}},
+        {"name": "Pre-diabetes", "when": {"all": [
+            {"field": "glucose", "op": ">", "value": 100},
+            {"field": "glucose", "op": "<=", "value": 125}]}}
+      ]
+    }
+
+Expresiones:
+ - Comparación: {"field", "op", "value"} con op en <, <=, >, >=, ==, !=; o bien
+   "below_range"/"above_range", que comparan con el rango de referencia del marcador.
+ - {"all": [...]}, {"any": [...]}, {"not": expr}.
+
+Valores ausentes: una comparación sobre un valor ausente (o no numérico) da
+`"missing"` (por defecto el del archivo, y si no, falso). Con `"default": x` el valor
+ausente se sustituye por x antes de comparar.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import numpy as np
+
+COMPARISONS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+class RuleError(ValueError):
+    """Archivo de reglas mal formado."""
+
+
+class RulePlan:
+    """
+    Plan compilado: una lista de nodos en orden topológico. Cada nodo es
+    (operación, argumentos) y su resultado ocupa una posición en la lista de resultados.
+    """
+
+    def __init__(self, rules, reference_ranges=None, default_missing=False):
+        self.reference_ranges = reference_ranges or {}
+        self.default_missing = bool(default_missing)
+        self.nodes = []
+        self._slots = {}
+        self.rule_names = []
+        self._rule_slots = []
+        if not isinstance(rules, list) or not rules:
+            raise RuleError("El archivo de reglas debe definir una lista 'rules' no vacía.")
+        for rule in rules:
+            if not isinstance(rule, dict) or 'name' not in rule or 'when' not in rule:
+                raise RuleError(f"Regla no válida (se esperan 'name' y 'when'): {rule}")
+            if rule['name'] in self.rule_names:
+                raise RuleError(f"Regla duplicada: {rule['name']}")
+            self.rule_names.append(rule['name'])
+            self._rule_slots.append(self._compile(rule['when']))
+        self.fields = sorted({args[0] for op, args in self.nodes if op == 'load'})
+
+    def _add(self, op, args):
+        """Añade un nodo si no existe ya uno idéntico (subexpresión común) y devuelve su posición."""
+        key = (op, args)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = len(self.nodes)
+            self.nodes.append(key)
+        return slot
+
+    def _compile(self, expr):
+        if not isinstance(expr, dict):
+            raise RuleError(f"Expresión no válida: {expr}")
+        if 'all' in expr or 'any' in expr:
+            op = 'all' if 'all' in expr else 'any'
+            children = expr[op]
+            if not isinstance(children, list) or not children:
+                raise RuleError(f"'{op}' necesita una lista no vacía de expresiones.")
+            # Orden canónico: (a AND b) y (b AND a) comparten el mismo nodo
+            slots = tuple(sorted({self._compile(child) for child in children}))
+            return slots[0] if len(slots) == 1 else self._add(op, slots)
+        if 'not' in expr:
+            return self._add('not', (self._compile(expr['not']),))
+        return self._compile_comparison(expr)
+
+    def _compile_comparison(self, expr):
+        field, op = expr.get('field'), expr.get('op')
+        if not isinstance(field, str) or not field:
+            raise RuleError(f"Comparación sin 'field': {expr}")
+        if op in ('below_range', 'above_range'):
+            if field not in self.reference_ranges:
+                raise RuleError(f"'{field}' no tiene rango de referencia para '{op}'.")
+            lower, upper = self.reference_ranges[field]
+            op, value = ('<', lower) if op == 'below_range' else ('>', upper)
+        elif op in COMPARISONS:
+            value = expr.get('value')
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise RuleError(f"La comparación '{field} {op}' necesita un 'value' numérico.")
+        else:
+            raise RuleError(f"Operador desconocido: {op}")
+        default = expr.get('default')
+        if default is not None and (isinstance(default, bool) or not isinstance(default, (int, float))):
+            raise RuleError(f"'default' de '{field}' debe ser numérico.")
+        missing = bool(expr.get('missing', self.default_missing))
+        load = self._add('load', (field, None if default is None else float(default)))
+        return self._add('compare', (load, op, float(value), missing))
+
+    def evaluate(self, columns, n=None):
+        """
+        Evalúa todas las reglas. `columns` es un dict marcador -> array de valores
+        (NaN = ausente) o un registro con valores escalares. Devuelve un dict
+        regla -> máscara booleana con un valor por paciente.
+        """
+        if n is None:
+            sizes = [np.size(columns[f]) for f in self.fields if f in columns]
+            n = max(sizes) if sizes else 1
+        results = [None] * len(self.nodes)
+        for slot, (op, args) in enumerate(self.nodes):
+            if op == 'load':
+                field, default = args
+                values = columns.get(field)
+                if values is None:
+                    values = np.full(n, np.nan)
+                else:
+                    values = np.broadcast_to(np.asarray(values, dtype=np.float64), (n,))
+                missing = np.isnan(values)
+                if default is not None and missing.any():
+                    values, missing = np.where(missing, default, values), np.zeros(n, dtype=bool)
+                results[slot] = (values, missing)
+            elif op == 'compare':
+                load, comparison, value, missing_result = args
+                values, missing = results[load]
+                with np.errstate(invalid='ignore'):
+                    mask = COMPARISONS[comparison](values, value)
+                results[slot] = np.where(missing, missing_result, mask)
+            elif op == 'all':
+                results[slot] = np.logical_and.reduce([results[s] for s in args])
+            elif op == 'any':
+                results[slot] = np.logical_or.reduce([results[s] for s in args])
+            else:  # 'not'
+                results[slot] = ~results[args[0]]
+        return {name: results[slot] for name, slot in zip(self.rule_names, self._rule_slots)}
+
+
+class RuleSet:
+    """
+    Reglas cargadas desde un archivo y recompiladas cuando el archivo cambia (sin
+    reiniciar el servidor). Si la nueva versión no compila, se conserva la anterior.
+    """
+
+    def __init__(self, path, reference_ranges=None, check_interval=2.0):
+        self.path = path
+        self.reference_ranges = reference_ranges or {}
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._plan = None
+        self._mtime = None
+        self._checked_at = 0.0
+        self._load()
+        if self._plan is None:
+            raise RuleError(f"No se pudieron cargar las reglas de {path}.")
+
+    def _load(self):
+        try:
+            # Se registra la fecha antes de leer: un archivo erróneo no se reintenta hasta que vuelva a cambiar
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                spec = json.load(f)
+            plan = RulePlan(spec.get('rules'), self.reference_ranges, spec.get('missing', False))
+        except (OSError, json.JSONDecodeError, AttributeError, RuleError) as e:
+            logging.error(f"Error al cargar las reglas de {self.path}: {e}")
+            return
+        self._plan = plan
+        logging.info(f"Reglas cargadas de {self.path}: {len(plan.rule_names)} reglas, {len(plan.nodes)} nodos")
+
+    def plan(self):
+        """Plan vigente; como mucho cada `check_interval` segundos se comprueba si el archivo cambió."""
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._checked_at = now
+                    try:
+                        changed = os.path.getmtime(self.path) != self._mtime
+                    except OSError:
+                        changed = False
+                    if changed:
+                        self._load()
+        return self._plan
@@ -0,0 +1,4 @@
+"""
+Modo de servicio en producción: varios procesos HTTP que delegan la inferencia
+y SHAP en uno o varios procesos de modelo dedicados a través de sockets Unix.
+"""
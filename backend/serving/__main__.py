@@ -0,0 +1,9 @@
+"""
+Punto de entrada del modo de servicio en producción: `python -m backend.serving`.
+"""
+import sys
+
+from .launcher import main
+
+if __name__ == '__main__':
+    sys.exit(main())
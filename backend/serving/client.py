@@ -0,0 +1,203 @@
+"""
+Cliente del servidor de modelo usado por los procesos HTTP.
+
+Expone adaptadores con la misma interfaz que el motor de inferencia local
+(`predict`, `warmup`), el explicador SHAP (`shap_values`), la cola de trabajos SHAP
+y la caché de resultados, de modo que `backend.model.predict` funciona igual con el
+modelo en otro proceso. La cola y la caché viven en el servidor de modelo: todos los
+procesos HTTP ven los mismos trabajos y las mismas entradas.
+"""
+import time
+import zlib
+import socket
+import logging
+import itertools
+import threading
+import numpy as np
+
+from .ipc import send_message, recv_message
+
+
+class ModelServerClient:
+    """
+    Conexiones persistentes (una por hilo y socket) a uno o varios servidores de modelo.
+    Las llamadas se reparten en turno rotativo entre los sockets disponibles.
+    """
+
+    def __init__(self, socket_paths, timeout=300.0):
+        if isinstance(socket_paths, str):
+            socket_paths = [p for p in socket_paths.split(',') if p]
+        if not socket_paths:
+            raise ValueError("Se necesita al menos un socket del servidor de modelo.")
+        self.socket_paths = list(socket_paths)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._round_robin = itertools.count()
+
+    def _connection(self, path):
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        sock = conns.get(path)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(path)
+            conns[path] = sock
+        return sock
+
+    def _drop(self, path):
+        sock = getattr(self._local, 'conns', {}).pop(path, None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def path_for(self, key):
+        """Socket del servidor responsable de `key`: cada clave vive siempre en el mismo servidor."""
+        if key is None:
+            return self.socket_paths[next(self._round_robin) % len(self.socket_paths)]
+        return self.socket_paths[zlib.crc32(key.encode('utf-8')) % len(self.socket_paths)]
+
+    def call(self, op, arrays=(), path=None, **fields):
+        """
+        Envía una operación (con `fields` como parámetros adicionales de la cabecera) y
+        devuelve (header, arrays). Reintenta una vez si la conexión cayó.
+        """
+        path = path or self.socket_paths[next(self._round_robin) % len(self.socket_paths)]
+        for attempt in (1, 2):
+            try:
+                sock = self._connection(path)
+                send_message(sock, dict(fields, op=op), arrays)
+                header, out = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                self._drop(path)
+                if attempt == 2:
+                    raise
+        if header.get("status") != "ok":
+            raise RuntimeError(header.get("message", f"Error del servidor de modelo en '{op}'"))
+        return header, out
+
+    def wait_until_ready(self, timeout=600.0, interval=0.5):
+        """Espera a que todos los servidores respondan a `ping`; devuelve la cabecera del primero."""
+        deadline = time.monotonic() + timeout
+        first = None
+        for path in self.socket_paths:
+            while True:
+                try:
+                    header, _ = self.call("ping", path=path)
+                    first = first or header
+                    break
+                except (ConnectionError, OSError, RuntimeError) as e:
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"El servidor de modelo en {path} no respondió: {e}")
+                    time.sleep(interval)
+        logging.info(f"Servidores de modelo disponibles: {', '.join(self.socket_paths)}")
+        return first
+
+
+class RemoteEngine:
+    """Motor de inferencia que delega en el servidor de modelo."""
+
+    name = 'remote'
+
+    def __init__(self, client):
+        self.client = client
+
+    def predict(self, batch):
+        _, (outputs,) = self.client.call("predict", [batch])
+        return outputs
+
+    def warmup(self, batch_sizes):
+        # El servidor de modelo ya calienta su propio motor al arrancar
+        pass
+
+
+class RemoteExplainer:
+    """Explicador SHAP que delega en el servidor de modelo."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def shap_values(self, images, tier='full'):
+        _, (values,) = self.client.call("explain", [images], tier=tier)
+        return values
+
+
+class RemoteShapJobs:
+    """
+    Cola de trabajos SHAP del servidor de modelo (misma interfaz de consulta que
+    `ShapJobManager`). Cada grupo de imágenes se envía al servidor responsable de su
+    clave de caché, que calcula la explicación, escribe el artefacto y completa su
+    caché; el identificador del trabajo lleva delante el índice de ese servidor.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit_explanations(self, entries, tier):
+        """Encola `entries` (ver `predict.submit_explanations`) y devuelve un identificador por entrada."""
+        groups = {}
+        for position, entry in enumerate(entries):
+            groups.setdefault(self.client.path_for(entry[0]), []).append(position)
+        job_ids = [None] * len(entries)
+        for path, positions in groups.items():
+            meta, arrays = [], []
+            for position in positions:
+                cache_key, prediction, processed_image, original_img, base_name, main_label = entries[position]
+                meta.append({"cache_key": cache_key, "prediction": prediction, "base_name": base_name,
+                             "main_label": main_label})
+                arrays.extend([np.asarray(processed_image, dtype=np.float32), np.asarray(original_img, dtype=np.uint8)])
+            header, _ = self.client.call("explain_async", arrays, path=path, tier=tier, entries=meta)
+            index = self.client.socket_paths.index(path)
+            for position, job_id in zip(positions, header["job_ids"]):
+                job_ids[position] = f"{index}-{job_id}"
+        return job_ids
+
+    def get(self, job_id, wait=0.0):
+        """Estado del trabajo en su servidor, o None si no existe."""
+        index, _, remote_id = job_id.partition('-')
+        if not index.isdigit() or int(index) >= len(self.client.socket_paths):
+            return None
+        header, _ = self.client.call("shap_job", path=self.client.socket_paths[int(index)],
+                                     job_id=remote_id, wait=wait)
+        job = header.get("job")
+        if job is not None:
+            job["job_id"] = job_id
+        return job
+
+    def pending_count(self):
+        """Trabajos encolados o en ejecución en todos los servidores de modelo."""
+        return sum(self.client.call("shap_stats", path=path)[0]["pending"] for path in self.client.socket_paths)
+
+
+class RemoteResultCache:
+    """Caché de resultados del servidor de modelo (misma interfaz que `ResultCache`)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        header, _ = self.client.call("cache_get", path=self.client.path_for(key), key=key)
+        return header.get("value")
+
+    def put(self, key, value, persist=True):
+        self.client.call("cache_put", path=self.client.path_for(key), key=key, value=value, persist=persist)
+
+    def invalidate(self, key):
+        self.client.call("cache_invalidate", path=self.client.path_for(key), key=key)
+
+    def stats(self):
+        """Suma de los contadores de todos los servidores."""
+        totals = {}
+        for path in self.client.socket_paths:
+            for name, value in (self.client.call("cache_stats", path=path)[0].get("stats") or {}).items():
+                totals[name] = totals.get(name, 0) + value
+        if not totals:
+            return None
+        lookups = totals.get("memory_hits", 0) + totals.get("disk_hits", 0) + totals.get("misses", 0)
+        hits = totals.get("memory_hits", 0) + totals.get("disk_hits", 0)
+        totals["hit_ratio"] = (hits / lookups) if lookups else 0.0
+        return totals
@@ -0,0 +1,47 @@
+"""
+Proceso HTTP de trabajo.
+
+Sirve la aplicación Flask sobre un socket de escucha heredado del lanzador
+(todos los procesos comparten el mismo puerto) y delega la inferencia en el
+servidor de modelo indicado por MODEL_SERVER_SOCKETS.
+"""
+import os
+import signal
+import logging
+import argparse
+import threading
+from werkzeug.serving import make_server
+
+
+def serve_http(fd, host, port):
+    """Atiende peticiones en el descriptor `fd` hasta recibir SIGTERM/SIGINT."""
+    from .. import create_app
+
+    app = create_app()
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    # Al cerrar, esperar a que terminen las peticiones en curso
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def _shutdown(signum, frame):
+        logging.info(f"[http-worker {os.getpid()}] Señal {signum} recibida, terminando peticiones en curso...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    logging.info(f"[http-worker {os.getpid()}] Sirviendo en http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        logging.info(f"[http-worker {os.getpid()}] Detenido.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Proceso HTTP de trabajo (uso interno del lanzador).')
+    parser.add_argument('--fd', type=int, required=True, help='Descriptor del socket de escucha heredado')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    serve_http(args.fd, args.host, args.port)
@@ -0,0 +1,48 @@
+"""
+Protocolo de mensajes sobre sockets Unix entre los procesos HTTP y el servidor de modelo.
+
+Cada mensaje es:
+    [4 bytes big-endian: longitud de la cabecera][cabecera JSON][bytes de cada array]
+La cabecera incluye la operación y, para cada array, su dtype y su forma, de modo
+que los tensores viajan como bytes crudos sin serialización intermedia.
+"""
+import json
+import struct
+import numpy as np
+
+_LENGTH = struct.Struct('>I')
+
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError("Conexión cerrada por el otro extremo.")
+        received += n
+    return buf
+
+
+def send_message(sock, header, arrays=()):
+    """Envía `header` (dict serializable a JSON) seguido de los `arrays` en bruto."""
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{"dtype": a.dtype.str, "shape": list(a.shape)} for a in arrays])
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(_LENGTH.pack(len(encoded)) + encoded)
+    for a in arrays:
+        sock.sendall(memoryview(a).cast('B'))
+
+
+def recv_message(sock):
+    """Recibe un mensaje y devuelve (header, [arrays])."""
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    header = json.loads(_recv_exact(sock, length).decode('utf-8'))
+    arrays = []
+    for meta in header.pop("arrays", []):
+        dtype = np.dtype(meta["dtype"])
+        shape = tuple(meta["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        arrays.append(np.frombuffer(_recv_exact(sock, nbytes), dtype=dtype).reshape(shape))
+    return header, arrays
@@ -0,0 +1,145 @@
+"""
+Lanzador del modo de servicio en producción.
+
+Arranca N procesos de modelo (cada uno con una copia del modelo y del explicador
+SHAP, escuchando en su propio socket Unix) y M procesos HTTP que comparten el
+mismo puerto y delegan en ellos. La memoria crece con el número de copias del
+modelo, no con el número de procesos HTTP.
+
+Uso:
+ python -m backend.serving --http-workers 4 --inference-workers 1 --port 8080
+
+SIGTERM/SIGINT cierran primero los procesos HTTP (que terminan las peticiones en
+curso) y después los de modelo; los que no terminen en --shutdown-timeout segundos
+se matan.
+"""
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import logging
+import argparse
+import tempfile
+import subprocess
+
+from .client import ModelServerClient
+
+
+def _spawn_model_server(socket_path, index, count):
+    env = dict(os.environ)
+    env.pop('MODEL_SERVER_SOCKETS', None)  # el servidor de modelo carga el modelo localmente
+    cache_dir = env.get('RESULT_CACHE_DIR', 'cache/results')  # mismo valor por defecto que predict.py
+    if count > 1 and cache_dir:
+        # Cada servidor guarda las claves que le tocan (ver client.py) en su propio directorio
+        env['RESULT_CACHE_DIR'] = os.path.join(cache_dir, f"shard-{index}")
+    return subprocess.Popen([sys.executable, '-m', 'backend.serving.model_server', '--socket', socket_path], env=env)
+
+
+def _spawn_http_worker(listen_fd, host, port, socket_paths):
+    env = dict(os.environ, MODEL_SERVER_SOCKETS=','.join(socket_paths), MODEL_LOAD_MODE='background')
+    return subprocess.Popen([sys.executable, '-m', 'backend.serving.http_worker',
+                             '--fd', str(listen_fd), '--host', host, '--port', str(port)],
+                            env=env, pass_fds=[listen_fd])
+
+
+def _stop(processes, timeout):
+    """Envía SIGTERM y espera hasta `timeout` segundos; mata a los que sigan vivos."""
+    for proc in processes:
+        if proc.poll() is None:
+            proc.terminate()
+    deadline = time.monotonic() + timeout
+    for proc in processes:
+        remaining = max(0.0, deadline - time.monotonic())
+        try:
+            proc.wait(remaining)
+        except subprocess.TimeoutExpired:
+            logging.warning(f"El proceso {proc.pid} no terminó a tiempo; se fuerza su cierre.")
+            proc.kill()
+            proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Servidor de producción multi-proceso de Aurora IA.')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8080)))
+    parser.add_argument('--http-workers', type=int, default=int(os.getenv('HTTP_WORKERS', 2)))
+    parser.add_argument('--inference-workers', type=int, default=int(os.getenv('INFERENCE_WORKERS', 1)))
+    parser.add_argument('--socket-dir', default=os.getenv('MODEL_SOCKET_DIR'),
+                        help='Directorio para los sockets Unix (por defecto, uno temporal)')
+    parser.add_argument('--startup-timeout', type=float, default=600.0,
+                        help='Segundos máximos para que los servidores de modelo estén listos')
+    parser.add_argument('--shutdown-timeout', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    socket_dir = args.socket_dir or tempfile.mkdtemp(prefix='auroia-model-')
+    os.makedirs(socket_dir, exist_ok=True)
+    socket_paths = [os.path.join(socket_dir, f"model-{i}.sock") for i in range(args.inference_workers)]
+    try:
+        return _serve(args, socket_paths)
+    finally:
+        if not args.socket_dir:
+            # Directorio temporal creado por el lanzador: no dejar sockets huérfanos en /tmp
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def _serve(args, socket_paths):
+    """Arranca los procesos, los supervisa hasta recibir una señal y los cierra; devuelve el código de salida."""
+    stopping = False
+
+    def _on_signal(signum, frame):
+        nonlocal stopping
+        logging.info(f"Señal {signum} recibida: iniciando cierre ordenado...")
+        stopping = True
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+
+    # 1. Procesos de modelo
+    model_servers = [_spawn_model_server(path, i, len(socket_paths)) for i, path in enumerate(socket_paths)]
+    try:
+        ModelServerClient(socket_paths).wait_until_ready(timeout=args.startup_timeout)
+    except TimeoutError as e:
+        logging.error(f"Los servidores de modelo no arrancaron: {e}")
+        _stop(model_servers, args.shutdown_timeout)
+        return 1
+
+    # 2. Socket de escucha compartido por todos los procesos HTTP
+    listener = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(128)
+    listener.set_inheritable(True)
+    listen_fd = listener.fileno()
+
+    http_workers = [_spawn_http_worker(listen_fd, args.host, args.port, socket_paths)
+                    for _ in range(args.http_workers)]
+    logging.info(f"Servidor listo en http://{args.host}:{args.port} "
+                 f"({args.http_workers} procesos HTTP, {args.inference_workers} procesos de modelo)")
+
+    # 3. Supervisión: reiniciar procesos HTTP caídos; si cae un servidor de modelo, cerrar todo
+    exit_code = 0
+    while not stopping:
+        time.sleep(0.5)
+        if any(proc.poll() is not None for proc in model_servers):
+            logging.error("Un servidor de modelo terminó inesperadamente; cerrando el servicio.")
+            exit_code = 1
+            break
+        for i, proc in enumerate(http_workers):
+            if proc.poll() is not None:
+                logging.warning(f"El proceso HTTP {proc.pid} terminó (código {proc.returncode}); reiniciando.")
+                http_workers[i] = _spawn_http_worker(listen_fd, args.host, args.port, socket_paths)
+
+    # 4. Cierre ordenado: primero HTTP (drenan peticiones), después los modelos
+    _stop(http_workers, args.shutdown_timeout)
+    listener.close()
+    _stop(model_servers, args.shutdown_timeout)
+    logging.info("Servicio detenido.")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Proceso dedicado de inferencia.
+
+Carga una sola copia del modelo, del motor de inferencia y del explicador SHAP, y
+atiende a todos los procesos HTTP a través de un socket Unix. Las peticiones de
+predicción de todos los clientes pasan por el mismo planificador de micro-lotes,
+así que el llenado de los lotes mejora con el número de procesos HTTP.
+
+Operaciones:
+ - ping: devuelve el estado y la versión del modelo.
+ - predict: recibe (N, 224, 224, 3) float32 y devuelve las probabilidades (N, 1).
+ - explain: recibe (N, 224, 224, 3) float32 (y `tier`) y devuelve los valores SHAP (N, 224, 224, 3).
+ - stats: métricas del planificador de lotes.
+ - explain_async: encola la explicación SHAP de varias imágenes (por cada una, la imagen
+   preprocesada y la original, y en `entries` su clave de caché, predicción, nombre base y
+   etiqueta principal) y devuelve `job_ids`. El servidor escribe el artefacto y completa su
+   caché de resultados.
+ - shap_job: estado del trabajo `job_id` (con long-polling opcional, `wait`).
+ - shap_stats: profundidad de la cola de trabajos SHAP.
+ - cache_get / cache_put / cache_invalidate / cache_stats: caché de resultados.
+
+La cola de trabajos SHAP y la caché de resultados viven aquí para que todos los procesos
+HTTP compartan los mismos trabajos y las mismas entradas (ver client.py).
+"""
+import os
+import signal
+import argparse
+import logging
+import threading
+import socketserver
+import numpy as np
+
+from .ipc import send_message, recv_message
+
+
+class _ModelRequestHandler(socketserver.BaseRequestHandler):
+    """Atiende una conexión persistente: un mensaje de respuesta por cada petición."""
+
+    def handle(self):
+        from ..model import predict
+
+        while True:
+            try:
+                header, arrays = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            op = header.get("op")
+            try:
+                if op == "ping":
+                    send_message(self.request, {"status": "ok", "model_version": predict.model_version,
+                                                "engine": predict.engine.name if predict.engine else None,
+                                                "class_names": predict.class_names})
+                elif op == "predict":
+                    outputs = np.asarray(predict.run_inference(arrays[0]), dtype=np.float32)
+                    send_message(self.request, {"status": "ok"}, [outputs])
+                elif op == "explain":
+                    if predict.explainer is None:
+                        raise RuntimeError("Explainer SHAP no inicializado en el servidor de modelo.")
+                    shap_values = np.asarray(predict.explainer.shap_values(arrays[0], tier=header.get("tier", "full")),
+                                             dtype=np.float32)
+                    send_message(self.request, {"status": "ok"}, [shap_values])
+                elif op == "stats":
+                    send_message(self.request, {"status": "ok", "batching": predict.get_batching_stats()})
+                elif op == "explain_async":
+                    entries = [(meta["cache_key"], meta["prediction"], arrays[2 * i], arrays[2 * i + 1],
+                                meta["base_name"], meta["main_label"]) for i, meta in enumerate(header["entries"])]
+                    job_ids = predict.submit_explanations(entries, header.get("tier", "full"))
+                    send_message(self.request, {"status": "ok", "job_ids": job_ids})
+                elif op == "shap_job":
+                    job = predict.get_shap_job(header["job_id"], wait=float(header.get("wait", 0.0)))
+                    send_message(self.request, {"status": "ok", "job": job})
+                elif op == "shap_stats":
+                    stats = predict.get_shap_stats() or {}
+                    send_message(self.request, {"status": "ok", "pending": stats.get("pending", 0)})
+                elif op == "cache_get":
+                    value = predict.result_cache.get(header["key"]) if predict.result_cache is not None else None
+                    send_message(self.request, {"status": "ok", "value": value})
+                elif op == "cache_put":
+                    if predict.result_cache is not None:
+                        predict.result_cache.put(header["key"], header["value"], persist=header.get("persist", True))
+                    send_message(self.request, {"status": "ok"})
+                elif op == "cache_invalidate":
+                    if predict.result_cache is not None:
+                        predict.result_cache.invalidate(header["key"])
+                    send_message(self.request, {"status": "ok"})
+                elif op == "cache_stats":
+                    send_message(self.request, {"status": "ok", "stats": predict.get_cache_stats()})
+                else:
+                    send_message(self.request, {"status": "error", "message": f"Operación desconocida: {op}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                logging.exception(f"Error en la operación '{op}' del servidor de modelo: {e}")
+                send_message(self.request, {"status": "error", "message": str(e)})
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve_model(socket_path):
+    """
+    Carga el modelo y atiende peticiones en `socket_path` hasta recibir SIGTERM/SIGINT.
+    Pensado para ejecutarse como proceso independiente (ver launcher.py).
+    """
+    from .. import load_skin_model
+
+    logging.info(f"[model-server {os.getpid()}] Cargando modelo...")
+    load_skin_model()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = ModelServer(socket_path, _ModelRequestHandler)
+
+    def _shutdown(signum, frame):
+        logging.info(f"[model-server {os.getpid()}] Señal {signum} recibida, cerrando...")
+        # shutdown() bloquea hasta que serve_forever termina: llamarlo desde otro hilo
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    logging.info(f"[model-server {os.getpid()}] Escuchando en {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        logging.info(f"[model-server {os.getpid()}] Detenido.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor de modelo (inferencia y SHAP) sobre socket Unix.')
+    parser.add_argument('--socket', required=True, help='Ruta del socket Unix en el que escuchar')
+    serve_model(parser.parse_args().socket)
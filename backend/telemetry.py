@@ -0,0 +1,271 @@
+"""
+Trazas por etapa y métricas en el formato de exposición de texto de Prometheus.
+
+Cada petición de análisis abre una traza (`begin_request`) y el código del pipeline
+marca sus etapas con `span('decode')`, `span('inference')`, etc. Sólo una fracción
+TRACE_SAMPLE_RATE de las peticiones se muestrea: en las demás `span` no hace nada,
+así que el coste en el camino crítico se reduce a leer una ContextVar. De las
+peticiones muestreadas se registra la duración de cada etapa en el histograma
+`auroia_stage_duration_seconds` y, con TRACE_LOG_SPANS=1, la traza completa como
+una línea JSON en el log.
+
+Los contadores de peticiones y los indicadores de peticiones en vuelo se actualizan
+siempre. Las métricas de la caché de resultados, los micro-lotes y la cola SHAP no
+se duplican: se leen de sus `stats()` en el momento de servir /metrics (ver
+`add_collector`).
+"""
+import os
+import json
+import time
+import uuid
+import random
+import bisect
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Fracción de peticiones cuyas etapas se miden (0 desactiva las trazas, 1 las mide todas)
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+# Escribir en el log la traza de cada petición muestreada (una línea JSON)
+TRACE_LOG_SPANS = os.getenv('TRACE_LOG_SPANS', '0') == '1'
+
+# Límites superiores (s) de los cubos de los histogramas de duración
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base de las métricas con etiquetas: un valor por combinación de etiquetas."""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Cuentas por cubo (el último es +Inf), suma y número de observaciones
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted((labels, [list(s[0]), s[1], s[2]]) for labels, s in self._values.items())
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Métricas propias más colectores que generan métricas al servir /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        `collect()` devuelve una lista de (nombre, tipo, ayuda, valor) o
+        (nombre, tipo, ayuda, {etiquetas: valor}); los None se omiten.
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for collect in self._collectors:
+            try:
+                samples = collect()
+            except Exception as e:
+                logging.warning(f"Error en un colector de métricas: {e}")
+                continue
+            for name, metric_type, documentation, value in samples:
+                if value is None:
+                    continue
+                lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+                values = value if isinstance(value, dict) else {(): value}
+                for labels, v in values.items():
+                    label_text = '{' + ','.join(f'{k}="{val}"' for k, val in labels) + '}' if labels else ''
+                    lines.append(f"{name}{label_text} {_format_value(v)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'auroia_requests_total', 'Peticiones atendidas por endpoint, tipo de análisis y código HTTP.',
+    ('endpoint', 'analysis_type', 'code')))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'auroia_requests_in_flight', 'Peticiones en curso por endpoint.', ('endpoint',)))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'auroia_request_duration_seconds', 'Duración de las peticiones por endpoint y tipo de análisis.',
+    ('endpoint', 'analysis_type')))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'auroia_stage_duration_seconds', 'Duración de cada etapa del análisis (peticiones muestreadas).', ('stage',)))
+
+_current_trace = contextvars.ContextVar('auroia_trace', default=None)
+
+
+class Trace:
+    """Etapas medidas de una petición muestreada: (etapa, inicio relativo s, duración s)."""
+
+    __slots__ = ('trace_id', 'endpoint', 'started', 'spans')
+
+    def __init__(self, endpoint):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "endpoint": self.endpoint,
+            "spans": [{"stage": stage, "start_ms": round(start * 1000.0, 3), "duration_ms": round(duration * 1000.0, 3)}
+                      for stage, start, duration in self.spans],
+        }
+
+
+class RequestContext:
+    """Estado de una petición entre `begin_request` y `end_request`."""
+
+    __slots__ = ('endpoint', 'started', 'trace', 'token')
+
+    def __init__(self, endpoint, trace, token):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.trace = trace
+        self.token = token
+
+
+def begin_request(endpoint):
+    """Cuenta la petición como en vuelo y, si se muestrea, abre su traza para el contexto actual."""
+    REQUESTS_IN_FLIGHT.inc(endpoint)
+    trace = Trace(endpoint) if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE else None
+    return RequestContext(endpoint, trace, _current_trace.set(trace))
+
+
+def end_request(context, code, analysis_type=None):
+    """Cierra la petición: contadores, duración y, si está activado, la traza en el log."""
+    elapsed = time.perf_counter() - context.started
+    analysis_type = analysis_type or 'none'
+    REQUESTS_IN_FLIGHT.dec(context.endpoint)
+    REQUESTS.inc(context.endpoint, analysis_type, str(code))
+    REQUEST_DURATION.observe(elapsed, context.endpoint, analysis_type)
+    try:
+        _current_trace.reset(context.token)
+    except ValueError:
+        # La petición terminó en otro contexto (no debería ocurrir con Flask)
+        _current_trace.set(None)
+    if context.trace is not None and TRACE_LOG_SPANS:
+        record = dict(context.trace.to_dict(), analysis_type=analysis_type, code=code,
+                      duration_ms=round(elapsed * 1000.0, 3))
+        logging.info(f"Traza {json.dumps(record)}")
+
+
+def end_request_after(context, iterable, code, analysis_type=None):
+    """
+    Generador que recorre `iterable` (respuesta en streaming) y cierra la petición al
+    terminar, de modo que su duración y sus etapas incluyen el cuerpo completo.
+    """
+    try:
+        yield from iterable
+    finally:
+        end_request(context, code, analysis_type)
+
+
+@contextmanager
+def span(stage):
+    """Mide la etapa `stage` si la petición actual está muestreada; si no, no hace nada."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished = time.perf_counter()
+        STAGE_DURATION.observe(finished - started, stage)
+        trace.spans.append((stage, started - trace.started, finished - started))
+
+
+def add_collector(collect):
+    REGISTRY.add_collector(collect)
+
+
+def render_metrics():
+    """Texto de /metrics (formato de exposición de Prometheus 0.0.4)."""
+    return REGISTRY.render()
@@ -0,0 +1,50 @@
+"""
+Persistencia opcional y asíncrona de las subidas para auditoría.
+
+Las imágenes y archivos de datos se procesan en memoria; si la auditoría está
+activada, una copia se escribe en segundo plano en la carpeta de subidas sin
+bloquear la respuesta, conservando sólo los `max_files` archivos más recientes.
+"""
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadAuditor:
+    """Escribe las subidas en `folder` desde un hilo de fondo."""
+
+    def __init__(self, folder, max_files=1000):
+        self.folder = folder
+        self.max_files = max_files
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-audit')
+        os.makedirs(self.folder, exist_ok=True)
+
+    def submit(self, filename, data):
+        """Encola la escritura de `data` (bytes) con un nombre único basado en `filename`."""
+        stamped = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000:06d}-{filename}"
+        return self._executor.submit(self._write, stamped, data)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.folder, filename)
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+            logging.info(f"Subida guardada para auditoría en: {path}")
+            self._prune()
+        except OSError as e:
+            logging.error(f"No se pudo guardar la subida {path}: {e}")
+
+    def _prune(self):
+        """Elimina los archivos más antiguos por encima de `max_files`."""
+        if not self.max_files:
+            return
+        entries = [e for e in os.scandir(self.folder) if e.is_file()]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
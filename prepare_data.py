@@ -1,9 +1,14 @@
 
 import os
+import time
+import hashlib
 import zipfile
+import argparse
+import numpy as np
 import pandas as pd
 import shutil
-from sklearn.model_selection import train_test_split
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 import logging
 import json
 from dotenv import load_dotenv
@@ -11,19 +16,69 @@ from collections import Counter
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def download_and_prepare_data():
+# --- Configuration ---
+TEMP_DIR = 'ham10000_temp'
+DATA_DIR = 'data'
+METADATA_FILE = 'HAM10000_metadata.csv'
+IMAGE_SIZE = (224, 224)  # ResNet50 input size
+# Records every resized image so interrupted runs resume and re-runs skip unchanged images
+MANIFEST_PATH = os.path.join(DATA_DIR, 'manifest.json')
+MANIFEST_VERSION = 1
+# Local HAM10000 zip or extracted directory; when set, nothing is downloaded
+DATASET_SOURCE = os.getenv('HAM10000_SOURCE', '')
+RESIZE_WORKERS = int(os.getenv('PREPARE_WORKERS', str(os.cpu_count() or 1)))
+# Save the manifest after this many newly resized images
+MANIFEST_SAVE_EVERY = 50
+# Images to sample from the metadata (0 = the full dataset) and split fractions;
+# the train split gets the rest
+SAMPLE_SIZE = int(os.getenv('PREPARE_SAMPLE_SIZE', '1000'))
+VALIDATION_FRACTION = float(os.getenv('PREPARE_VALIDATION_FRACTION', '0.2'))
+TEST_FRACTION = float(os.getenv('PREPARE_TEST_FRACTION', '0.0'))
+SPLIT_SEED = int(os.getenv('PREPARE_SEED', '42'))
+SPLITS = ('train', 'validation', 'test')
+# Split manifest: one row per image with its split, label and metadata, plus the
+# configuration that produced it (later stages and reruns read it instead of the metadata)
+SPLITS_PATH = os.path.join(DATA_DIR, 'splits.csv')
+SPLITS_CONFIG_PATH = os.path.join(DATA_DIR, 'splits.json')
+DIAGNOSIS_LABELS = {
+    'nv': 'benign', 'bkl': 'benign', 'df': 'benign', 'vasc': 'benign',
+    'mel': 'malignant', 'bcc': 'malignant', 'akiec': 'malignant'
+}
+# Optional export of the prepared splits into fixed-size shards: 'none', 'npy' or 'tfrecord'
+# (format described in backend/model/training/shards.py)
+EXPORT_FORMAT = os.getenv('PREPARE_EXPORT', 'none')
+SHARDS_DIR = os.path.join(DATA_DIR, 'shards')
+SHARD_SIZE = int(os.getenv('PREPARE_SHARD_SIZE', '1024'))
+SHARD_INDEX_VERSION = 1
+# Metadata columns copied into each exported record
+RECORD_COLUMNS = ['image_id', 'lesion_id', 'dx', 'dx_type', 'age', 'sex', 'localization']
+
+
+@contextmanager
+def timed(stage, timings):
+    """Records the wall time of a preparation stage in `timings`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - started
+        logging.info(f"Stage '{stage}' took {timings[stage]:.2f}s")
+
+
+def download_from_kaggle():
     """
-    Downloads the HAM10000 dataset, creates a smaller, stratified sample, 
-    and organizes the images for training.
+    Downloads and extracts the HAM10000 dataset into TEMP_DIR using the Kaggle API.
+    Returns the extracted directory, or None on failure.
     """
-    # 0. Load environment variables and set up Kaggle credentials
+    # Load environment variables and set up Kaggle credentials
     load_dotenv()
     kaggle_username = os.getenv("KAGGLE_USERNAME")
     kaggle_key = os.getenv("KAGGLE_KEY")
 
     if not kaggle_username or not kaggle_key:
-        logging.error("Kaggle credentials not found in .env file. Please create .env with KAGGLE_USERNAME and KAGGLE_KEY.")
-        return
+        logging.error("Kaggle credentials not found in .env file. Please create .env with KAGGLE_USERNAME and KAGGLE_KEY, "
+                      "or pass a local dataset with --source / HAM10000_SOURCE.")
+        return None
 
     # Ensure the .kaggle directory exists and write the credentials file
     kaggle_dir = os.path.expanduser("~/.kaggle")
@@ -33,176 +88,483 @@ def download_and_prepare_data():
         json.dump({"username": kaggle_username, "key": kaggle_key}, f)
     os.chmod(kaggle_json_path, 0o600)  # Set file permissions for security
 
-    # 1. Download the dataset
-    # 1. Download metadata and then only the sampled images using KaggleApi
-    logging.info("Downloading HAM10000 metadata and sampled images from Kaggle (no full-zip)...")
     try:
         from kaggle.api.kaggle_api_extended import KaggleApi
     except Exception:
         logging.error("kaggle package not available in the environment. Please install it (pip install kaggle) and try again.")
-        return
+        return None
 
     api = KaggleApi()
     api.authenticate()
 
-    # Download metadata CSV first
-    os.makedirs("ham10000_temp", exist_ok=True)
-    metadata_file = "HAM10000_metadata.csv"
+    os.makedirs(TEMP_DIR, exist_ok=True)
     try:
         logging.info("Downloading HAM10000 dataset from Kaggle...")
-        api.dataset_download_files('kmader/skin-cancer-mnist-ham10000', path='ham10000_temp', force=True)
-        
-        # Extract the downloaded zip
-        zip_path = os.path.join('ham10000_temp', 'skin-cancer-mnist-ham10000.zip')
-        if os.path.exists(zip_path):
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall('ham10000_temp')
-            os.remove(zip_path)  # Clean up the zip file after extraction
-        else:
-            logging.error("Downloaded zip file not found!")
-            return
+        api.dataset_download_files('kmader/skin-cancer-mnist-ham10000', path=TEMP_DIR, force=True)
     except Exception as e:
-        logging.error(f"Failed to download metadata via KaggleApi: {e}")
-        return
+        logging.error(f"Failed to download the dataset via KaggleApi: {e}")
+        return None
 
-    # Load metadata
-    logging.info("Loading metadata...")
-    metadata = pd.read_csv(os.path.join('ham10000_temp', metadata_file))
+    zip_path = os.path.join(TEMP_DIR, 'skin-cancer-mnist-ham10000.zip')
+    if not os.path.exists(zip_path):
+        logging.error("Downloaded zip file not found!")
+        return None
+    extracted = extract_zip(zip_path, TEMP_DIR)
+    os.remove(zip_path)  # Clean up the zip file after extraction
+    return extracted
+
+
+def extract_zip(zip_path, destination):
+    """
+    Extracts `zip_path` into `destination` unless a previous run already extracted the
+    same archive (tracked by a marker file with the archive size and mtime).
+    """
+    st = os.stat(zip_path)
+    signature = f"{os.path.basename(zip_path)}:{st.st_size}:{st.st_mtime_ns}"
+    marker = os.path.join(destination, '.extracted')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read() == signature:
+                logging.info(f"{zip_path} already extracted in {destination}")
+                return destination
+    logging.info(f"Extracting {zip_path} into {destination}...")
+    os.makedirs(destination, exist_ok=True)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(destination)
+    with open(marker, 'w') as f:
+        f.write(signature)
+    return destination
+
+
+def fetch_dataset(source=''):
+    """
+    Locates the raw dataset: a local directory is used in place, a local zip is
+    extracted into TEMP_DIR, and with no source the dataset is downloaded from Kaggle.
+    Returns the dataset directory, or None on failure.
+    """
+    if source:
+        if os.path.isdir(source):
+            logging.info(f"Using local dataset directory {source}")
+            return source
+        if zipfile.is_zipfile(source):
+            return extract_zip(source, TEMP_DIR)
+        logging.error(f"Dataset source is neither a directory nor a zip file: {source}")
+        return None
+    if os.path.exists(os.path.join(TEMP_DIR, '.extracted')):
+        # An earlier run already downloaded and extracted the dataset
+        logging.info(f"Reusing the dataset extracted in {TEMP_DIR}")
+        return TEMP_DIR
+    return download_from_kaggle()
+
+
+def index_dataset(dataset_dir):
+    """
+    Walks the dataset once and returns (metadata_path, {image filename: path}).
+    Replaces probing every source directory for every image.
+    """
+    metadata_path = None
+    images = {}
+    for root, _, files in os.walk(dataset_dir):
+        for name in files:
+            if name == METADATA_FILE and metadata_path is None:
+                metadata_path = os.path.join(root, name)
+            elif name.lower().endswith('.jpg'):
+                images.setdefault(name, os.path.join(root, name))
+    return metadata_path, images
 
-    # 5. Create exact stratified sample of up to 1000 images (same logic as before)
 
-    # 3. Load metadata
+def allocate(counts, total):
+    """
+    Splits `total` among classes proportionally to `counts` (largest remainder, at
+    least 1 per class while possible) so the allocations sum exactly to `total`.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    exact = counts / counts.sum() * total
+    quotas = np.floor(exact).astype(np.int64)
+    if total >= len(counts):
+        quotas = np.maximum(quotas, 1)
+    quotas = np.minimum(quotas, counts.astype(np.int64))
+    remainder = total - quotas.sum()
+    # Hand out (or take back) the difference by largest fractional part, within each class's size
+    order = np.argsort(-(exact - quotas), kind='stable') if remainder > 0 else np.argsort(exact - quotas, kind='stable')
+    for i in order:
+        if remainder == 0:
+            break
+        if remainder > 0 and quotas[i] < counts[i]:
+            quotas[i] += 1
+            remainder -= 1
+        elif remainder < 0 and quotas[i] > 1:
+            quotas[i] -= 1
+            remainder += 1
+    return quotas
+
+
+def create_sample(metadata, sample_size=SAMPLE_SIZE, seed=SPLIT_SEED):
+    """Exact stratified sample of `sample_size` images (0 or more than available = all of them)."""
+    if sample_size <= 0 or sample_size >= len(metadata):
+        return metadata
+    logging.info(f"Creating a stratified sample of {sample_size} images...")
+    counts = metadata['label'].value_counts()
+    quotas = pd.Series(allocate(counts.to_numpy(), sample_size), index=counts.index)
+    # Random rank of each image within its class; keep the first `quota` of each class
+    rng = np.random.default_rng(seed)
+    shuffled = metadata.iloc[rng.permutation(len(metadata))]
+    rank = shuffled.groupby('label', sort=False).cumcount()
+    return shuffled[rank.to_numpy() < shuffled['label'].map(quotas).to_numpy()]
+
+
+def assign_splits(metadata, validation_fraction=VALIDATION_FRACTION, test_fraction=TEST_FRACTION,
+                  seed=SPLIT_SEED):
+    """
+    Stratified train/validation/test split by lesion: all images of a lesion go to the
+    same split, and each class is divided in the requested proportions (by image count).
+    Returns a copy of `metadata` with a 'split' column.
+    """
+    metadata = metadata.copy()
+    # Images without a lesion id are their own group
+    metadata['lesion_id'] = metadata['lesion_id'].fillna(metadata['image_id']) if 'lesion_id' in metadata \
+        else metadata['image_id']
+
+    # One row per lesion: its class (malignant if any of its images is) and its image count
+    metadata['malignant'] = metadata['label'] == 'malignant'
+    lesions = metadata.groupby('lesion_id', sort=False).agg(malignant=('malignant', 'max'), images=('image_id', 'size'))
+    metadata = metadata.drop(columns='malignant')
+    lesions['label'] = np.where(lesions['malignant'], 'malignant', 'benign')
+
+    # Shuffle lesions, then place each one by the cumulative share of its class's images
+    # up to its midpoint: [0, train) -> train, [train, train + validation) -> validation, rest -> test
+    rng = np.random.default_rng(seed)
+    lesions = lesions.iloc[rng.permutation(len(lesions))]
+    by_label = lesions.groupby('label', sort=False)['images']
+    position = (by_label.cumsum() - lesions['images'] / 2) / by_label.transform('sum')
+    train_fraction = 1.0 - validation_fraction - test_fraction
+    edges = [train_fraction, train_fraction + validation_fraction]
+    lesions['split'] = np.asarray(SPLITS)[np.searchsorted(edges, position.to_numpy(), side='right')]
+
+    metadata['split'] = metadata['lesion_id'].map(lesions['split'])
+    return metadata
+
+
+def build_split_manifest(metadata_path, sample_size=SAMPLE_SIZE, validation_fraction=VALIDATION_FRACTION,
+                         test_fraction=TEST_FRACTION, seed=SPLIT_SEED):
+    """
+    Returns the split table (one row per image), reusing SPLITS_PATH when it was built
+    from the same metadata file and configuration; otherwise builds and writes it.
+    """
+    st = os.stat(metadata_path)
+    config = {"metadata": {"size": st.st_size, "mtime_ns": st.st_mtime_ns}, "sample_size": sample_size,
+              "validation_fraction": validation_fraction, "test_fraction": test_fraction, "seed": seed}
+    try:
+        with open(SPLITS_CONFIG_PATH) as f:
+            if json.load(f).get('config') == config:
+                logging.info(f"Reusing the split manifest {SPLITS_PATH}")
+                return pd.read_csv(SPLITS_PATH)
+    except (OSError, ValueError):
+        pass
+
     logging.info("Loading metadata...")
-    metadata = pd.read_csv("ham10000_temp/HAM10000_metadata.csv")
+    metadata = pd.read_csv(metadata_path)
 
-    # 4. Map diagnoses to 'benign' or 'malignant'
+    # Map diagnoses to 'benign' or 'malignant'
     logging.info("Mapping diagnoses to benign/malignant...")
-    metadata['label'] = metadata['dx'].map({
-        'nv': 'benign', 'bkl': 'benign', 'df': 'benign', 'vasc': 'benign',
-        'mel': 'malignant', 'bcc': 'malignant', 'akiec': 'malignant'
-    })
-    metadata['image_path'] = metadata['image_id'].apply(lambda x: f"{x}.jpg")
-
-    # 5. --- Create an exact stratified sample of up to 1000 images ---
-    sample_size = min(1000, len(metadata))
-    logging.info(f"Creating a stratified sample of {sample_size} images to speed up development...")
-
-    # Determine per-class sample counts proportionally (min 1 per class) and adjust to sum exactly sample_size
-    label_counts = metadata['label'].value_counts().to_dict()
-    total = len(metadata)
-    per_class = {label: max(1, int(round((count / total) * sample_size))) for label, count in label_counts.items()}
-    current = sum(per_class.values())
-    labels = list(per_class.keys())
-    # If we need to add samples, add to the largest classes
-    while current < sample_size:
-        # choose class with largest original count
-        target = max(labels, key=lambda l: label_counts[l])
-        per_class[target] += 1
-        current += 1
-    # If we need to remove samples, remove from classes with allocation > 1
-    while current > sample_size:
-        candidate = max(labels, key=lambda l: per_class[l] if per_class[l] > 1 else -1)
-        if per_class[candidate] > 1:
-            per_class[candidate] -= 1
-            current -= 1
+    metadata['label'] = metadata['dx'].map(DIAGNOSIS_LABELS)
+    unknown = metadata['label'].isna()
+    if unknown.any():
+        logging.warning(f"Skipping {int(unknown.sum())} images with unknown diagnoses: "
+                        f"{sorted(metadata.loc[unknown, 'dx'].astype(str).unique())}")
+        metadata = metadata[~unknown]
+    metadata['image_path'] = metadata['image_id'] + '.jpg'
+
+    splits = assign_splits(create_sample(metadata, sample_size, seed), validation_fraction, test_fraction, seed)
+    splits = splits.sort_values(['split', 'label', 'image_id']).reset_index(drop=True)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    splits.to_csv(SPLITS_PATH, index=False)
+    counts = splits.groupby(['split', 'label']).size()
+    with open(SPLITS_CONFIG_PATH, 'w') as f:
+        json.dump({"config": config, "counts": {f"{split}/{label}": int(n) for (split, label), n in counts.items()}},
+                  f, indent=2)
+    for (split, label), n in counts.items():
+        logging.info(f"- {split}/{label}: {n} images")
+    return splits
+
+
+def source_signature(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def load_manifest():
+    """Loads the manifest of resized images ({destination: entry}); empty if missing or outdated."""
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("image_size") != list(IMAGE_SIZE):
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(files, timings=None):
+    """Writes the manifest atomically so an interrupted run never leaves it half written."""
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({"version": MANIFEST_VERSION, "image_size": list(IMAGE_SIZE), "files": files,
+                   "timings": timings or {}}, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def resize_image(src_path, dest_path):
+    """Resizes one image (runs in a worker process). Returns (dest_path, error)."""
+    from PIL import Image
+    try:
+        with Image.open(src_path) as img:
+            img = img.resize(IMAGE_SIZE)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            # Write under a temporary name: a killed worker never leaves a truncated image behind
+            tmp_path = dest_path + '.part'
+            img.save(tmp_path, format='JPEG')
+        os.replace(tmp_path, dest_path)
+        return dest_path, None
+    except Exception as e:
+        return dest_path, f"Failed to process/move {src_path} -> {dest_path}: {e}"
+
+
+def plan_images(splits, image_index):
+    """Maps the destination of every image in the split table to its source file."""
+    sources = splits['image_path'].map(image_index)
+    missing = sources.isna()
+    for image_filename in splits.loc[missing, 'image_path']:
+        logging.warning(f"Image not found in source dirs: {image_filename}")
+    present = splits[~missing]
+    destinations = DATA_DIR + os.sep + present['split'] + os.sep + present['label'] + os.sep + present['image_path']
+    return dict(zip(destinations, sources[~missing]))
+
+
+def resize_images(planned, workers=RESIZE_WORKERS):
+    """
+    Resizes the planned images in a process pool, skipping those the manifest already
+    records with the same source signature. Returns the updated manifest entries.
+    """
+    manifest = load_manifest()
+    files = {}
+    pending = []
+    for dest_path, src_path in planned.items():
+        signature = dict(source_signature(src_path), source=os.path.basename(src_path))
+        if manifest.get(dest_path) == signature and os.path.exists(dest_path):
+            files[dest_path] = signature
         else:
-            break
+            pending.append((dest_path, src_path, signature))
+    logging.info(f"{len(files)} images up to date, {len(pending)} to resize with {workers} workers")
+
+    if pending:
+        done = 0
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {pool.submit(resize_image, src_path, dest_path): signature
+                       for dest_path, src_path, signature in pending}
+            for future in as_completed(futures):
+                dest_path, error = future.result()
+                done += 1
+                if error:
+                    logging.error(error)
+                    continue
+                files[dest_path] = futures[future]
+                if done % MANIFEST_SAVE_EVERY == 0:
+                    save_manifest(files)
+                # Log progress: every 10% and the final image to reduce spam
+                if done % max(1, len(pending) // 10) == 0 or done == len(pending):
+                    logging.info(f"Progress: {done}/{len(pending)} images resized")
+        finally:
+            # On interruption, drop the queued images and keep a record of the finished ones
+            pool.shutdown(wait=True, cancel_futures=True)
+            save_manifest(files)
+    return files
 
-    # Build the sampled metadata by sampling exactly per-class counts
-    sampled_frames = []
-    for label, n in per_class.items():
-        group = metadata[metadata['label'] == label]
-        if len(group) <= n:
-            sampled_frames.append(group)
+
+def remove_stale_images(split_dirs, keep):
+    """Deletes images left in the split directories by earlier runs that are no longer planned."""
+    removed = 0
+    for split_dir in split_dirs:
+        for root, _, names in os.walk(split_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if path not in keep:
+                    os.remove(path)
+                    removed += 1
+    if removed:
+        logging.info(f"Removed {removed} stale images from previous runs")
+
+
+def write_shard(paths, labels, image_ids, out_path, export_format):
+    """Packs resized images into one shard file (runs in a worker process). Returns (out_path, error)."""
+    from PIL import Image
+    try:
+        images = np.stack([np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8) for path in paths])
+        tmp_path = out_path + '.part'
+        if export_format == 'npy':
+            with open(tmp_path, 'wb') as f:
+                np.save(f, images)
         else:
-            sampled_frames.append(group.sample(n=n, random_state=42))
-    sampled_metadata = pd.concat(sampled_frames).sample(frac=1, random_state=42).reset_index(drop=True)
-
-    # No need to download images individually since we already have the full dataset extracted
-    logging.info("Using images from the downloaded dataset...")
-
-    # 6. Create train/validation directories
-    logging.info("Creating training and validation directories...")
-    base_dir = 'data'
-    if os.path.exists(base_dir):
-        shutil.rmtree(base_dir) # Clean up previous runs
-    train_dir = os.path.join(base_dir, 'train')
-    validation_dir = os.path.join(base_dir, 'validation')
-    os.makedirs(os.path.join(train_dir, 'benign'), exist_ok=True)
-    os.makedirs(os.path.join(train_dir, 'malignant'), exist_ok=True)
-    os.makedirs(os.path.join(validation_dir, 'benign'), exist_ok=True)
-    os.makedirs(os.path.join(validation_dir, 'malignant'), exist_ok=True)
-
-    # 7. Split the *sampled* data into training and validation sets
-    logging.info("Splitting the sampled data into training (80%) and validation (20%) sets...")
-    train_df, validation_df = train_test_split(sampled_metadata, test_size=0.2, random_state=42, stratify=sampled_metadata['label'])
-
-    # 8. Move images to the correct directories
-    def move_images(df, source_dirs, destination_dir, total_to_move):
-        from PIL import Image
-        moved_count = 0
-        for _, row in df.iterrows():
-            image_filename = row['image_path']
-            label = row['label']
-            found = False
-            for source_dir in source_dirs:
-                src_path = os.path.join(source_dir, image_filename)
-                if os.path.exists(src_path):
-                    dest_path = os.path.join(destination_dir, label, image_filename)
-                    try:
-                        # Resize the image before saving
-                        with Image.open(src_path) as img:
-                            img = img.resize((224, 224))  # Resize to 224x224 for ResNet50
-                            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-                            img.save(dest_path)
-                        moved_count += 1
-                        found = True
-                        # Log progress: every 10 images and the final image to reduce spam
-                        if moved_count % 10 == 0 or moved_count == total_to_move:
-                            logging.info(f"Progress: {moved_count}/{total_to_move} images processed and moved to {destination_dir}")
-                        else:
-                            logging.debug(f"Processed and moved {image_filename} ({moved_count}/{total_to_move})")
-                    except Exception as e:
-                        logging.error(f"Failed to process/move {src_path} -> {dest_path}: {e}")
-                    break
-            if not found:
-                logging.warning(f"Image not found in source dirs: {image_filename}")
-        logging.info(f"Finished processing and moving to {destination_dir}: {moved_count}/{total_to_move} moved")
-
-    source_image_dirs = [os.path.join("ham10000_temp", "HAM10000_images_part_1"), 
-                   os.path.join("ham10000_temp", "HAM10000_images_part_2")]
-    
-    # Ensure source directories exist
-    for dir_path in source_image_dirs:
-        if not os.path.exists(dir_path):
-            logging.warning(f"Source directory not found: {dir_path}")
-            source_image_dirs.remove(dir_path)
-    
-    if not source_image_dirs:
-        logging.error("No source image directories found! The dataset might not have been downloaded correctly.")
+            import tensorflow as tf
+            with tf.io.TFRecordWriter(tmp_path) as writer:
+                for image, label, image_id in zip(images, labels, image_ids):
+                    feature = {
+                        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+                        'shape': tf.train.Feature(int64_list=tf.train.Int64List(value=list(image.shape))),
+                        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+                        'image_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_id.encode('utf-8')])),
+                    }
+                    writer.write(tf.train.Example(features=tf.train.Features(feature=feature)).SerializeToString())
+        os.replace(tmp_path, out_path)
+        return out_path, None
+    except Exception as e:
+        return out_path, f"Failed to write shard {out_path}: {e}"
+
+
+def export_shards(files, splits, export_format=EXPORT_FORMAT, shard_size=SHARD_SIZE, workers=RESIZE_WORKERS):
+    """
+    Packs each prepared split into shards of `shard_size` uint8 images under
+    SHARDS_DIR/<split>, with an index.json listing the shards and, per record, its
+    label and HAM10000 metadata. Splits whose images did not change are not rewritten.
+    """
+    extension = {'npy': '.npy', 'tfrecord': '.tfrecord'}[export_format]
+    by_image = splits.set_index('image_path')
+    splits = {}
+    for path in sorted(files):
+        split = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        splits.setdefault(split, []).append(path)
+
+    for split, paths in splits.items():
+        split_dir = os.path.join(SHARDS_DIR, split)
+        index_path = os.path.join(split_dir, 'index.json')
+        digest = hashlib.sha256(json.dumps([SHARD_INDEX_VERSION, export_format, shard_size, list(IMAGE_SIZE),
+                                            [(path, files[path]) for path in paths]]).encode('utf-8')).hexdigest()
+        try:
+            with open(index_path) as f:
+                if json.load(f).get('fingerprint') == digest:
+                    logging.info(f"Shards for '{split}' are up to date")
+                    continue
+        except (OSError, ValueError):
+            pass
+
+        class_names = sorted({os.path.basename(os.path.dirname(path)) for path in paths})
+        labels = [class_names.index(os.path.basename(os.path.dirname(path))) for path in paths]
+        image_ids = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        rows = by_image.loc[[os.path.basename(path) for path in paths],
+                            [column for column in RECORD_COLUMNS if column in by_image.columns]]
+        # to_json turns NaN into null and NumPy scalars into plain JSON values
+        records = [dict(record, label=class_names[label], label_index=label)
+                   for record, label in zip(json.loads(rows.to_json(orient='records')), labels)]
+
+        if os.path.isdir(split_dir):
+            shutil.rmtree(split_dir)
+        os.makedirs(split_dir)
+        shards = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for number, start in enumerate(range(0, len(paths), shard_size)):
+                end = min(start + shard_size, len(paths))
+                name = f"shard-{number:05d}{extension}"
+                shards.append({"file": name, "count": end - start})
+                futures.append(pool.submit(write_shard, paths[start:end], labels[start:end], image_ids[start:end],
+                                           os.path.join(split_dir, name), export_format))
+            for future in as_completed(futures):
+                _, error = future.result()
+                if error:
+                    logging.error(error)
+                    return
+        np.save(os.path.join(split_dir, 'labels.npy'), np.asarray(labels, dtype=np.int64))
+        # The index is written last: a split without index.json is incomplete
+        with open(index_path, 'w') as f:
+            json.dump({"version": SHARD_INDEX_VERSION, "format": export_format, "fingerprint": digest,
+                       "image_shape": [IMAGE_SIZE[1], IMAGE_SIZE[0], 3], "class_names": class_names,
+                       "count": len(paths), "shards": shards, "records": records}, f)
+        logging.info(f"Exported {len(paths)} '{split}' images into {len(shards)} {export_format} shards in {split_dir}")
+
+
+def download_and_prepare_data(source=DATASET_SOURCE, workers=RESIZE_WORKERS, cleanup=False,
+                              export_format=EXPORT_FORMAT, shard_size=SHARD_SIZE, sample_size=SAMPLE_SIZE,
+                              validation_fraction=VALIDATION_FRACTION, test_fraction=TEST_FRACTION, seed=SPLIT_SEED):
+    """
+    Downloads the HAM10000 dataset (or reads it from a local zip or directory),
+    builds stratified train/validation/test splits grouped by lesion (optionally on a
+    sample), and organizes the resized images for training.
+    """
+    if validation_fraction < 0 or test_fraction < 0 or validation_fraction + test_fraction >= 1:
+        logging.error("The validation and test fractions must be non-negative and leave room for training.")
         return
+    timings = {}
 
-    logging.info("Moving and resizing training images...")
-    expected_train = len(train_df)
-    move_images(train_df, source_image_dirs, train_dir, expected_train)
+    # 1. Locate the raw dataset (local directory, local zip or Kaggle download)
+    with timed('fetch', timings):
+        dataset_dir = fetch_dataset(source)
+    if dataset_dir is None:
+        return
+
+    # 2. Index the dataset files once
+    with timed('index', timings):
+        metadata_path, image_index = index_dataset(dataset_dir)
+    if metadata_path is None:
+        logging.error(f"{METADATA_FILE} not found in {dataset_dir}! The dataset might not have been downloaded correctly.")
+        return
+    if not image_index:
+        logging.error("No source images found! The dataset might not have been downloaded correctly.")
+        return
+
+    # 3. Sample and split by lesion (or reuse the split manifest of a previous run)
+    with timed('split', timings):
+        splits = build_split_manifest(metadata_path, sample_size, validation_fraction, test_fraction, seed)
 
-    logging.info("Moving and resizing validation images...")
-    expected_val = len(validation_df)
-    move_images(validation_df, source_image_dirs, validation_dir, expected_val)
+    # 4. Resize images into the split directories (resuming from the manifest)
+    split_dirs = [os.path.join(DATA_DIR, split) for split in SPLITS]
+    for split, label in splits[['split', 'label']].drop_duplicates().itertuples(index=False):
+        os.makedirs(os.path.join(DATA_DIR, split, label), exist_ok=True)
+
+    with timed('resize', timings):
+        planned = plan_images(splits, image_index)
+        files = resize_images(planned, workers)
+        remove_stale_images(split_dirs, set(files))
 
     # Verify the final dataset structure
-    total_train = sum(len(os.listdir(os.path.join(train_dir, label))) for label in ['benign', 'malignant'])
-    total_val = sum(len(os.listdir(os.path.join(validation_dir, label))) for label in ['benign', 'malignant'])
-    
+    counts = Counter(os.path.basename(os.path.dirname(os.path.dirname(path))) for path in files)
     logging.info(f"Final dataset statistics:")
-    logging.info(f"- Training images: {total_train}")
-    logging.info(f"- Validation images: {total_val}")
-    
-    # 9. Clean up temporary directory
-    logging.info("Cleaning up temporary files...")
-    shutil.rmtree("ham10000_temp")
-    
+    logging.info(f"- Training images: {counts['train']}")
+    logging.info(f"- Validation images: {counts['validation']}")
+    if counts['test']:
+        logging.info(f"- Test images: {counts['test']}")
+
+    # 5. Optionally pack the prepared splits into shards
+    if export_format != 'none':
+        with timed('export', timings):
+            export_shards(files, splits, export_format, shard_size, workers)
+
+    # 6. Optionally clean up the temporary directory (later runs will download/extract again)
+    if cleanup and os.path.exists(TEMP_DIR):
+        logging.info("Cleaning up temporary files...")
+        shutil.rmtree(TEMP_DIR)
+
+    save_manifest(files, timings)
+    logging.info("Stage timings: " + ", ".join(f"{stage}={seconds:.2f}s" for stage, seconds in timings.items()))
     logging.info("Data preparation complete! The 'data' directory is ready for training.")
 
+
 if __name__ == '__main__':
-    download_and_prepare_data()
+    parser = argparse.ArgumentParser(description="Prepare the HAM10000 splits used for training.")
+    parser.add_argument('--source', default=DATASET_SOURCE,
+                        help="Local HAM10000 zip or directory (default: download from Kaggle)")
+    parser.add_argument('--workers', type=int, default=RESIZE_WORKERS, help="Resize worker processes")
+    parser.add_argument('--cleanup', action='store_true', help=f"Delete {TEMP_DIR} when finished")
+    parser.add_argument('--export', choices=['none', 'npy', 'tfrecord'], default=EXPORT_FORMAT,
+                        help=f"Also pack the prepared splits into shards under {SHARDS_DIR}")
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help="Images per shard")
+    parser.add_argument('--sample-size', type=int, default=SAMPLE_SIZE,
+                        help="Images to sample from the metadata (0 = full dataset)")
+    parser.add_argument('--val-fraction', type=float, default=VALIDATION_FRACTION)
+    parser.add_argument('--test-fraction', type=float, default=TEST_FRACTION)
+    parser.add_argument('--seed', type=int, default=SPLIT_SEED)
+    args = parser.parse_args()
+    download_and_prepare_data(args.source, args.workers, args.cleanup, args.export, args.shard_size,
+                              args.sample_size, args.val_fraction, args.test_fraction, args.seed)
@@ -94,7 +94,7 @@ function displayResults(data) {
 
     resultCard.innerHTML = diagnosisHTML;
 
-    // Agregar visualización SHAP si está disponible
+    // Agregar visualización SHAP si está disponible (o si se está generando)
     if (data.prediction.shap_plot_url) {
         const shapAnalysis = document.createElement('div');
         shapAnalysis.className = 'mt-6';
@@ -110,42 +110,101 @@ function displayResults(data) {
         `;
         resultCard.appendChild(shapAnalysis);
 
-        // Cargar visualización Plotly si está disponible
-        if (typeof Plotly !== 'undefined') {
-            fetch(data.prediction.shap_plot_url)
-                .then(response => response.json())
-                .then(plotData => {
-                    Plotly.newPlot('plotlyVisualization', plotData.data, plotData.layout, {responsive: true});
+        if (data.prediction.shap_status === 'pending' && data.prediction.shap_job_id) {
+            // La explicación se calcula en segundo plano: mostrar un aviso y esperar al trabajo
+            shapAnalysis.querySelector('#plotlyVisualization').innerHTML = `
+                <div class="flex items-center space-x-3 text-gray-400 py-6 justify-center">
+                    <div class="animate-spin rounded-full h-6 w-6 border-t-2 border-b-2 border-brand-blue"></div>
+                    <span>Generando explicación visual...</span>
+                </div>`;
+            waitForShapJob(data.prediction.shap_job_id)
+                .then(job => {
+                    if (job.status !== 'done') {
+                        shapAnalysis.querySelector('#plotlyVisualization').textContent =
+                            'No se pudo generar la explicación visual.';
+                        return;
+                    }
+                    const prediction = Object.assign({}, data.prediction, {
+                        shap_plot_url: job.shap_plot_url,
+                        explanation: job.explanation,
+                        shap_status: 'done'
+                    });
+                    renderShapPlot(prediction);
+                    resultCard.appendChild(buildReportButton(prediction));
                 })
                 .catch(error => {
-                    console.error('Error cargando la visualización:', error);
+                    console.error('Error esperando la explicación SHAP:', error);
+                    shapAnalysis.querySelector('#plotlyVisualization').textContent =
+                        'No se pudo obtener la explicación visual.';
                 });
-            // Si el backend devolvió una explicación textual, mostrarla
-            if (data.prediction.explanation) {
-                const explEl = document.getElementById('shapExplanation');
-                if (explEl) explEl.textContent = data.prediction.explanation;
-            }
+        } else {
+            renderShapPlot(data.prediction);
+            // Botón para abrir informe detallado (nueva página)
+            resultCard.appendChild(buildReportButton(data.prediction));
         }
     }
 
-        // Botón para abrir informe detallado (nueva página)
-        if (data.prediction.shap_plot_url) {
-            const btnWrap = document.createElement('div');
-            btnWrap.className = 'mt-4';
-            const params = new URLSearchParams();
-            params.set('plot', data.prediction.shap_plot_url);
-            params.set('explanation', data.prediction.explanation || '');
-            params.set('decision', data.prediction.decision || '');
-            params.set('maligno', data.prediction.probabilities?.maligno || '');
-            params.set('benigno', data.prediction.probabilities?.benigno || '');
-            const href = `/shap_report.html?${params.toString()}`;
-            btnWrap.innerHTML = `<a href="${href}" target="_blank" class="inline-block px-4 py-2 bg-brand-blue text-white rounded-md font-semibold">Ver informe detallado</a>`;
-            resultCard.appendChild(btnWrap);
-        }
-
     resultsContainer.appendChild(resultCard);
     resultsContainer.classList.remove('hidden');
 }
 
+/**
+ * Consulta el estado de un trabajo SHAP con long-polling hasta que termine.
+ * @param {string} jobId - Identificador devuelto por /api/analyze.
+ * @returns {Promise<object>} - El trabajo en estado 'done' o 'error'.
+ */
+async function waitForShapJob(jobId) {
+    while (true) {
+        const response = await fetch(`/api/shap/${encodeURIComponent(jobId)}?wait=20`);
+        if (!response.ok) {
+            throw new Error(`Error consultando el trabajo SHAP: ${response.status}`);
+        }
+        const body = await response.json();
+        if (body.job && (body.job.status === 'done' || body.job.status === 'error')) {
+            return body.job;
+        }
+    }
+}
+
+/**
+ * Carga la visualización SHAP (ver shap_artifact.js) y muestra la explicación textual.
+ * @param {object} prediction - La sección `prediction` de la respuesta.
+ */
+function renderShapPlot(prediction) {
+    if (typeof Plotly === 'undefined') return;
+    loadShapFigure(prediction.shap_plot_url)
+        .then(plotData => {
+            Plotly.newPlot('plotlyVisualization', plotData.data, plotData.layout, {responsive: true});
+        })
+        .catch(error => {
+            console.error('Error cargando la visualización:', error);
+        });
+    // Si el backend devolvió una explicación textual, mostrarla
+    if (prediction.explanation) {
+        const explEl = document.getElementById('shapExplanation');
+        if (explEl) explEl.textContent = prediction.explanation;
+    }
+}
+
+/**
+ * Construye el botón que abre el informe detallado en una nueva página.
+ * @param {object} prediction - La sección `prediction` de la respuesta.
+ * @returns {HTMLElement}
+ */
+function buildReportButton(prediction) {
+    const btnWrap = document.createElement('div');
+    btnWrap.className = 'mt-4';
+    const params = new URLSearchParams();
+    params.set('plot', prediction.shap_plot_url);
+    if (prediction.shap_job_id) params.set('job', prediction.shap_job_id);
+    params.set('explanation', prediction.explanation || '');
+    params.set('decision', prediction.decision || '');
+    params.set('maligno', prediction.probabilities?.maligno || '');
+    params.set('benigno', prediction.probabilities?.benigno || '');
+    const href = `/shap_report.html?${params.toString()}`;
+    btnWrap.innerHTML = `<a href="${href}" target="_blank" class="inline-block px-4 py-2 bg-brand-blue text-white rounded-md font-semibold">Ver informe detallado</a>`;
+    return btnWrap;
+}
+
 // Exportar las funciones que necesitamos
 window.displayResults = displayResults;
\ No newline at end of file
@@ -0,0 +1,99 @@
+// shap_artifact.js
+// Lee los artefactos SHAP binarios del servidor y construye la figura de Plotly en el navegador.
+// Formato (gzip): 'SHAP' + uint32 LE (longitud de la cabecera) + cabecera JSON + mapa de calor uint8.
+
+const SHAP_ARTIFACT_MAGIC = 'SHAP';
+
+/**
+ * Descarga y decodifica un artefacto SHAP.
+ * @param {string} url - URL del artefacto (`shap_plot_url`).
+ * @returns {Promise<{header: object, heatmap: number[][], imageUrl: string}>}
+ */
+async function fetchShapArtifact(url) {
+    const response = await fetch(url);
+    if (!response.ok) throw new Error(`HTTP ${response.status} al descargar ${url}`);
+    const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+    const buffer = await new Response(stream).arrayBuffer();
+
+    const bytes = new Uint8Array(buffer);
+    const magic = String.fromCharCode(...bytes.subarray(0, 4));
+    if (magic !== SHAP_ARTIFACT_MAGIC) throw new Error('Artefacto SHAP no válido');
+    const headerLength = new DataView(buffer).getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(bytes.subarray(8, 8 + headerLength)));
+
+    // Descuantizar: uint8 -> [0, scale]
+    const [rows, cols] = header.shape;
+    const values = bytes.subarray(8 + headerLength);
+    const factor = header.scale / 255;
+    const heatmap = [];
+    for (let r = 0; r < rows; r++) {
+        const row = new Array(cols);
+        for (let c = 0; c < cols; c++) row[c] = values[r * cols + c] * factor;
+        heatmap.push(row);
+    }
+    return { header, heatmap, imageUrl: new URL(header.image, new URL(url, window.location.href)).href };
+}
+
+/**
+ * Construye la figura (imagen original y mapa de calor SHAP lado a lado).
+ * @returns {{data: object[], layout: object}}
+ */
+function buildShapFigure({ header, heatmap, imageUrl }) {
+    const [height, width] = header.source_shape;
+    const step = header.downsample || 1;
+    const maxAbs = header.scale;
+    const axis = { showgrid: false, zeroline: false };
+    return {
+        data: [
+            { type: 'image', source: imageUrl, name: 'Original', xaxis: 'x', yaxis: 'y' },
+            {
+                type: 'heatmap',
+                z: heatmap,
+                // Cada celda cubre un bloque de step×step píxeles de la imagen original
+                x0: (step - 1) / 2, dx: step,
+                y0: (step - 1) / 2, dy: step,
+                colorscale: 'RdBu',
+                zmid: 0,
+                zmin: -maxAbs,
+                zmax: maxAbs,
+                showscale: true,
+                colorbar: { title: { text: 'Importancia', side: 'right' }, thickness: 15, len: 0.7 },
+                name: 'Análisis SHAP',
+                xaxis: 'x2',
+                yaxis: 'y2'
+            }
+        ],
+        layout: {
+            title: { text: 'Análisis Visual de Características', y: 0.95, x: 0.5, xanchor: 'center', yanchor: 'top', font: { size: 20 } },
+            height: 600,
+            width: 1000,
+            showlegend: true,
+            plot_bgcolor: 'rgb(13, 17, 23)',
+            paper_bgcolor: 'rgb(13, 17, 23)',
+            font: { color: 'rgb(205, 213, 224)' },
+            margin: { l: 40, r: 40, t: 60, b: 40 },
+            xaxis: { ...axis, domain: [0, 0.45] },
+            yaxis: { ...axis, autorange: 'reversed' },
+            xaxis2: { ...axis, domain: [0.55, 1], range: [-0.5, width - 0.5] },
+            yaxis2: { ...axis, range: [height - 0.5, -0.5], scaleanchor: 'x2' },
+            annotations: [
+                { text: 'Imagen Original', x: 0.225, y: 1.0, xref: 'paper', yref: 'paper', xanchor: 'center', yanchor: 'bottom', showarrow: false, font: { size: 16 } },
+                { text: 'Áreas de Interés (SHAP)', x: 0.775, y: 1.0, xref: 'paper', yref: 'paper', xanchor: 'center', yanchor: 'bottom', showarrow: false, font: { size: 16 } }
+            ]
+        }
+    };
+}
+
+/**
+ * Carga la visualización SHAP de `url` y devuelve la figura lista para Plotly.newPlot.
+ * Las URLs `.json` son figuras completas generadas por versiones anteriores del servidor.
+ * @param {string} url
+ * @returns {Promise<{data: object[], layout: object}>}
+ */
+async function loadShapFigure(url) {
+    if (url.endsWith('.json')) {
+        const response = await fetch(url);
+        return response.json();
+    }
+    return buildShapFigure(await fetchShapArtifact(url));
+}
@@ -1,13 +1,33 @@
 // shap_report.js
-// Renderiza el informe detallado a partir de query params: plot (URL al JSON), explanation, decision, probabilities
+// Renderiza el informe detallado a partir de query params: plot (URL del artefacto SHAP), job (trabajo SHAP opcional),
+// explanation, decision, probabilities
 
 function q(name){
   return decodeURIComponent((new URLSearchParams(window.location.search)).get(name) || '');
 }
 
+// Espera (long-poll) a que el trabajo SHAP termine; devuelve el trabajo o null si no existe
+async function waitForJob(jobId){
+  while (true) {
+    const res = await fetch(`/api/shap/${encodeURIComponent(jobId)}?wait=20`);
+    if (!res.ok) return null;
+    const body = await res.json();
+    if (body.job && (body.job.status === 'done' || body.job.status === 'error')) return body.job;
+  }
+}
+
 async function renderReport(){
-  const plotUrl = q('plot');
-  const explanation = q('explanation');
+  let plotUrl = q('plot');
+  let explanation = q('explanation');
+  const jobId = q('job');
+  if (jobId) {
+    // Si la explicación aún se está generando, esperar a que esté lista
+    const job = await waitForJob(jobId);
+    if (job && job.status === 'done') {
+      plotUrl = job.shap_plot_url || plotUrl;
+      explanation = job.explanation || explanation;
+    }
+  }
   const decision = q('decision');
   const mal = q('maligno');
   const ben = q('benigno');
@@ -23,15 +43,13 @@ async function renderReport(){
     <p class="text-sm text-gray-300 mt-3">${explanation || 'Sin explicación disponible.'}</p>
   `;
 
-  // Load plot JSON and render
+  // Load the SHAP artifact, build the figure client-side and render
   if (plotUrl) {
     try {
-      const res = await fetch(plotUrl);
-      const fig = await res.json();
-      // fig should have .data and .layout
+      const fig = await loadShapFigure(plotUrl);
       Plotly.newPlot('plotlyReport', fig.data, fig.layout, {responsive:true});
     } catch (err){
-      console.error('No se pudo cargar el plot JSON', err);
+      console.error('No se pudo cargar el artefacto SHAP', err);
       document.getElementById('plotlyReport').textContent = 'Error cargando la visualización interactiva.';
     }
   }
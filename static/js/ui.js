@@ -47,7 +47,7 @@ async function analyzeFile(file, analysisType) {
 
     if (!response.ok) {
         const errorData = await response.json().catch(() => ({ error: 'Error desconocido en el servidor' }));
-        throw new Error(errorData.error || `Error del servidor: ${response.statusText}`);
+        throw new Error(errorData.message || errorData.error || `Error del servidor: ${response.statusText}`);
     }
 
     return response.json();
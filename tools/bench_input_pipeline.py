@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Compara el rendimiento (imágenes/s) del canal de entrada tf.data con el antiguo
+ImageDataGenerator.flow_from_directory sobre el mismo árbol de datos.
+
+Para cada canal se recorre el conjunto completo `--epochs` veces sin entrenar nada,
+sólo consumiendo lotes:
+ - generator: ImageDataGenerator (rescale + AUGMENTATION_PARAMS si hay aumentación).
+ - tf.data: make_dataset con la misma aumentación; la primera época incluye el
+   llenado de la caché y las siguientes la leen.
+
+`--data-dir` también puede ser un conjunto exportado en shards (data/shards/train);
+en ese caso sólo se mide tf.data, más el acceso aleatorio a registros sueltos.
+
+Uso:
+ python tools/bench_input_pipeline.py --data-dir data/train --epochs 2
+ python tools/bench_input_pipeline.py --data-dir data/train --no-augment --cache none
+ python tools/bench_input_pipeline.py --data-dir data/shards/train
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+# Permitir ejecutar el script desde la raíz del repositorio (python tools/<script>.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def measure_epochs(batches_for_epoch, epochs):
+    """Imágenes/s de cada época; `batches_for_epoch()` devuelve un iterable de lotes (imágenes, etiquetas)."""
+    results = []
+    for _ in range(epochs):
+        images = 0
+        started = time.perf_counter()
+        for batch, _ in batches_for_epoch():
+            images += len(batch)
+        elapsed = time.perf_counter() - started
+        results.append({"images": images, "seconds": elapsed, "images_per_second": images / elapsed})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data/train', help='Carpeta con una subcarpeta por clase')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--no-augment', action='store_true', help='Medir sin aumentación de datos')
+    parser.add_argument('--cache', default='memory', help="Caché de tf.data: 'memory', una ruta o 'none'")
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    args = parser.parse_args()
+
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
+    from backend.model.training.data import make_dataset
+    from backend.model.training.utils import AUGMENTATION_PARAMS
+    from backend.model.training.shards import ShardedDataset, is_shard_directory
+
+    augment = not args.no_augment
+    image_shape = (224, 224, 3)
+    sharded = is_shard_directory(args.data_dir)
+
+    generator = None
+    if not sharded:
+        datagen = ImageDataGenerator(rescale=1./255, **(AUGMENTATION_PARAMS if augment else {}))
+        iterator = datagen.flow_from_directory(args.data_dir, target_size=image_shape[:2],
+                                               batch_size=args.batch_size, class_mode='binary')
+        generator = measure_epochs(lambda: (iterator[i] for i in range(len(iterator))), args.epochs)
+
+    result, error = make_dataset(args.data_dir, image_shape, args.batch_size, augment=augment, shuffle=augment,
+                                 cache=None if args.cache == 'none' else args.cache)
+    if error:
+        logging.error(error)
+        return
+    dataset, info = result
+    pipeline = measure_epochs(lambda: dataset, args.epochs)
+
+    report = {
+        "data_dir": args.data_dir,
+        "images": info["samples"],
+        "batch_size": args.batch_size,
+        "augment": augment,
+        "cache": args.cache,
+        "generator": generator,
+        "tf_data": pipeline,
+    }
+    for name, epochs in (('generator', generator), ('tf.data', pipeline)):
+        if epochs:
+            logging.info('%s: %s imágenes/s por época', name,
+                         ', '.join(f"{e['images_per_second']:.1f}" for e in epochs))
+    if generator:
+        # Última época de cada canal (con la caché de tf.data ya llena si está activa)
+        report["speedup"] = pipeline[-1]["images_per_second"] / generator[-1]["images_per_second"]
+        logging.info('Aceleración (última época): %.2fx', report["speedup"])
+    shards = ShardedDataset(args.data_dir) if sharded else None
+    if shards is not None and shards.format == 'npy':
+        indices = np.random.default_rng(0).integers(0, len(shards), size=1000)
+        started = time.perf_counter()
+        for i in indices:
+            shards[int(i)]
+        report["random_access_us"] = (time.perf_counter() - started) / len(indices) * 1e6
+        logging.info('Acceso aleatorio a un registro: %.1f µs', report["random_access_us"])
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Benchmark del pipeline de análisis de piel, por etapas y de extremo a extremo.
+
+Etapas (cada llamada procesa un lote de `batch_size` imágenes):
+ - preprocess: `preprocess_image` sobre los bytes de cada imagen.
+ - inference: `engine.predict` del lote ya preprocesado.
+ - shap/<nivel>: `explainer.shap_values` del lote con cada nivel de --shap-tiers.
+ - render: `generate_shap_image` de cada imagen del lote.
+ - e2e/<nivel>: `make_prediction` con SHAP síncrono (una imagen por llamada).
+
+Cada etapa se ejecuta con cada concurrencia de --concurrency (hilos lanzando
+llamadas a la vez) y se informa de p50/p95/p99, rendimiento (imágenes/s) y RSS
+máximo del proceso en JSON. Con --baseline se compara contra un informe anterior y
+el proceso termina con código 1 si alguna métrica empeora más de --tolerance.
+
+Uso:
+ python tools/bench_pipeline.py --random-weights --save-baseline bench/baseline.json
+ python tools/bench_pipeline.py --random-weights --baseline bench/baseline.json
+ python tools/bench_pipeline.py --images uploads --batch-sizes 1 8 --concurrency 1 4 --shap-tiers coarse fast
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import shutil
+import logging
+import resource
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Permitir ejecutar el script desde la raíz del repositorio (python tools/<script>.py)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+STAGES = ('preprocess', 'inference', 'shap', 'render', 'e2e')
+
+
+def peak_rss_mb():
+    """RSS máximo del proceso hasta ahora (ru_maxrss está en KB en Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def load_images(paths):
+    """Bytes de las imágenes indicadas (archivos o carpetas)."""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTENSIONS))
+            images += [open(os.path.join(path, n), 'rb').read() for n in names]
+        else:
+            images.append(open(path, 'rb').read())
+    return images
+
+
+def measure(call, units, concurrency, iterations, warmup):
+    """
+    Ejecuta `call(i)` `iterations` veces (tras `warmup` descartadas) con `concurrency`
+    hilos. Cada llamada procesa `units` imágenes. Devuelve las métricas de la etapa.
+    """
+    for i in range(warmup):
+        call(i)
+
+    def timed_call(i):
+        started = time.perf_counter()
+        call(i)
+        return (time.perf_counter() - started) * 1000.0
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed_call, range(iterations)))
+    else:
+        latencies = [timed_call(i) for i in range(iterations)]
+    wall = time.perf_counter() - started
+    latencies = np.asarray(latencies)
+    return {
+        "iterations": iterations,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "images_per_second": units * iterations / wall,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Cambios relativos respecto al informe `baseline` y lista de regresiones."""
+    comparison, regressions = {}, []
+    for key, result in report["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if base is None:
+            continue
+        p95_change = result["p95_ms"] / base["p95_ms"] - 1.0
+        throughput_change = result["images_per_second"] / base["images_per_second"] - 1.0
+        regressed = p95_change > tolerance or throughput_change < -tolerance
+        comparison[key] = {"p95_change": p95_change, "throughput_change": throughput_change, "regression": regressed}
+        if regressed:
+            regressions.append(key)
+    if baseline.get("peak_rss_mb"):
+        rss_change = report["peak_rss_mb"] / baseline["peak_rss_mb"] - 1.0
+        comparison["peak_rss_mb"] = {"change": rss_change, "regression": rss_change > tolerance}
+        if rss_change > tolerance:
+            regressions.append("peak_rss_mb")
+    return comparison, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', nargs='+', default=[os.path.join(ROOT, 'uploads')],
+                        help='Imágenes o carpetas de imágenes de prueba')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--shap-iterations', type=int, default=3,
+                        help='Iteraciones de las etapas con SHAP (shap, e2e), mucho más lentas')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--shap-tiers', nargs='+', default=['coarse', 'fast'], choices=['coarse', 'fast', 'full'])
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Usar la arquitectura de create_model con pesos aleatorios en lugar de model.h5')
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    parser.add_argument('--baseline', help='Informe anterior con el que comparar')
+    parser.add_argument('--save-baseline', help='Guardar este informe como nueva referencia')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Empeoramiento relativo permitido (p95, imágenes/s y RSS) antes de marcar regresión')
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        logging.error('No hay imágenes de prueba en %s', args.images)
+        return 1
+    output_paths = {name: os.path.abspath(path) for name, path in
+                    (('output', args.output), ('baseline', args.baseline), ('save_baseline', args.save_baseline)) if path}
+
+    from backend.model import predict
+    from backend.model.model import create_model, load_trained_model, get_model_version
+
+    # Cada medición debe pasar por el modelo: sin caché de resultados
+    predict.RESULT_CACHE_ENABLED = False
+    if args.random_weights:
+        model, err = create_model(weights=None)
+        class_names = ['benigno', 'maligno']
+    else:
+        model, class_names = load_trained_model()
+        err = None if model is not None else 'model.h5 no disponible'
+    if model is None:
+        logging.error('No se pudo cargar el modelo: %s', err)
+        return 1
+    predict.load_model_resources(model, class_names, 'random' if args.random_weights else get_model_version())
+
+    # Los artefactos SHAP se escriben en un directorio temporal, no en static/ del repositorio
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.chdir(workdir)
+    os.makedirs('static/shap', exist_ok=True)
+
+    preprocessed = [predict.preprocess_image(data) for data in images]
+    processed = np.concatenate([p for p, _, _ in preprocessed])
+    originals = [o for _, o, _ in preprocessed]
+
+    def batch_indices(i, size):
+        return [(i * size + k) % len(images) for k in range(size)]
+
+    report = {
+        "config": {"images": len(images), "batch_sizes": args.batch_sizes, "concurrency": args.concurrency,
+                   "iterations": args.iterations, "shap_iterations": args.shap_iterations,
+                   "shap_tiers": args.shap_tiers, "engine": predict.engine.name,
+                   "random_weights": args.random_weights},
+        "results": {},
+    }
+
+    # Los logs por imagen del pipeline distorsionarían las medidas
+    logging.disable(logging.WARNING)
+    try:
+        for size in args.batch_sizes:
+            stage_calls = {}
+            if 'preprocess' in args.stages:
+                stage_calls['preprocess'] = (
+                    lambda i, size=size: [predict.preprocess_image(images[j]) for j in batch_indices(i, size)],
+                    args.iterations)
+            if 'inference' in args.stages:
+                stage_calls['inference'] = (
+                    lambda i, size=size: predict.engine.predict(processed[batch_indices(i, size)]), args.iterations)
+            if 'shap' in args.stages:
+                for tier in args.shap_tiers:
+                    stage_calls[f'shap/{tier}'] = (
+                        lambda i, size=size, tier=tier: predict.explainer.shap_values(processed[batch_indices(i, size)], tier=tier),
+                        args.shap_iterations)
+            if 'render' in args.stages:
+                attributions = predict.explainer.shap_values(processed[:1], tier='coarse')
+                stage_calls['render'] = (
+                    lambda i, size=size: [predict.generate_shap_image(attributions, originals[j], f"static/shap/bench_{i}_{j}.bin")
+                                          for j in batch_indices(i, size)],
+                    args.iterations)
+            for concurrency in args.concurrency:
+                for stage, (call, iterations) in stage_calls.items():
+                    key = f"{stage}/b{size}/c{concurrency}"
+                    report["results"][key] = measure(call, size, concurrency, iterations, args.warmup)
+
+        if 'e2e' in args.stages:
+            for tier in args.shap_tiers:
+                for concurrency in args.concurrency:
+                    call = lambda i, tier=tier: predict.make_prediction(
+                        images[i % len(images)], async_shap=False, image_name=f"bench_{i}.png", shap_tier=tier)
+                    report["results"][f"e2e/{tier}/c{concurrency}"] = measure(
+                        call, 1, concurrency, args.shap_iterations * concurrency, args.warmup)
+    finally:
+        logging.disable(logging.NOTSET)
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["peak_rss_mb"] = peak_rss_mb()
+    for key, result in report["results"].items():
+        logging.info('%-24s p50=%8.1f ms p95=%8.1f ms p99=%8.1f ms %8.1f img/s', key, result["p50_ms"],
+                     result["p95_ms"], result["p99_ms"], result["images_per_second"])
+    logging.info('RSS máximo: %.0f MB', report["peak_rss_mb"])
+
+    regressions = []
+    if 'baseline' in output_paths:
+        with open(output_paths['baseline']) as f:
+            report["comparison"], regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+        if regressions:
+            logging.error('Regresiones frente a la referencia (tolerancia %.0f%%): %s',
+                          args.tolerance * 100, ', '.join(regressions))
+        else:
+            logging.info('Sin regresiones frente a la referencia.')
+
+    print(json.dumps(report, indent=2))
+    for name in ('output', 'save_baseline'):
+        if name in output_paths:
+            os.makedirs(os.path.dirname(output_paths[name]) or '.', exist_ok=True)
+            with open(output_paths[name], 'w') as f:
+                json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
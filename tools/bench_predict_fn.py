@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Compara la latencia de `model.predict` con la función de inferencia trazada.
+
+Para cada tamaño de lote se ejecutan iteraciones de calentamiento y luego se
+miden p50/p99 de ambas rutas:
+ - model.predict: ruta original (adaptadores de datos de Keras en cada llamada).
+ - traced: tf.function de firma fija usada por KerasEngine.
+
+Uso:
+ python tools/bench_predict_fn.py --batch-sizes 1 4 8 --iterations 50
+ python tools/bench_predict_fn.py --random-weights   # sin model.h5 ni conexión
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+# Permitir ejecutar el script desde la raíz del repositorio (python tools/<script>.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def measure(fn, batch, iterations, warmup):
+    """Latencias en milisegundos de `iterations` llamadas tras `warmup` llamadas descartadas."""
+    for _ in range(warmup):
+        fn(batch)
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn(batch)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "images_per_second": float(len(batch) * iterations / (latencies.sum() / 1000.0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Usar la arquitectura de create_model con pesos aleatorios en lugar de model.h5')
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    args = parser.parse_args()
+
+    from backend.model.model import create_model, load_trained_model
+    from backend.model.engines import KerasEngine
+
+    if args.random_weights:
+        model, err = create_model(weights=None)
+    else:
+        model, err = load_trained_model()
+    if model is None:
+        logging.error('No se pudo cargar el modelo: %s', err)
+        return
+
+    predict_path = KerasEngine(model, traced=False)
+    traced_path = KerasEngine(model, traced=True)
+
+    report = {"iterations": args.iterations, "results": {}}
+    for size in args.batch_sizes:
+        batch = np.random.uniform(-120, 150, size=(size, 224, 224, 3)).astype(np.float32)
+        # La primera llamada de cada ruta incluye el trazado: se mide aparte
+        started = time.perf_counter()
+        traced_path.predict(batch)
+        first_call_ms = (time.perf_counter() - started) * 1000.0
+        baseline = measure(predict_path.predict, batch, args.iterations, args.warmup)
+        traced = measure(traced_path.predict, batch, args.iterations, args.warmup)
+        report["results"][str(size)] = {
+            "model_predict": baseline,
+            "traced": dict(traced, first_call_ms=first_call_ms),
+            "p50_speedup": baseline["p50_ms"] / traced["p50_ms"],
+            "p99_speedup": baseline["p99_ms"] / traced["p99_ms"],
+        }
+        logging.info('Lote %d: model.predict p50=%.1f ms p99=%.1f ms | traced p50=%.1f ms p99=%.1f ms',
+                     size, baseline["p50_ms"], baseline["p99_ms"], traced["p50_ms"], traced["p99_ms"])
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
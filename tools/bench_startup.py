@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Mide el tiempo de arranque en frío de la aplicación Flask.
+
+Cada repetición se ejecuta en un proceso nuevo (imports en frío) y registra:
+ - import_s: importar el paquete `backend`.
+ - create_app_s: construir la aplicación con create_app().
+ - first_page_s: desde el inicio hasta servir `/` con código 200.
+ - ready_s: desde el inicio hasta que `/readyz` responde 200 (modelo cargado).
+
+Uso:
+ python tools/bench_startup.py --runs 3 --mode background
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Código que se ejecuta en el proceso hijo; imprime una línea JSON con los tiempos
+CHILD_SCRIPT = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import backend
+t_import = time.perf_counter()
+app = backend.create_app()
+t_app = time.perf_counter()
+client = app.test_client()
+assert client.get('/').status_code == 200
+t_page = time.perf_counter()
+heavy = sorted(m for m in ("tensorflow", "shap", "plotly") if m in sys.modules)
+deadline = t_page + float(sys.argv[1])
+ready = False
+while time.perf_counter() < deadline:
+    probe = client.get('/readyz')
+    if probe.status_code == 200:
+        ready = True
+        break
+    if probe.get_json()["model"]["status"] == "failed":
+        break
+    time.sleep(0.05)
+t_ready = time.perf_counter()
+print(json.dumps({
+    "import_s": t_import - t0,
+    "create_app_s": t_app - t_import,
+    "first_page_s": t_page - t0,
+    "ready_s": (t_ready - t0) if ready else None,
+    "heavy_modules_after_first_page": heavy,
+}))
+'''
+
+
+def run_once(mode, ready_timeout):
+    env = dict(os.environ, MODEL_LOAD_MODE=mode)
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, str(ready_timeout)],
+                          cwd=repo_root, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"El proceso de medición falló:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"min": min(values), "median": statistics.median(values), "max": max(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--mode', choices=['background', 'sync'], default='background')
+    parser.add_argument('--ready-timeout', type=float, default=300.0,
+                        help='Segundos máximos a esperar a que /readyz responda 200')
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    args = parser.parse_args()
+
+    runs = [run_once(args.mode, args.ready_timeout) for _ in range(args.runs)]
+    report = {
+        "mode": args.mode,
+        "runs": runs,
+        "summary": {key: summarize([r[key] for r in runs])
+                    for key in ("import_s", "create_app_s", "first_page_s", "ready_s")},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
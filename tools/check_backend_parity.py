@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Comprobación de paridad entre el modelo Keras y los motores de inferencia convertidos.
+
+Recorre el conjunto de validación (data/validation/<clase>/*), preprocesa cada imagen
+igual que el servidor, y compara las probabilidades y la etiqueta de decisión de cada
+motor con las del modelo Keras. Termina con código 1 si algún motor no alcanza el
+acuerdo mínimo exigido.
+
+Uso:
+ python tools/check_backend_parity.py --backends tflite_fp16 tflite_int8 savedmodel
+"""
+import argparse
+import os
+import sys
+import json
+import time
+import logging
+import numpy as np
+
+# Permitir ejecutar el script desde la raíz del repositorio (python tools/<script>.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def decision_label(prob_malignant):
+    """Etiqueta de decisión del servidor (`build_prediction`) para una probabilidad."""
+    from backend.model.predict import build_prediction
+    return build_prediction(float(prob_malignant))["decision"]
+
+
+def load_validation_set(data_dir, limit=None):
+    """Devuelve (imágenes preprocesadas, etiquetas 0/1) del directorio de validación."""
+    from backend.model.predict import preprocess_image
+
+    paths, labels = [], []
+    for label_index, label in enumerate(['benign', 'malignant']):
+        label_dir = os.path.join(data_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for name in sorted(os.listdir(label_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(label_dir, name))
+                labels.append(label_index)
+    if limit:
+        paths, labels = paths[:limit], labels[:limit]
+
+    images, kept_labels = [], []
+    for path, label in zip(paths, labels):
+        processed, _, err = preprocess_image(path)
+        if err:
+            logging.warning('Se omite %s: %s', path, err)
+            continue
+        images.append(processed[0])
+        kept_labels.append(label)
+    if not images:
+        return np.empty((0,), dtype=np.float32), np.asarray(kept_labels)
+    return np.stack(images).astype(np.float32), np.asarray(kept_labels)
+
+
+def run_engine(engine, images, batch_size):
+    """Probabilidades de malignidad y segundos totales de inferencia."""
+    outputs = []
+    started = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        outputs.append(np.asarray(engine.predict(images[i:i + batch_size])).reshape(-1))
+    return np.concatenate(outputs), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default='data/validation', help='Directorio con subcarpetas benign/ y malignant/')
+    parser.add_argument('--backends', nargs='+', default=['tflite_fp16', 'tflite_int8', 'savedmodel'])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--limit', type=int, default=None, help='Máximo de imágenes a evaluar')
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help='Fracción mínima de decisiones iguales a las del modelo Keras')
+    parser.add_argument('--force-convert', action='store_true', help='Regenerar los artefactos aunque existan')
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    args = parser.parse_args()
+
+    from backend.model.model import load_trained_model
+    from backend.model.engines import KerasEngine, build_artifact, load_inference_engine
+
+    model, _ = load_trained_model()
+    if model is None:
+        logging.error('No se pudo cargar el modelo.')
+        return 1
+
+    images, labels = load_validation_set(args.data_dir, args.limit)
+    if len(images) == 0:
+        logging.error('No se encontraron imágenes de validación en %s', args.data_dir)
+        return 1
+    logging.info('Imágenes de validación: %d', len(images))
+
+    reference, ref_seconds = run_engine(KerasEngine(model), images, args.batch_size)
+    ref_decisions = [decision_label(p) for p in reference]
+    report = {
+        "images": int(len(images)),
+        "keras": {
+            "accuracy": float(np.mean((reference >= 0.5) == labels)),
+            "images_per_second": len(images) / ref_seconds,
+        },
+        "backends": {},
+    }
+
+    failed = False
+    for backend in args.backends:
+        if args.force_convert:
+            build_artifact(model, backend, force=True)
+        engine, err = load_inference_engine(model, backend)
+        if err:
+            logging.error(err)
+            report["backends"][backend] = {"error": err}
+            failed = True
+            continue
+        probs, seconds = run_engine(engine, images, args.batch_size)
+        decisions = [decision_label(p) for p in probs]
+        agreement = float(np.mean([a == b for a, b in zip(decisions, ref_decisions)]))
+        result = {
+            "accuracy": float(np.mean((probs >= 0.5) == labels)),
+            "decision_agreement": agreement,
+            "max_abs_diff": float(np.max(np.abs(probs - reference))),
+            "mean_abs_diff": float(np.mean(np.abs(probs - reference))),
+            "images_per_second": len(images) / seconds,
+            "speedup_vs_keras": ref_seconds / seconds,
+        }
+        report["backends"][backend] = result
+        if agreement < args.min_agreement:
+            failed = True
+            logging.error('%s: acuerdo %.4f por debajo del mínimo %.4f', backend, agreement, args.min_agreement)
+        else:
+            logging.info('%s: acuerdo %.4f, diferencia máxima %.5f, %.1fx más rápido',
+                         backend, agreement, result["max_abs_diff"], result["speedup_vs_keras"])
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Generador de carga HTTP para /api/analyze.
+
+Reproduce un corpus de imágenes (análisis de piel) y de informes de sangre JSON/CSV
+a un ritmo objetivo (--rps) y con una proporción de piel dada (--mix), en bucle
+abierto: cada petición tiene su instante de envío programado y la latencia se mide
+desde ese instante, de modo que si el servidor (o el propio generador) se satura
+la espera se refleja en la latencia en lugar de reducir el ritmo de envío.
+
+Registra por tipo de análisis un histograma de latencias, p50/p95/p99, códigos de
+estado, errores y respuestas servidas desde la caché, y muestrea periódicamente
+/api/stats para seguir la profundidad de las colas del servidor (micro-lotes y
+trabajos SHAP) junto con las peticiones en vuelo del cliente.
+
+Con --spawn-server arranca el propio servidor (python -m backend.serving) con el
+modelo simulado (STUB_MODEL=1, ver backend/model/stub.py), así que no hace falta
+model.h5 ni GPU; las latencias simuladas se ajustan con --stub-latency-ms,
+--stub-latency-per-image-ms y --stub-shap-latency-ms.
+
+Uso:
+ python tools/load_test.py --spawn-server --rps 20 --duration 30 --mix 0.8 --blood datos.json
+ python tools/load_test.py --url http://127.0.0.1:8080 --images uploads --rps 5 --shap-async 0
+ python tools/load_test.py --spawn-server --http-workers 4 --rps 50 --output informe.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+BLOOD_EXTENSIONS = ('.json', '.csv')
+# Límites superiores (ms) de los cubos del histograma de latencias
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Informe de sangre por defecto si no se pasa --blood
+DEFAULT_BLOOD_REPORT = json.dumps({
+    "red_blood_cells": 5.1, "white_blood_cells": 7200, "platelets": 250000, "hemoglobin": 14.2, "glucose": 92,
+    "bacteria_presence": 0,
+}).encode('utf-8')
+
+
+def collect_files(paths, extensions):
+    """(nombre, bytes) de los archivos indicados (archivos o carpetas) con esas extensiones."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.lower().endswith(extensions))
+            files += [(n, open(os.path.join(path, n), 'rb').read()) for n in names]
+        elif path.lower().endswith(extensions):
+            files.append((os.path.basename(path), open(path, 'rb').read()))
+    return files
+
+
+def encode_multipart(fields, filename, data):
+    """Cuerpo multipart/form-data con los campos `fields` y el archivo `file`."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8') + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def get_json(url, timeout=5.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+class Recorder:
+    """Resultados de las peticiones por tipo de análisis (seguro entre hilos)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds = {}
+        self.in_flight = 0
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def record(self, kind, status, latency_ms, lag_ms, error=None, cached=False):
+        with self._lock:
+            self.in_flight -= 1
+            entry = self._kinds.setdefault(kind, {"latencies": [], "lags": [], "status": {}, "errors": {}, "cached": 0})
+            entry["latencies"].append(latency_ms)
+            entry["lags"].append(lag_ms)
+            entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+            if error:
+                entry["errors"][error] = entry["errors"].get(error, 0) + 1
+            entry["cached"] += int(cached)
+
+    def summary(self, elapsed):
+        with self._lock:
+            kinds = dict(self._kinds)
+        return {kind: summarize(entry, elapsed) for kind, entry in kinds.items()}
+
+
+def summarize(entry, elapsed):
+    """Métricas de un tipo de análisis a partir de sus latencias, códigos y errores."""
+    latencies = np.asarray(entry["latencies"])
+    failed = sum(entry["errors"].values())
+    counts = np.histogram(latencies, bins=(0,) + LATENCY_BUCKETS_MS + (np.inf,))[0]
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "error_rate": failed / len(latencies) if len(latencies) else 0.0,
+        "cached": entry["cached"],
+        "status_codes": entry["status"],
+        "errors": entry["errors"],
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        # Retraso del envío respecto a lo programado: si crece, el cuello de botella es el generador
+        "p99_send_lag_ms": float(np.percentile(entry["lags"], 99)),
+        "histogram_ms": {str(le): int(c) for le, c in zip(LATENCY_BUCKETS_MS + ('inf',), counts)},
+    }
+
+
+def send(url, kind, filename, data, form, timeout):
+    """Envía una petición de análisis. Devuelve (código HTTP o 0, error o None, servida desde caché)."""
+    fields = dict(form, analysis_type=kind)
+    body, content_type = encode_multipart(fields, filename, data)
+    request = urllib.request.Request(f"{url}/api/analyze", data=body, method='POST',
+                                      headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, payload = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, f"HTTP {e.code}", False
+    except Exception as e:
+        return 0, type(e).__name__, False
+    try:
+        result = json.loads(payload.decode('utf-8'))
+    except ValueError:
+        return status, 'respuesta no JSON', False
+    if isinstance(result, dict) and result.get("status") == 'error':
+        return status, 'status=error', False
+    return status, None, isinstance(result, dict) and bool(result.get("cached"))
+
+
+def poll_stats(url, interval, recorder, started, stop, samples):
+    """Muestrea /api/stats cada `interval` s hasta que se active `stop`."""
+    while not stop.wait(interval):
+        sample = {"t": time.perf_counter() - started, "client_in_flight": recorder.in_flight}
+        try:
+            stats = get_json(f"{url}/api/stats")
+            sample["batch_queue_depth"] = (stats.get("batching") or {}).get("queue_depth")
+            sample["shap_pending"] = (stats.get("shap") or {}).get("pending")
+        except Exception as e:
+            sample["error"] = type(e).__name__
+        samples.append(sample)
+
+
+def summarize_queues(samples):
+    """Máximo y media de cada profundidad de cola muestreada."""
+    summary = {}
+    for key in ("client_in_flight", "batch_queue_depth", "shap_pending"):
+        values = [s[key] for s in samples if s.get(key) is not None]
+        if values:
+            summary[key] = {"max": max(values), "mean": float(np.mean(values))}
+    return summary
+
+
+def spawn_server(args, workdir):
+    """
+    Arranca `python -m backend.serving` con el modelo simulado y espera a /readyz.
+    El servidor se ejecuta en `workdir`, donde escribe sus artefactos SHAP y su caché.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, STUB_MODEL='1', STUB_LATENCY_MS=str(args.stub_latency_ms),
+               STUB_LATENCY_PER_IMAGE_MS=str(args.stub_latency_per_image_ms),
+               STUB_SHAP_LATENCY_MS=str(args.stub_shap_latency_ms))
+    command = [sys.executable, '-m', 'backend.serving', '--host', '127.0.0.1', '--port', str(args.port),
+               '--http-workers', str(args.http_workers), '--inference-workers', '1']
+    server = subprocess.Popen(command, cwd=workdir, env=env)
+    url = f"http://127.0.0.1:{args.port}"
+    deadline = time.perf_counter() + args.startup_timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"El servidor terminó durante el arranque (código {server.returncode}).")
+        try:
+            if get_json(f"{url}/readyz", timeout=1.0).get("status") == 'ready':
+                return server, url
+        except Exception:
+            pass
+        time.sleep(0.5)
+    stop_server(server)
+    raise TimeoutError(f"El servidor no estuvo listo en {args.startup_timeout} s.")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def run_load(url, images, reports, args):
+    """Envía la carga programada y devuelve el informe."""
+    rng = np.random.default_rng(args.seed)
+    total = int(args.rps * args.duration)
+    if args.arrival == 'poisson':
+        offsets = np.cumsum(rng.exponential(1.0 / args.rps, size=total))
+    else:
+        offsets = np.arange(total) / args.rps
+    is_skin = rng.uniform(size=total) < args.mix if images and reports else np.full(total, bool(images))
+    skin_form = {k: v for k, v in (('shap_async', args.shap_async), ('shap_tier', args.shap_tier)) if v is not None}
+
+    recorder = Recorder()
+    samples = []
+    stop = threading.Event()
+
+    def fire(i, scheduled):
+        lag_ms = (time.perf_counter() - scheduled) * 1000.0
+        if is_skin[i]:
+            kind, (filename, data), form = 'piel', images[i % len(images)], skin_form
+        else:
+            kind, (filename, data), form = 'sangre', reports[i % len(reports)], {}
+        status, error, cached = send(url, kind, filename, data, form, args.timeout)
+        recorder.record(kind, status, (time.perf_counter() - scheduled) * 1000.0, lag_ms, error, cached)
+
+    logging.info(f"Enviando {total} peticiones a {url} ({args.rps} rps, {args.duration} s, {args.mix:.0%} piel)")
+    started = time.perf_counter()
+    poller = threading.Thread(target=poll_stats, args=(url, args.stats_interval, recorder, started, stop, samples),
+                              daemon=True)
+    poller.start()
+    with ThreadPoolExecutor(max_workers=args.max_in_flight, thread_name_prefix='load') as pool:
+        for i, offset in enumerate(offsets):
+            scheduled = started + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            recorder.started()
+            pool.submit(fire, i, scheduled)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    poller.join()
+
+    return {
+        "config": {"url": url, "rps": args.rps, "duration_s": args.duration, "mix": args.mix,
+                   "arrival": args.arrival, "max_in_flight": args.max_in_flight, "shap_async": args.shap_async,
+                   "shap_tier": args.shap_tier, "images": len(images), "blood_reports": len(reports),
+                   "stub_server": args.spawn_server},
+        "elapsed_s": elapsed,
+        "achieved_rps": total / elapsed if elapsed else 0.0,
+        "results": recorder.summary(elapsed),
+        "queues": summarize_queues(samples),
+        "queue_samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='Servidor a probar (sin --spawn-server)')
+    parser.add_argument('--images', nargs='+', default=[os.path.join(ROOT, 'uploads')],
+                        help='Imágenes o carpetas de imágenes para los análisis de piel')
+    parser.add_argument('--blood', nargs='+', default=[], help='Informes de sangre JSON/CSV o carpetas con ellos')
+    parser.add_argument('--rps', type=float, default=10.0, help='Peticiones por segundo objetivo')
+    parser.add_argument('--duration', type=float, default=30.0, help='Duración de la prueba (s)')
+    parser.add_argument('--mix', type=float, default=0.8, help='Fracción de peticiones de piel (el resto, sangre)')
+    parser.add_argument('--arrival', choices=['uniform', 'poisson'], default='poisson')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='Conexiones simultáneas máximas del cliente')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Tiempo máximo por petición (s)')
+    parser.add_argument('--shap-async', choices=['0', '1'], help='Campo shap_async de las peticiones de piel')
+    parser.add_argument('--shap-tier', choices=['coarse', 'fast', 'full'])
+    parser.add_argument('--stats-interval', type=float, default=0.5, help='Intervalo de muestreo de /api/stats (s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON')
+    parser.add_argument('--spawn-server', action='store_true',
+                        help='Arrancar python -m backend.serving con el modelo simulado (STUB_MODEL=1)')
+    parser.add_argument('--port', type=int, default=8097)
+    parser.add_argument('--http-workers', type=int, default=2)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--stub-latency-ms', type=float, default=30.0)
+    parser.add_argument('--stub-latency-per-image-ms', type=float, default=10.0)
+    parser.add_argument('--stub-shap-latency-ms', type=float, default=500.0)
+    args = parser.parse_args()
+
+    images = collect_files(args.images, IMAGE_EXTENSIONS)
+    reports = collect_files(args.blood, BLOOD_EXTENSIONS) or [('informe.json', DEFAULT_BLOOD_REPORT)]
+    if args.mix > 0 and not images:
+        logging.error(f"No hay imágenes en {args.images}")
+        return 1
+    if args.mix <= 0:
+        images = []
+    if args.mix >= 1:
+        reports = []
+
+    server, workdir = None, None
+    url = args.url.rstrip('/')
+    try:
+        if args.spawn_server:
+            workdir = tempfile.mkdtemp(prefix='load_test_')
+            server, url = spawn_server(args, workdir)
+        report = run_load(url, images, reports, args)
+    finally:
+        if server is not None:
+            stop_server(server)
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for kind, result in report["results"].items():
+        logging.info(f"{kind}: {result['requests']} peticiones, {result['throughput_rps']:.1f} rps, "
+                     f"p50={result['p50_ms']:.0f} ms p95={result['p95_ms']:.0f} ms p99={result['p99_ms']:.0f} ms, "
+                     f"errores={result['error_rate']:.1%}, caché={result['cached']}")
+    for name, queue in report["queues"].items():
+        logging.info(f"{name}: máx={queue['max']} media={queue['mean']:.1f}")
+
+    print(json.dumps({k: v for k, v in report.items() if k != 'queue_samples'}, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
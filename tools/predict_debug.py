@@ -8,22 +8,129 @@ Cargas:
 
 Uso:
  python tools\predict_debug.py --image uploads\imagen_piel1.png
+ python tools\predict_debug.py --folder data\validation\malignant --save-shap --shap-tier fast
+
+En modo carpeta, las imágenes se preprocesan en paralelo, la inferencia se hace por
+lotes y, con --save-shap, cada lote se explica con una sola llamada al explicador
+(backend.model.predict.explain_predictions). Sólo se preprocesa un lote por delante
+del que se está analizando, así que la memoria no crece con el tamaño de la carpeta.
+
+Los artefactos SHAP se guardan como static/shap/shap_debug_<imagen>.bin en ambos modos.
 """
 import argparse
 import os
+import sys
+import json
+import time
 import logging
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Permitir ejecutar el script desde la raíz del repositorio (python tools/<script>.py)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Ajustar path si es necesario (ejecutar desde repo root debería funcionar)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def run_folder(args):
+    """Diagnóstico por lotes de todas las imágenes de una carpeta."""
+    from backend.model.model import load_trained_model
+    from backend.model import predict
+
+    paths = sorted(os.path.join(args.folder, name) for name in os.listdir(args.folder)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        logging.error('No hay imágenes en %s', args.folder)
+        return
+
+    logging.info('Cargando modelo...')
+    model, class_names = load_trained_model()
+    if model is None:
+        logging.error('No se pudo cargar el modelo.')
+        return
+    predict.load_model_resources(model, class_names)
+
+    logging.info('Analizando %d imágenes...', len(paths))
+    report = {"images": [], "inference_seconds": 0.0, "shap_seconds": 0.0, "shap_tier": args.shap_tier}
+    batches = [paths[start:start + args.batch_size] for start in range(0, len(paths), args.batch_size)]
+    valid = 0
+    with ThreadPoolExecutor(max_workers=predict.PREPROCESS_WORKERS) as pool:
+        upcoming = pool.map(predict.preprocess_image, batches[0])
+        for index, batch_paths in enumerate(batches):
+            preprocessed = list(upcoming)
+            if index + 1 < len(batches):
+                # Preprocesar el lote siguiente mientras se analiza éste
+                upcoming = pool.map(predict.preprocess_image, batches[index + 1])
+            chunk = []
+            for path, (processed, original, err) in zip(batch_paths, preprocessed):
+                if err:
+                    logging.error('%s: %s', path, err)
+                    report["images"].append({"image": path, "error": err})
+                else:
+                    chunk.append((path, processed, original))
+            if chunk:
+                valid += len(chunk)
+                _analyze_chunk(predict, chunk, args, report)
+
+    if valid:
+        logging.info('Inferencia: %.1f imágenes/s', valid / max(report["inference_seconds"], 1e-9))
+        if args.save_shap:
+            logging.info('SHAP (%s): %.2f imágenes/s', args.shap_tier, valid / max(report["shap_seconds"], 1e-9))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info('Informe guardado en %s', args.output)
+
+
+def _debug_base_name(path):
+    """Nombre base de los artefactos SHAP de diagnóstico (ver `shap_filename_for`)."""
+    return 'debug_' + os.path.splitext(os.path.basename(path))[0]
+
+
+def _analyze_chunk(predict, chunk, args, report):
+    """Inferencia (y SHAP, con --save-shap) de un lote de (ruta, preprocesada, original)."""
+    started = time.perf_counter()
+    probs = np.asarray(predict.engine.predict(np.concatenate([p for _, p, _ in chunk]))).reshape(len(chunk), -1)
+    report["inference_seconds"] += time.perf_counter() - started
+    predictions = [predict.build_prediction(float(row[0])) for row in probs]
+
+    shap_results = [(None, None)] * len(chunk)
+    if args.save_shap:
+        items = [(processed, original, _debug_base_name(path), prediction["main_diagnosis"]["name"])
+                 for (path, processed, original), prediction in zip(chunk, predictions)]
+        started = time.perf_counter()
+        shap_results = predict.explain_predictions(items, tier=args.shap_tier)
+        report["shap_seconds"] += time.perf_counter() - started
+
+    for (path, _, _), prediction, (shap_url, explanation) in zip(chunk, predictions, shap_results):
+        logging.info('%s: maligno=%0.4f decisión=%s%s', os.path.basename(path),
+                     prediction["probabilities"]["maligno"], prediction["decision"],
+                     f' shap={shap_url}' if shap_url else '')
+        report["images"].append({"image": path, "decision": prediction["decision"],
+                                 "probabilities": prediction["probabilities"],
+                                 "shap_plot_url": shap_url, "explanation": explanation})
+
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--image', required=True, help='Ruta a la imagen a diagnosticar')
-    parser.add_argument('--save-shap', action='store_true', help='Intentar generar y guardar JSON SHAP')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help='Ruta a la imagen a diagnosticar')
+    source.add_argument('--folder', help='Carpeta de imágenes a diagnosticar por lotes')
+    parser.add_argument('--save-shap', action='store_true', help='Intentar generar y guardar el artefacto SHAP')
+    parser.add_argument('--shap-tier', default='full', choices=['coarse', 'fast', 'full'],
+                        help='Nivel de la explicación SHAP en modo carpeta')
+    parser.add_argument('--batch-size', type=int, default=8, help='Imágenes por lote en modo carpeta')
+    parser.add_argument('--output', help='Ruta opcional para guardar el informe JSON (modo carpeta)')
     args = parser.parse_args()
 
+    if args.folder:
+        run_folder(args)
+        return
+
     img_path = args.image
     if not os.path.exists(img_path):
         logging.error('Imagen no encontrada: %s', img_path)
@@ -31,7 +138,7 @@ def main():
 
     # Importar dinámicamente para evitar problemas si tensorflow no está cargado
     from backend.model.model import load_trained_model
-    from backend.model.predict import preprocess_image, generate_shap_image, LOW_THRESHOLD, HIGH_THRESHOLD
+    from backend.model.predict import preprocess_image, generate_shap_image, shap_filename_for, LOW_THRESHOLD, HIGH_THRESHOLD
 
     logging.info('Cargando modelo...')
     model, class_names = load_trained_model()
@@ -77,9 +184,8 @@ def main():
     if args.save_shap:
         try:
             os.makedirs('static/shap', exist_ok=True)
-            base_name = os.path.splitext(os.path.basename(img_path))[0]
-            out = os.path.join('static/shap', f'debug_shap_{base_name}.json')
-            logging.info('Intentando generar SHAP JSON en %s', out)
+            out = os.path.join('static/shap', shap_filename_for(_debug_base_name(img_path)))
+            logging.info('Intentando generar el artefacto SHAP en %s', out)
             # Llama a generate_shap_image: acepta (shap_values, image_original, output_path)
             # Necesitamos un explainer: reutilizamos el code de predict.py para crear explainer si disponible
             from backend.model.predict import explainer, load_model_resources
@@ -100,7 +206,7 @@ def main():
                 if err:
                     logging.error('Error al generar SHAP: %s', err)
                 else:
-                    logging.info('SHAP JSON guardado en: %s', out)
+                    logging.info('Artefacto SHAP guardado en: %s', out)
         except Exception:
             logging.exception('Fallo al generar SHAP')
 
@@ -2,7 +2,7 @@
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from backend.model.training.data import make_dataset
 import logging
 import os
 
@@ -14,9 +14,13 @@ IMG_WIDTH = 224
 BATCH_SIZE = 32 # Number of images to process in a batch
 EPOCHS = 15     # Number of times to iterate over the entire dataset
 
-TRAIN_DIR = 'data/train'
-VALIDATION_DIR = 'data/validation'
+# Either the prepared JPEG folders or the shards exported by `prepare_data.py --export`
+# (e.g. TRAIN_DIR=data/shards/train)
+TRAIN_DIR = os.getenv('TRAIN_DIR', 'data/train')
+VALIDATION_DIR = os.getenv('VALIDATION_DIR', 'data/validation')
 MODEL_SAVE_PATH = 'backend/model/model.h5'
+# Decoded-image cache for the tf.data pipeline: 'memory', a file path prefix or 'none'
+DATA_CACHE = os.getenv('TRAIN_DATA_CACHE', 'memory')
 
 def create_model():
     """
@@ -60,37 +64,27 @@ def train_model():
     """
     Trains the model using data from the data/train and data/validation directories.
     """
-    # 1. Create Data Generators
-    # Rescale pixel values from [0, 255] to [0, 1]
-    train_datagen = ImageDataGenerator(rescale=1./255)
-    validation_datagen = ImageDataGenerator(rescale=1./255)
-
-    train_generator = train_datagen.flow_from_directory(
-        TRAIN_DIR,
-        target_size=(IMG_WIDTH, IMG_HEIGHT),
-        batch_size=BATCH_SIZE,
-        class_mode='categorical' # for categorical_crossentropy
-    )
-
-    validation_generator = validation_datagen.flow_from_directory(
-        VALIDATION_DIR,
-        target_size=(IMG_WIDTH, IMG_HEIGHT),
-        batch_size=BATCH_SIZE,
-        class_mode='categorical'
-    )
+    # 1. Create tf.data pipelines (parallel decode, cache and prefetch)
+    # Pixel values are rescaled from [0, 255] to [0, 1] inside the pipeline
+    datasets = {}
+    for split, directory in (('train', TRAIN_DIR), ('validation', VALIDATION_DIR)):
+        cache = None if DATA_CACHE == 'none' else (DATA_CACHE if DATA_CACHE == 'memory' else f"{DATA_CACHE}_{split}")
+        result, error = make_dataset(directory, (IMG_HEIGHT, IMG_WIDTH, 3), BATCH_SIZE,
+                                     label_mode='categorical', # for categorical_crossentropy
+                                     shuffle=(split == 'train'), cache=cache)
+        if error:
+            logging.error(error)
+            return
+        datasets[split] = result[0]
 
     # 2. Create and train the model
     model = create_model()
 
     logging.info("Starting model training...")
     history = model.fit(
-        train_generator,
+        datasets['train'],
         epochs=EPOCHS,
-        validation_data=validation_generator,
-        # Steps per epoch = Total Train Images / Batch Size
-        steps_per_epoch=train_generator.samples // BATCH_SIZE,
-        # Validation Steps = Total Validation Images / Batch Size
-        validation_steps=validation_generator.samples // BATCH_SIZE
+        validation_data=datasets['validation']
     )
 
     logging.info("Model training completed.")